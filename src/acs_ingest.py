@@ -0,0 +1,125 @@
+# This file contains functions and methods that are used to read ACS district demographics
+import os
+import glob
+import json
+import hashlib
+import pandas as pd
+# csv / Parquet datasets
+from storage import read_table, write_table, table_exists
+
+
+
+## ACS specs
+
+# ACS tables used for district demographics: folder of the raw files and {ACS variable: (column name, dtype)}
+acs_specs = [{"table": "S1701", "folder": "poverty", "variables": {"S1701_C03_001E": ("Poverty (%)", "float64")}},
+             {"table": "B29004", "folder": "income", "variables": {"B29004_001E": ("Median_Household_Income", "int64")}},
+             {"table": "B01001", "folder": "population", "variables": {"B01001_001E": ("Pop_Total", "int64"),
+                                                                       "B01001_002E": ("Pop_M", "int64"),
+                                                                       "B01001_026E": ("Pop_F", "int64")}}]
+
+# ACS estimates of each year: 1-year for 2018, 5-year for 2020 (1-year estimates are not available for 2020)
+# other years use the raw files that are present, 1-year estimates first
+acs_estimates = {2018: "1Y", 2020: "5Y"}
+estimate_preference = ["1Y", "5Y", "3Y"]
+
+# version of read_acs_table (geography filter, columns, coercion), bump it when it changes so cached tables are rebuilt
+ACS_INGEST_VERSION = 2
+
+# state FIPS codes (GEO_ID = 5001600US + state FIPS + district)
+state_fips = {"AL": "01", "AK": "02", "AZ": "04", "AR": "05", "CA": "06", "CO": "08", "CT": "09", "DE": "10", "FL": "12", "GA": "13",
+              "HI": "15", "ID": "16", "IL": "17", "IN": "18", "IA": "19", "KS": "20", "KY": "21", "LA": "22", "ME": "23", "MD": "24",
+              "MA": "25", "MI": "26", "MN": "27", "MS": "28", "MO": "29", "MT": "30", "NE": "31", "NV": "32", "NH": "33", "NJ": "34",
+              "NM": "35", "NY": "36", "NC": "37", "ND": "38", "OH": "39", "OK": "40", "OR": "41", "PA": "42", "RI": "44", "SC": "45",
+              "SD": "46", "TN": "47", "TX": "48", "UT": "49", "VT": "50", "VA": "51", "WA": "53", "WV": "54", "WI": "55", "WY": "56"}
+
+# raw ACS file of a table and year, e.g. "poverty/ACSST1Y2018.S1701-Data.csv"
+def acs_path(raw_dir, spec, year):
+    # subject tables (S) and detailed tables (B) have different file prefixes
+    prefix = "ST" if spec["table"].startswith("S") else "DT"
+    if year in acs_estimates:
+        return os.path.join(raw_dir, spec["folder"], f"ACS{prefix}{acs_estimates[year]}{year}.{spec['table']}-Data.csv")
+
+    # the estimate of the files that are present, e.g. ACSST1Y2022.S1701-Data.csv or ACSST5Y2022.S1701-Data.csv
+    paths = {os.path.basename(path)[len(f"ACS{prefix}"):][:2]: path
+             for path in glob.glob(os.path.join(raw_dir, spec["folder"], f"ACS{prefix}*{year}.{spec['table']}-Data.csv"))}
+    for estimate in estimate_preference:
+        if estimate in paths:
+            return paths[estimate]
+    raise FileNotFoundError(f"no ACS {spec['table']} file of {year} in {os.path.join(raw_dir, spec['folder'])}")
+
+# hash of a spec and the ingest version, cached tables of other specs are not used
+def spec_hash(spec):
+    return hashlib.sha256(json.dumps({"spec": spec, "version": ACS_INGEST_VERSION}, sort_keys = True).encode()).hexdigest()[:12]
+
+
+
+## ingest
+
+# column dtype of a spec dtype: integer columns are nullable (Int64), a cell that is not a number is missing
+def column_dtype(dtype):
+    return "Int64" if dtype == "int64" else dtype
+
+# numeric ACS values, cells such as "-", "N", "(X)" or "250,000+" become missing and are reported
+def coerce_numeric(values, dtype, name, path):
+    numbers = pd.to_numeric(values, errors = "coerce")
+    coerced = values[numbers.isna() & values.notna()]
+    if len(coerced) > 0:
+        examples = sorted(coerced.unique())[:5]
+        print(f"Warning - {os.path.basename(path)}: {len(coerced)} rows of {name} are not numbers and are missing, e.g. {examples}")
+    return numbers.astype(column_dtype(dtype))
+
+# district rows of one ACS table and year for all states: State, District + the spec's columns
+def read_acs_table(path, spec):
+    variables = spec["variables"]
+    # only GEO_ID and the wanted variables are read (as text, converted below), the second row is the column description
+    data = pd.read_csv(path, skiprows = [1], usecols = ["GEO_ID"] + list(variables), encoding = "utf-8-sig", dtype = str)
+
+    # geography filter: congressional districts (summary level 500), GEO_ID ends with state FIPS + district
+    data = data[data["GEO_ID"].str.startswith("500") & data["GEO_ID"].str[-2:].str.isdigit()]
+    # the files repeat the districts, keep the first row of each district
+    data = data.drop_duplicates("GEO_ID", keep = "first")
+
+    fips_state = {fips: state for state, fips in state_fips.items()}
+    districts = pd.DataFrame({"State": data["GEO_ID"].str[-4:-2].map(fips_state),
+                              # at-large district "00" = district 1
+                              "District": data["GEO_ID"].str[-2:].astype(int).replace(0, 1)})
+    for variable, (name, dtype) in variables.items():
+        districts[name] = coerce_numeric(data[variable], dtype, name, path)
+    return districts.dropna(subset = ["State"]).reset_index(drop = True)
+
+# the file read_table would read for a cached table
+def cache_file(path):
+    parquet = os.path.splitext(path)[0] + ".parquet"
+    return parquet if os.path.exists(parquet) else path
+
+# processed district table of one ACS table and year, cached until the raw file, the spec or the ingest version changes
+def load_acs_table(raw_dir, spec, year, cache_dir):
+    path = acs_path(raw_dir, spec, year)
+    # the raw file's estimate and the spec are part of the cache file name
+    estimate = os.path.basename(path).split(".")[0][5:7]
+    cached_path = os.path.join(cache_dir, f"{spec['table']}_{year}_{estimate}_{spec_hash(spec)}.csv")
+    if table_exists(cached_path) and os.path.getmtime(cache_file(cached_path)) >= os.path.getmtime(path):
+        # csv does not keep the nullable dtypes
+        return read_table(cached_path).astype({name: column_dtype(dtype) for name, dtype in spec["variables"].values()})
+
+    districts = read_acs_table(path, spec)
+    write_table(districts, cached_path)
+    return districts
+
+# district demographics of all states and years: {(state, year): DataFrame}
+def district_demographics(states, years, raw_dir = "../data/raw/District_Demographics", cache_dir = "../data/processed/District_Demographics/cache"):
+    tables = {year: [load_acs_table(raw_dir, spec, year, cache_dir) for spec in acs_specs] for year in years}
+
+    demographics = {}
+    for year in years:
+        # merge all tables of the year on (State, District)
+        merged = tables[year][0]
+        for table in tables[year][1:]:
+            merged = merged.merge(table, on = ["State", "District"], how = "outer")
+        merged["Sex Ratio"] = merged["Pop_M"] / merged["Pop_F"]
+
+        for state in states:
+            state_data = merged[merged["State"] == state].drop(columns = "State")
+            demographics[(state, year)] = state_data.sort_values("District").reset_index(drop = True)
+    return demographics
@@ -1,105 +1,89 @@
 # This file contains functions and methods that are used to analyze data
 import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 # OLS
-import statsmodels.formula.api as smf
 from stargazer.stargazer import Stargazer
+from ols_engine import fit_ols, model_matrices, check_statsmodels
+# bootstrap & permutation p-values
+from resampling import resampling_pvalue
+# csv / Parquet datasets
+from storage import read_table, write_table
+# analysis features
+from features import build_features, age_labels
+# summary statistics cube
+from cube import build_cube, save_cube, cube_rows, cube_subsets, summarize, score_groups, score_group_keys
 
 
 
 ## descriptive statistics
-os.makedirs("../results/descriptive_statistics", exist_ok = True)
-
-# read the data
-CA_final = pd.read_csv("../data/processed/CA_final.csv", encoding = "utf-8")
-CA_final = CA_final[["Year", "District", "Party", "Incumbent", "Gender", "Age", "Edu", "score", "score_CNN", "vote_share", "ln_vote_share", "Poverty (%)", "Median_Household_Income", "Pop_Total", "Sex Ratio"]]
-
-# drop sample with missing value
-CA_final = CA_final.dropna()
-# age square
-CA_final["Agesq"] = CA_final["Age"] ** 2
-# Education Level
-CA_final["Edu_Level"] = CA_final["Edu_Level"] = CA_final["Edu"].map({"Master": 3,
-                                                                     "Doctor": 3,
-                                                                     "Bachelor": 2,
-                                                                     "High_school": 1})
-CA_final["Master & Above"] = ((CA_final["Edu"] == "Master") | (CA_final["Edu"] == "Doctor")).astype(int)
-CA_final["College"] = (CA_final["Edu"] == "Bachelor").astype(int)
-CA_final["High School"] = (CA_final["Edu"] == "High_school").astype(int)
-# Party
-CA_final["Republican"] = (CA_final["Party"] == "Republican").astype(int)
-CA_final["Democratic"] = (CA_final["Party"] == "Democratic").astype(int)
-CA_final["Other"] = ((CA_final["Party"] == "Green") | (CA_final["Party"] == "No party preference")).astype(int)
-# city_type
-def city_type(row):
-    if row["Year"] == 2018:
-        if row["Median_Household_Income"] >= 100000 and row["Pop_Total"] >= 760000:
-            return "urban"
-        elif row["Median_Household_Income"] < 75000 and row["Pop_Total"] < 720000:
-            return "rural"
-        else:
-            return "transition"
-    else:
-        if row["Median_Household_Income"] >= 100000 and row["Pop_Total"] >= 760000:
-            return "urban"
-        elif row["Median_Household_Income"] < 75000 and row["Pop_Total"] < 730000:
-            return "rural"
-        else:
-            return "transition"
-CA_final["city_type"] = CA_final.apply(city_type, axis = 1)
-# dummy
-categorical_vars = ["Incumbent", "Gender", "city_type"]
-for var in categorical_vars:
-    dummies = pd.get_dummies(CA_final[var], prefix = var, prefix_sep = "_").astype(int)
-    CA_final = pd.concat([CA_final, dummies], axis = 1)
-# save
-CA_final.to_csv("../results/alldata_CA.csv")
-
-def calculate_statistics(data, variables):
-    stats = data[variables].agg(["mean", "std", "min", "max"]).transpose()
+
+# columns of the final dataset used in the analysis
+columns = ["Year", "District", "Party", "Incumbent", "Gender", "Age", "Edu", "score", "score_CNN", "vote_share", "ln_vote_share", "Poverty (%)", "Median_Household_Income", "Pop_Total", "Sex Ratio"]
+
+# analysis dataset: complete samples with age square, education level, party, city_type & dummies, saved as alldata_CA.csv
+def prepare_data(path = "../data/processed/CA_final.csv", output_path = "../results/alldata_CA.csv"):
+    # read the data
+    CA_final = read_table(path, columns = columns)[columns]
+
+    # drop sample with missing value
+    CA_final = CA_final.dropna()
+    # features (features.py), Age_Group is only used by the grouped statistics and not saved
+    CA_final = build_features(CA_final)
+    # save
+    write_table(CA_final.drop(columns = "Age_Group"), output_path, index = True, keep_csv = True)
+    return CA_final
+
+# statistics of the variables over the cells of the cube selected by rows (None: all cells)
+def calculate_statistics(cube, variables, rows = None):
+    summary = summarize(cube, variables, rows)
+    stats = pd.DataFrame([summary[variable].iloc[0][["Mean", "Std", "Min", "Max"]] for variable in variables], index = variables).astype(float)
     stats = stats.round(4)
-    stats.columns = ["Mean", "Std", "Min", "Max"]
-    stats.loc["N", :] = len(data)
+    stats.loc["N", :] = summary["rows"].iloc[0]
     return stats
 
-# descriptive statistics (by gender)
-variables = ["vote_share", "ln_vote_share", "score", "score_CNN", 
-             "Republican", "Democratic", "Other",
-             "Incumbent_0", "Incumbent_1",
-             "Age", "Master & Above", "College", "High School", 
-             "city_type_rural", "city_type_transition", "city_type_urban",
-             "Poverty (%)", "Median_Household_Income", "Pop_Total", "Sex Ratio"]
-# all data
-stats_total = calculate_statistics(CA_final, variables)
-# Gender_M == 1
-stats_male = calculate_statistics(CA_final[CA_final["Gender_M"] == 1], variables)
-# Gender_F == 1
-stats_female = calculate_statistics(CA_final[CA_final["Gender_F"] == 1], variables)
-# table
-all_stats = pd.concat([stats_total, stats_male, stats_female], keys = ["Total", "Male", "Female"], axis = 1)
-# save
-all_stats.to_csv("../results/descriptive_statistics/descriptive_statistics_CA.csv")
-
-# descriptive statistics (by party)
-variables = ["vote_share", "ln_vote_share", "score", "score_CNN", 
-             "Gender_M", "Gender_F",
-             "Incumbent_0", "Incumbent_1",
-             "Age", "Master & Above", "College", "High School", 
-             "city_type_rural", "city_type_transition", "city_type_urban",
-             "Poverty (%)", "Median_Household_Income", "Pop_Total", "Sex Ratio"]
-# all data
-stats_total = calculate_statistics(CA_final, variables)
-# Republican == 1
-stats_Rep = calculate_statistics(CA_final[CA_final["Republican"] == 1], variables)
-# Democratic == 1
-stats_Democ = calculate_statistics(CA_final[CA_final["Democratic"] == 1], variables)
-# Other == 1
-stats_Other = calculate_statistics(CA_final[CA_final["Other"] == 1], variables)
-# table
-all_stats = pd.concat([stats_total, stats_Rep, stats_Democ, stats_Other], keys = ["Total", "Republican", "Democratic", "Other"], axis = 1)
-# save
-all_stats.to_csv("../results/descriptive_statistics/descriptive_stats_CA.csv")
+# descriptive statistics by gender and by party
+def descriptive_statistics(cube):
+    os.makedirs("../results/descriptive_statistics", exist_ok = True)
+
+    # descriptive statistics (by gender)
+    variables = ["vote_share", "ln_vote_share", "score", "score_CNN", 
+                 "Republican", "Democratic", "Other",
+                 "Incumbent_0", "Incumbent_1",
+                 "Age", "Master & Above", "College", "High School", 
+                 "city_type_rural", "city_type_transition", "city_type_urban",
+                 "Poverty (%)", "Median_Household_Income", "Pop_Total", "Sex Ratio"]
+    # all data
+    stats_total = calculate_statistics(cube, variables)
+    # Gender_M == 1
+    stats_male = calculate_statistics(cube, variables, cube_rows(cube, *cube_subsets["Gender_M"]))
+    # Gender_F == 1
+    stats_female = calculate_statistics(cube, variables, cube_rows(cube, *cube_subsets["Gender_F"]))
+    # table
+    all_stats = pd.concat([stats_total, stats_male, stats_female], keys = ["Total", "Male", "Female"], axis = 1)
+    # save
+    all_stats.to_csv("../results/descriptive_statistics/descriptive_statistics_CA.csv")
+
+    # descriptive statistics (by party)
+    variables = ["vote_share", "ln_vote_share", "score", "score_CNN", 
+                 "Gender_M", "Gender_F",
+                 "Incumbent_0", "Incumbent_1",
+                 "Age", "Master & Above", "College", "High School", 
+                 "city_type_rural", "city_type_transition", "city_type_urban",
+                 "Poverty (%)", "Median_Household_Income", "Pop_Total", "Sex Ratio"]
+    # all data
+    stats_total = calculate_statistics(cube, variables)
+    # Republican == 1
+    stats_Rep = calculate_statistics(cube, variables, cube_rows(cube, *cube_subsets["Republican"]))
+    # Democratic == 1
+    stats_Democ = calculate_statistics(cube, variables, cube_rows(cube, *cube_subsets["Democratic"]))
+    # Other == 1
+    stats_Other = calculate_statistics(cube, variables, cube_rows(cube, *cube_subsets["Other"]))
+    # table
+    all_stats = pd.concat([stats_total, stats_Rep, stats_Democ, stats_Other], keys = ["Total", "Republican", "Democratic", "Other"], axis = 1)
+    # save
+    all_stats.to_csv("../results/descriptive_statistics/descriptive_stats_CA.csv")
 
 
 
@@ -112,105 +96,108 @@ candidate_features = ["Gender_M", "Gender_F",
                       "Incumbent_0", "Incumbent_1", 
                       "city_type_rural", "city_type_transition", "city_type_urban"]
 
-# age groups
-CA_final["Age_Group"] = pd.cut(CA_final["Age"], bins = [0, 40, 50, 60, 70, 100], labels = ["<40", "40-50", "50-60", "60-70", ">70"])
-candidate_features += ["Age_Group"]
-
-def calculate_group_statistics(data, feature):
+# score statistics of the candidates with a feature (cube_subsets), or of each age group
+def calculate_group_statistics(cube, feature):
     if feature == "Age_Group":
-        grouped = data.groupby("Age_Group", observed = False)["score"]
-        grouped_CNN = data.groupby("Age_Group", observed = False)["score_CNN"]
+        summary = summarize(cube, ["score", "score_CNN"], by = cube.index.get_level_values("Age_Group"), levels = age_labels)
+        grouped, grouped_CNN = summary["score"], summary["score_CNN"]
     else:
-        grouped = data[data[feature] == 1]["score"]
-        grouped_CNN = data[data[feature] == 1]["score_CNN"]
+        summary = summarize(cube, ["score", "score_CNN"], rows = cube_rows(cube, *cube_subsets[feature]))
+        # the only group, column by column to keep N an integer
+        grouped, grouped_CNN = [{name: column.iloc[0] for name, column in summary[score].items()} for score in ["score", "score_CNN"]]
     
     # mean, std, N
-    mean = round(grouped.mean(), 4)
-    std = round(grouped.std(), 4)
-    count = grouped.count()
-    mean_CNN = round(grouped_CNN.mean(), 4)
-    std_CNN = round(grouped_CNN.std(), 4)
-    count_CNN = grouped_CNN.count()
+    mean = round(grouped["Mean"], 4)
+    std = round(grouped["Std"], 4)
+    count = grouped["N"]
+    mean_CNN = round(grouped_CNN["Mean"], 4)
+    std_CNN = round(grouped_CNN["Std"], 4)
+    count_CNN = grouped_CNN["N"]
     
     return {"Mean": mean, "Std": std, "N": count, "Mean_CNN": mean_CNN, "Std_CNN": std_CNN, "N_CNN": count_CNN,}
 
-# table
-CA_results = []
-for feature in candidate_features:
-    stats = calculate_group_statistics(CA_final, feature)
-    if feature == "Age_Group":
-        for group in stats["Mean"].index:
-            CA_results.append([f"Age: {group}", stats["Mean"][group], stats["Std"][group], stats["N"][group], stats["Mean_CNN"][group], stats["Std_CNN"][group], stats["N_CNN"][group]])
-    else:
-        CA_results.append([feature, stats["Mean"], stats["Std"], stats["N"], stats["Mean_CNN"], stats["Std_CNN"], stats["N_CNN"]])
-# convert to DataFrame
-CA_results_df = pd.DataFrame(CA_results, columns = ["Feature", "Score (Mean)", "Score (Std)", "N", "Score_CNN (Mean)", "Score_CNN (Std)", "N_CNN"])
+# table of score statistics by candidate feature and age group
+def grouped_score_statistics(cube):
+    os.makedirs("../results/descriptive_statistics", exist_ok = True)
 
-# save
-CA_results_df.to_csv("../results/descriptive_statistics/grouped_score_statistics_CA.csv", index = False)
+    # age groups
+    features = candidate_features + ["Age_Group"]
+
+    # table
+    CA_results = []
+    for feature in features:
+        stats = calculate_group_statistics(cube, feature)
+        if feature == "Age_Group":
+            for group in stats["Mean"].index:
+                CA_results.append([f"Age: {group}", stats["Mean"][group], stats["Std"][group], stats["N"][group], stats["Mean_CNN"][group], stats["Std_CNN"][group], stats["N_CNN"][group]])
+        else:
+            CA_results.append([feature, stats["Mean"], stats["Std"], stats["N"], stats["Mean_CNN"], stats["Std_CNN"], stats["N_CNN"]])
+    # convert to DataFrame
+    CA_results_df = pd.DataFrame(CA_results, columns = ["Feature", "Score (Mean)", "Score (Std)", "N", "Score_CNN (Mean)", "Score_CNN (Std)", "N_CNN"])
+
+    # save
+    CA_results_df.to_csv("../results/descriptive_statistics/grouped_score_statistics_CA.csv", index = False)
 
 
 
 ## Candidate Attractiveness Levels and Voting Share
 
-# score group 1
-CA_final["score_group"] = pd.cut(CA_final["score"], bins = [0, 70, 75, 80, 100], labels = ["below 69.99", "70-74.99", "75-79.99", "above 80"], include_lowest = True)
-score_stats = CA_final.groupby("score_group").agg({"vote_share": ["mean", "std"],
-                                                   "ln_vote_share": ["mean", "std"],
-                                                   "score": "count"}).round(4).reset_index()
-score_stats.columns = ["score_group", "vote_share (mean)", "vote_share (std)", "ln_vote_share (mean)", "ln_vote_share (std)", "count"]
-# save
-score_stats.to_csv("../results/descriptive_statistics/score_group_statistics_1.csv", index = False)
-# score group 2
-CA_final["score_group"] = pd.cut(CA_final["score"], bins = [0, 75, 80, 100], labels = ["below 74.99", "75-79.99", "above 80"], include_lowest = True)
-score_stats = CA_final.groupby("score_group").agg({"vote_share": ["mean", "std"],
-                                                   "ln_vote_share": ["mean", "std"],
-                                                   "score": "count"}).round(4).reset_index()
-score_stats.columns = ["score_group", "vote_share (mean)", "vote_share (std)", "ln_vote_share (mean)", "ln_vote_share (std)", "count"]
-# save
-score_stats.to_csv("../results/descriptive_statistics/score_group_statistics_2.csv", index = False)
-
-# score group (CNN) 1
-CA_final["score_group"] = pd.cut(CA_final["score_CNN"], bins = [0, 70, 75, 80, 100], labels = ["below 69.99", "70-74.99", "75-79.99", "above 80"], include_lowest = True)
-score_stats = CA_final.groupby("score_group").agg({"vote_share": ["mean", "std"],
-                                                   "ln_vote_share": ["mean", "std"],
-                                                   "score_CNN": "count"}).round(4).reset_index()
-score_stats.columns = ["score_group", "vote_share (mean)", "vote_share (std)", "ln_vote_share (mean)", "ln_vote_share (std)", "count"]
-# save
-score_stats.to_csv("../results/descriptive_statistics/score_group_statistics_CNN_1.csv", index = False)
-# score group (CNN) 2
-CA_final["score_group"] = pd.cut(CA_final["score_CNN"], bins = [0, 75, 80, 100], labels = ["below 74.99", "75-79.99", "above 80"], include_lowest = True)
-score_stats = CA_final.groupby("score_group").agg({"vote_share": ["mean", "std"],
-                                                   "ln_vote_share": ["mean", "std"],
-                                                   "score_CNN": "count"}).round(4).reset_index()
-score_stats.columns = ["score_group", "vote_share (mean)", "vote_share (std)", "ln_vote_share (mean)", "ln_vote_share (std)", "count"]
-# save
-score_stats.to_csv("../results/descriptive_statistics/score_group_statistics_CNN_2.csv", index = False)
+# vote share by score group of one score (3 or 4 score groups)
+def score_group_table(cube, score, num_groups):
+    groups = list(score_groups[num_groups])
+    summary = summarize(cube, ["vote_share", "ln_vote_share", score], by = score_group_keys(cube, score, num_groups), levels = groups)
+    score_stats = pd.DataFrame({"score_group": groups,
+                                "vote_share (mean)": summary["vote_share"]["Mean"].to_numpy(),
+                                "vote_share (std)": summary["vote_share"]["Std"].to_numpy(),
+                                "ln_vote_share (mean)": summary["ln_vote_share"]["Mean"].to_numpy(),
+                                "ln_vote_share (std)": summary["ln_vote_share"]["Std"].to_numpy(),
+                                "count": summary[score]["N"].to_numpy()})
+    return score_stats.round(4)
+
+# vote share by score group
+def score_group_statistics(cube):
+    os.makedirs("../results/descriptive_statistics", exist_ok = True)
+
+    # score group 1 & 2
+    score_group_table(cube, "score", 4).to_csv("../results/descriptive_statistics/score_group_statistics_1.csv", index = False)
+    score_group_table(cube, "score", 3).to_csv("../results/descriptive_statistics/score_group_statistics_2.csv", index = False)
+    # score group (CNN) 1 & 2
+    score_group_table(cube, "score_CNN", 4).to_csv("../results/descriptive_statistics/score_group_statistics_CNN_1.csv", index = False)
+    score_group_table(cube, "score_CNN", 3).to_csv("../results/descriptive_statistics/score_group_statistics_CNN_2.csv", index = False)
 
 
 
 ## OLS
 
-def OLS_regressions(data, bins, labels):
+# also check the OLS tables against statsmodels' OLS(...).fit(cov_type = "HC1"), off unless OLS_CHECK=1 (tests/test_ols_engine.py always checks)
+ols_check_enabled = os.environ.get("OLS_CHECK", "0") != "0"
+# bin edges and labels of the score groups in the OLS tables (spec_curve.py sweeps other bin edges)
+score_bins = {3: ([0, 75, 80, 100], [1, 2, 3]),
+              4: ([0, 70, 75, 80, 100], [1, 2, 3, 4])}
+
+# (formula, rows) of each model
+def OLS_models(data, bins, labels):
     data["score_group"] = pd.cut(data["score"], bins = bins, labels = labels, include_lowest = True).astype(int)
     data["score_group_CNN"] = pd.cut(data["score_CNN"], bins = bins, labels = labels, include_lowest = True).astype(int)
     
-    models = {"Total": smf.ols("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + Democratic + C(Incumbent) + C(Year)", data = data).fit(cov_type = "HC1"),
-              "Total (CNN)": smf.ols("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + Democratic + C(Incumbent) + C(Year)", data = data).fit(cov_type = "HC1"),
-              "Total_edu": smf.ols("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Incumbent) + C(Year)", data = data).fit(cov_type = "HC1"),
-              "Total_edu (CNN)": smf.ols("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Incumbent) + C(Year)", data = data).fit(cov_type = "HC1"),
-              "Total_edu_city": smf.ols("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Incumbent) + C(city_type) + C(Year)", data = data).fit(cov_type = "HC1"),
-              "Total_edu_city (CNN)": smf.ols("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Incumbent) + C(city_type) + C(Year)", data = data).fit(cov_type = "HC1"),
-              "Not Democratic": smf.ols("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)", data = data[data["Party"] != "Democratic"]).fit(cov_type = "HC1"),
-              "Democratic": smf.ols("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)", data = data[data["Party"] == "Democratic"]).fit(cov_type = "HC1"),
-              "Not Democratic (CNN)": smf.ols("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)", data = data[data["Party"] != "Democratic"]).fit(cov_type = "HC1"),
-              "Democratic (CNN)": smf.ols("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)", data = data[data["Party"] == "Democratic"]).fit(cov_type = "HC1"),
-              "Not Incumbent": smf.ols("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)", data = data[data["Incumbent"] == 0]).fit(cov_type = "HC1"),
-              "Incumbent": smf.ols("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)", data = data[data["Incumbent"] == 1]).fit(cov_type = "HC1"),
-              "Not Incumbent (CNN)": smf.ols("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)", data = data[data["Incumbent"] == 0]).fit(cov_type = "HC1"),
-              "Incumbent (CNN)": smf.ols("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)", data = data[data["Incumbent"] == 1]).fit(cov_type = "HC1")}
-    
-    return models
+    return {"Total": ("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + Democratic + C(Incumbent) + C(Year)", None),
+            "Total (CNN)": ("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + Democratic + C(Incumbent) + C(Year)", None),
+            "Total_edu": ("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Incumbent) + C(Year)", None),
+            "Total_edu (CNN)": ("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Incumbent) + C(Year)", None),
+            "Total_edu_city": ("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Incumbent) + C(city_type) + C(Year)", None),
+            "Total_edu_city (CNN)": ("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Incumbent) + C(city_type) + C(Year)", None),
+            "Not Democratic": ("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)", data["Party"] != "Democratic"),
+            "Democratic": ("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)", data["Party"] == "Democratic"),
+            "Not Democratic (CNN)": ("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)", data["Party"] != "Democratic"),
+            "Democratic (CNN)": ("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)", data["Party"] == "Democratic"),
+            "Not Incumbent": ("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)", data["Incumbent"] == 0),
+            "Incumbent": ("ln_vote_share ~ score_group + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)", data["Incumbent"] == 1),
+            "Not Incumbent (CNN)": ("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)", data["Incumbent"] == 0),
+            "Incumbent (CNN)": ("ln_vote_share ~ score_group_CNN + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)", data["Incumbent"] == 1)}
+
+# all models fitted at once on a shared design matrix
+def OLS_regressions(data, bins, labels):
+    return fit_ols(data, OLS_models(data, bins, labels))
 
 def stargazer_table(models, filename):
     stargazer = Stargazer([models["Total"], models["Total (CNN)"], models["Total_edu"], models["Total_edu (CNN)"], models["Total_edu_city"], models["Total_edu_city (CNN)"], models["Not Democratic"], models["Democratic"], models["Not Democratic (CNN)"], models["Democratic (CNN)"], models["Not Incumbent"], models["Incumbent"], models["Not Incumbent (CNN)"], models["Incumbent (CNN)"]])
@@ -229,90 +216,143 @@ def stargazer_table(models, filename):
     with open(filename, "w") as f:
         f.write(stargazer.render_html())
 
-alldata_CA = pd.read_csv("../results/alldata_CA.csv", encoding="utf-8")
-os.makedirs("../results/table", exist_ok = True)
+# OLS tables for 3 and 4 score groups
+def regression_tables(alldata_CA):
+    os.makedirs("../results/table", exist_ok = True)
 
-# For 3 score groups
-models_3 = OLS_regressions(alldata_CA, [0, 75, 80, 100], [1, 2, 3])
-stargazer_table(models_3, "../results/table/lnVoteShare_3.html")
-# For 4 score groups
-models_4 = OLS_regressions(alldata_CA, [0, 70, 75, 80, 100], [1, 2, 3, 4])
-stargazer_table(models_4, "../results/table/lnVoteShare_4.html")
+    for groups, filename in [(3, "../results/table/lnVoteShare_3.html"), (4, "../results/table/lnVoteShare_4.html")]:
+        models = OLS_models(alldata_CA, *score_bins[groups])
+        results = fit_ols(alldata_CA, models)
+        # the engine's coefficients, standard errors & F statistics must match statsmodels
+        if ols_check_enabled:
+            check_statsmodels(alldata_CA, models, results)
+        stargazer_table(results, filename)
 
 
 
 ## interaction term
 
-# interaction term (Incumbent)
-
-# For 3 score groups
-alldata_CA["score_group"] = pd.cut(alldata_CA["score"], bins = [0, 75, 80, 100], labels = [1, 2, 3], include_lowest = True).astype(int)
-alldata_CA["score_group_CNN"] = pd.cut(alldata_CA["score_CNN"], bins = [0, 75, 80, 100], labels = [1, 2, 3], include_lowest = True).astype(int)
-m_01_total = smf.ols("ln_vote_share ~ score_group + C(Incumbent) + score_group:C(Incumbent) + Age + Agesq + C(Gender) + Democratic + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_02_total = smf.ols("ln_vote_share ~ score_group_CNN + C(Incumbent) + score_group_CNN:C(Incumbent) + Age + Agesq + C(Gender) + Democratic + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_03_total = smf.ols("ln_vote_share ~ score_group + C(Incumbent) + score_group:C(Incumbent) + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_04_total = smf.ols("ln_vote_share ~ score_group_CNN + C(Incumbent) + score_group_CNN:C(Incumbent) + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_05_total = smf.ols("ln_vote_share ~ score_group + C(Incumbent) + score_group:C(Incumbent) + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_06_total = smf.ols("ln_vote_share ~ score_group_CNN + C(Incumbent) + score_group_CNN:C(Incumbent) + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-# For 4 score groups
-alldata_CA["score_group"] = pd.cut(alldata_CA["score"], bins = [0, 70, 75, 80, 100], labels = [1, 2, 3, 4], include_lowest = True).astype(int)
-alldata_CA["score_group_CNN"] = pd.cut(alldata_CA["score_CNN"], bins = [0, 70, 75, 80, 100], labels = [1, 2, 3, 4], include_lowest = True).astype(int)
-m_07_total = smf.ols("ln_vote_share ~ score_group + C(Incumbent) + score_group:C(Incumbent) + Age + Agesq + C(Gender) + Democratic + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_08_total = smf.ols("ln_vote_share ~ score_group_CNN + C(Incumbent) + score_group_CNN:C(Incumbent) + Age + Agesq + C(Gender) + Democratic + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_09_total = smf.ols("ln_vote_share ~ score_group + C(Incumbent) + score_group:C(Incumbent) + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_10_total = smf.ols("ln_vote_share ~ score_group_CNN + C(Incumbent) + score_group_CNN:C(Incumbent) + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_11_total = smf.ols("ln_vote_share ~ score_group + C(Incumbent) + score_group:C(Incumbent) + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_12_total = smf.ols("ln_vote_share ~ score_group_CNN + C(Incumbent) + score_group_CNN:C(Incumbent) + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-# table
-stargazer = Stargazer([m_01_total, m_02_total, m_03_total, m_04_total, m_05_total, m_06_total, m_07_total, m_08_total, m_09_total, m_10_total, m_11_total, m_12_total])
-stargazer.title("Table: Effects of Facial Attractiveness Score on ln Vote Share")
-stargazer.custom_columns(["3 Score Groups", "4 Score Groups"], [6, 6])
-stargazer.custom_columns(["Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)"], [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1])
-stargazer.show_model_numbers(False)
-stargazer.covariate_order(["score_group", "score_group:C(Incumbent)[T.1]", "score_group_CNN", "score_group_CNN:C(Incumbent)[T.1]", "C(Incumbent)[T.1]", "Intercept"])
-stargazer.add_line("Age FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
-stargazer.add_line("Gender FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
-stargazer.add_line("Education FE", ["", "", "V", "V", "V", "V", "", "", "V", "V", "V", "V"])
-stargazer.add_line("Party FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
-stargazer.add_line("City FE", ["", "", "", "", "V", "V", "", "", "", "", "V", "V"])
-stargazer.add_line("Year FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
-# save
-with open("../results/table/lnVoteShare_Incumbent.html", "w") as f:
-    f.write(stargazer.render_html())
-
-# interaction term (Party)
-
-# For 3 score groups
-alldata_CA["score_group"] = pd.cut(alldata_CA["score"], bins = [0, 75, 80, 100], labels = [1, 2, 3], include_lowest = True).astype(int)
-alldata_CA["score_group_CNN"] = pd.cut(alldata_CA["score_CNN"], bins = [0, 75, 80, 100], labels = [1, 2, 3], include_lowest = True).astype(int)
-m_01_total = smf.ols("ln_vote_share ~ score_group + Democratic + score_group:Democratic + Age + Agesq + C(Gender) + C(Incumbent) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_02_total = smf.ols("ln_vote_share ~ score_group_CNN + Democratic + score_group_CNN:Democratic + Age + Agesq + C(Gender) + C(Incumbent) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_03_total = smf.ols("ln_vote_share ~ score_group + Democratic + score_group:Democratic + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_04_total = smf.ols("ln_vote_share ~ score_group_CNN + Democratic + score_group_CNN:Democratic + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_05_total = smf.ols("ln_vote_share ~ score_group + Democratic + score_group:Democratic + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_06_total = smf.ols("ln_vote_share ~ score_group_CNN + Democratic + score_group_CNN:Democratic + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-# For 4 score groups
-alldata_CA["score_group"] = pd.cut(alldata_CA["score"], bins = [0, 70, 75, 80, 100], labels = [1, 2, 3, 4], include_lowest = True).astype(int)
-alldata_CA["score_group_CNN"] = pd.cut(alldata_CA["score_CNN"], bins = [0, 70, 75, 80, 100], labels = [1, 2, 3, 4], include_lowest = True).astype(int)
-m_07_total = smf.ols("ln_vote_share ~ score_group + Democratic + score_group:Democratic + Age + Agesq + C(Gender) + C(Incumbent) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_08_total = smf.ols("ln_vote_share ~ score_group_CNN + Democratic + score_group_CNN:Democratic + Age + Agesq + C(Gender) + C(Incumbent) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_09_total = smf.ols("ln_vote_share ~ score_group + Democratic + score_group:Democratic + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_10_total = smf.ols("ln_vote_share ~ score_group_CNN + Democratic + score_group_CNN:Democratic + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_11_total = smf.ols("ln_vote_share ~ score_group + Democratic + score_group:Democratic + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-m_12_total = smf.ols("ln_vote_share ~ score_group_CNN + Democratic + score_group_CNN:Democratic + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)", data = alldata_CA).fit(cov_type = "HC1")
-# table
-stargazer = Stargazer([m_01_total, m_02_total, m_03_total, m_04_total, m_05_total, m_06_total, m_07_total, m_08_total, m_09_total, m_10_total, m_11_total, m_12_total])
-stargazer.title("Table: Effects of Facial Attractiveness Score on ln Vote Share")
-stargazer.custom_columns(["3 Score Groups", "4 Score Groups"], [6, 6])
-stargazer.custom_columns(["Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)"], [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1])
-stargazer.show_model_numbers(False)
-stargazer.covariate_order(["score_group", "score_group:Democratic", "score_group_CNN", "score_group_CNN:Democratic", "Democratic", "Intercept"])
-stargazer.add_line("Age FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
-stargazer.add_line("Gender FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
-stargazer.add_line("Education FE", ["", "", "V", "V", "V", "V", "", "", "V", "V", "V", "V"])
-stargazer.add_line("Incumbent FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
-stargazer.add_line("City FE", ["", "", "", "", "V", "V", "", "", "", "", "V", "V"])
-stargazer.add_line("Year FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
-# save
-with open("../results/table/lnVoteShare_Party.html", "w") as f:
-    f.write(stargazer.render_html())
+# models of the same formulas for 3 and 4 score groups (12 models)
+def interaction_models(alldata_CA, formulas):
+    models = []
+    for bins, labels in score_bins.values():
+        alldata_CA["score_group"] = pd.cut(alldata_CA["score"], bins = bins, labels = labels, include_lowest = True).astype(int)
+        alldata_CA["score_group_CNN"] = pd.cut(alldata_CA["score_CNN"], bins = bins, labels = labels, include_lowest = True).astype(int)
+        results = fit_ols(alldata_CA, {formula: (formula, None) for formula in formulas})
+        models += [results[formula] for formula in formulas]
+    return models
+
+# OLS tables with the score group x incumbent and score group x party interactions
+def interaction_tables(alldata_CA):
+    os.makedirs("../results/table", exist_ok = True)
+
+    # interaction term (Incumbent)
+    formulas = ["ln_vote_share ~ score_group + C(Incumbent) + score_group:C(Incumbent) + Age + Agesq + C(Gender) + Democratic + C(Year)",
+                "ln_vote_share ~ score_group_CNN + C(Incumbent) + score_group_CNN:C(Incumbent) + Age + Agesq + C(Gender) + Democratic + C(Year)",
+                "ln_vote_share ~ score_group + C(Incumbent) + score_group:C(Incumbent) + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Year)",
+                "ln_vote_share ~ score_group_CNN + C(Incumbent) + score_group_CNN:C(Incumbent) + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(Year)",
+                "ln_vote_share ~ score_group + C(Incumbent) + score_group:C(Incumbent) + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)",
+                "ln_vote_share ~ score_group_CNN + C(Incumbent) + score_group_CNN:C(Incumbent) + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)"]
+    models = interaction_models(alldata_CA, formulas)
+    # table
+    stargazer = Stargazer(models)
+    stargazer.title("Table: Effects of Facial Attractiveness Score on ln Vote Share")
+    stargazer.custom_columns(["3 Score Groups", "4 Score Groups"], [6, 6])
+    stargazer.custom_columns(["Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)"], [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1])
+    stargazer.show_model_numbers(False)
+    stargazer.covariate_order(["score_group", "score_group:C(Incumbent)[T.1]", "score_group_CNN", "score_group_CNN:C(Incumbent)[T.1]", "C(Incumbent)[T.1]", "Intercept"])
+    stargazer.add_line("Age FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
+    stargazer.add_line("Gender FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
+    stargazer.add_line("Education FE", ["", "", "V", "V", "V", "V", "", "", "V", "V", "V", "V"])
+    stargazer.add_line("Party FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
+    stargazer.add_line("City FE", ["", "", "", "", "V", "V", "", "", "", "", "V", "V"])
+    stargazer.add_line("Year FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
+    # save
+    with open("../results/table/lnVoteShare_Incumbent.html", "w") as f:
+        f.write(stargazer.render_html())
+
+    # interaction term (Party)
+    formulas = ["ln_vote_share ~ score_group + Democratic + score_group:Democratic + Age + Agesq + C(Gender) + C(Incumbent) + C(Year)",
+                "ln_vote_share ~ score_group_CNN + Democratic + score_group_CNN:Democratic + Age + Agesq + C(Gender) + C(Incumbent) + C(Year)",
+                "ln_vote_share ~ score_group + Democratic + score_group:Democratic + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(Year)",
+                "ln_vote_share ~ score_group_CNN + Democratic + score_group_CNN:Democratic + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(Year)",
+                "ln_vote_share ~ score_group + Democratic + score_group:Democratic + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)",
+                "ln_vote_share ~ score_group_CNN + Democratic + score_group_CNN:Democratic + Age + Agesq + C(Gender) + C(Edu_Level) + C(Incumbent) + C(city_type) + C(Year)"]
+    models = interaction_models(alldata_CA, formulas)
+    # table
+    stargazer = Stargazer(models)
+    stargazer.title("Table: Effects of Facial Attractiveness Score on ln Vote Share")
+    stargazer.custom_columns(["3 Score Groups", "4 Score Groups"], [6, 6])
+    stargazer.custom_columns(["Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)", "Total", "Total (CNN)"], [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1])
+    stargazer.show_model_numbers(False)
+    stargazer.covariate_order(["score_group", "score_group:Democratic", "score_group_CNN", "score_group_CNN:Democratic", "Democratic", "Intercept"])
+    stargazer.add_line("Age FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
+    stargazer.add_line("Gender FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
+    stargazer.add_line("Education FE", ["", "", "V", "V", "V", "V", "", "", "V", "V", "V", "V"])
+    stargazer.add_line("Incumbent FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
+    stargazer.add_line("City FE", ["", "", "", "", "V", "V", "", "", "", "", "V", "V"])
+    stargazer.add_line("Year FE", ["V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V", "V"])
+    # save
+    with open("../results/table/lnVoteShare_Party.html", "w") as f:
+        f.write(stargazer.render_html())
+
+
+
+## resampling inference
+
+# bootstrap / permutation p-values of score_group & score_group_CNN, off unless RESAMPLING is set, e.g. RESAMPLING=wild,pairs,permutation
+resampling_methods = [method for method in os.environ.get("RESAMPLING", "").split(",") if method]
+resampling_replications = int(os.environ.get("RESAMPLING_REPLICATIONS", 10000))
+resampling_seed = int(os.environ.get("RESAMPLING_SEED", 0))
+resampling_workers = int(os.environ.get("RESAMPLING_WORKERS", os.cpu_count()))
+
+# p-values of the score group in every model of OLS_regressions next to the HC1 p-value
+def resampling_table(data, bins, labels, filename, methods, replications, seed, executor):
+    models = OLS_models(data, bins, labels)
+    results = fit_ols(data, models)
+    rows = []
+    for name, (X, y, columns) in model_matrices(data, models).items():
+        variable = "score_group_CNN" if "score_group_CNN" in columns else "score_group"
+        row = {"Model": name, "Variable": variable, "Coef.": results[name].params[variable],
+               "Std.Err. (HC1)": results[name].bse[variable], "P>|z| (HC1)": results[name].pvalues[variable]}
+        for method in methods:
+            row[f"P ({method})"], row[f"Replications ({method})"] = resampling_pvalue(X, y, columns.index(variable), method, replications, seed, executor = executor)
+        rows.append(row)
+    pd.DataFrame(rows).to_csv(filename, index = False)
+
+# resampling p-values for 3 and 4 score groups
+def resampling_tables(alldata_CA, methods = None, replications = None, seed = None, workers = None):
+    methods = resampling_methods if methods is None else methods
+    if not methods:
+        return
+    replications = replications or resampling_replications
+    seed = resampling_seed if seed is None else seed
+    os.makedirs("../results/table", exist_ok = True)
+
+    with ProcessPoolExecutor(max_workers = workers or resampling_workers) as executor:
+        # For 3 score groups
+        resampling_table(alldata_CA, *score_bins[3], "../results/table/resampling_3.csv", methods, replications, seed, executor)
+        # For 4 score groups
+        resampling_table(alldata_CA, *score_bins[4], "../results/table/resampling_4.csv", methods, replications, seed, executor)
+
+
+
+## all tables
+
+# all tables of the analysis, resampling: keyword arguments of resampling_tables (methods, replications, seed, workers)
+def analyze(path = "../data/processed/CA_final.csv", **resampling):
+    alldata_CA = prepare_data(path)
+    # descriptive statistics: one summary cube, also saved for the figures
+    cube = build_cube(alldata_CA)
+    save_cube(cube)
+
+    descriptive_statistics(cube)
+    grouped_score_statistics(cube)
+    score_group_statistics(cube)
+    regression_tables(alldata_CA)
+    resampling_tables(alldata_CA, **resampling)
+    interaction_tables(alldata_CA)
+
+
+if __name__ == "__main__":
+    analyze()
@@ -0,0 +1,355 @@
+# This file contains functions and methods that are used to benchmark the pipeline stages on synthetic data of 1x, 10x and 1000x the CA size
+# methodology: every stage runs once untimed (warm-up), then `repeat` timed runs with time.perf_counter after a gc.collect();
+# the median of the timed runs is the number compared between runs. Per-image stages time each phase of each image instead.
+import os
+import gc
+import sys
+import json
+import html
+import time
+import platform
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+# csv / Parquet datasets
+from storage import read_table, read_excel_cached
+# candidate IDs & analysis features
+from features import candidate_ids, build_features
+# merge of clean_data.py
+from merge_data import merge_all, candidate_columns
+
+
+
+## settings
+
+# scales of the synthetic data (1000 is slow: run it with --scales 1000)
+default_scales = [1, 10]
+# timed runs per stage and scale, fewer for large scales
+default_repeat = 5
+large_scale_repeat = 1
+large_scale = 100
+# images of the per-image stages at scale 1, scaled like the tables (20 images -> 200 at 10x)
+default_images = 20
+# images timed per scale at most, the total time of more images is extrapolated from the timed ones
+max_images = int(os.environ.get("BENCHMARK_MAX_IMAGES", 2000))
+# stages in pipeline order
+stage_names = ["parse", "image_HOG", "image_CNN", "merge", "OLS", "stargazer", "plot"]
+
+years = [2018, 2020]
+benchmark_dir = "../results/benchmark"
+fixture_dir = "../results/benchmark/fixtures"
+
+
+
+## synthetic data
+
+# CA input tables of the merge: elections, candidates, scores ({year: DataFrame}) & demographics ({("CA", year): DataFrame})
+def CA_tables():
+    return {"elections": {year: read_table(f"../data/raw/election_result/CA_house_election_{year}.csv") for year in years},
+            "candidates": {year: read_excel_cached(f"../data/processed/candidate_data/CA_candidate_data_{year}.xlsx", columns = candidate_columns) for year in years},
+            "scores": {year: read_table(f"../data/processed/candidate_images/CA/{year}_scores.csv") for year in years},
+            "demographics": {("CA", year): read_table(f"../data/processed/District_Demographics/CA_District_Demographics_{year}.csv") for year in years}}
+
+# new district of copy k: districts of copy k follow the districts of copy k - 1
+def copy_district(district, k, districts):
+    return district + k * districts
+
+# candidate IDs of copy k, e.g. CA_1_2 -> CA_54_2 (state_district_number)
+def copy_ids(ids, k, districts):
+    parts = ids.str.split("_", expand = True)
+    return candidate_ids(parts[0], copy_district(parts[1].astype(int), k, districts), parts[2])
+
+# the CA tables repeated `scale` times as new districts, with votes & scores jittered so the copies are not identical
+def synthetic_tables(scale, seed = 0, tables = None):
+    tables = tables or CA_tables()
+    rng = np.random.default_rng(seed)
+    synthetic = {"elections": {}, "candidates": {}, "scores": {}, "demographics": {}}
+    for year in years:
+        districts = int(tables["demographics"][("CA", year)]["District"].max())
+        election = tables["elections"][year]
+        votes = election["Votes"].astype(str).str.replace(",", "").astype(float)
+        copies = {"elections": [], "candidates": [], "scores": [], "demographics": []}
+        for k in range(scale):
+            copies["elections"].append(election.assign(District = copy_district(election["District"], k, districts),
+                                                       ID = copy_ids(election["ID"], k, districts),
+                                                       Votes = (votes * rng.uniform(0.8, 1.2, len(votes))).round().map("{:,.0f}".format)))
+            candidate = tables["candidates"][year]
+            copies["candidates"].append(candidate.assign(ID = copy_ids(candidate["ID"], k, districts)))
+            scores = tables["scores"][year]
+            copies["scores"].append(scores.assign(ID = copy_ids(scores["ID"], k, districts),
+                                                  score = (scores["score"] + rng.integers(-3, 4, len(scores))).clip(0, 100),
+                                                  score_CNN = (scores["score_CNN"] + rng.integers(-3, 4, len(scores))).clip(0, 100)))
+            demographic = tables["demographics"][("CA", year)]
+            copies["demographics"].append(demographic.assign(District = copy_district(demographic["District"], k, districts)))
+        synthetic["elections"][year] = pd.concat(copies["elections"], ignore_index = True)
+        synthetic["candidates"][year] = pd.concat(copies["candidates"], ignore_index = True)
+        synthetic["scores"][year] = pd.concat(copies["scores"], ignore_index = True)
+        synthetic["demographics"][("CA", year)] = pd.concat(copies["demographics"], ignore_index = True)
+    return synthetic
+
+# candidate panel of the analysis (alldata_CA) from synthetic tables
+def synthetic_panel(tables):
+    from analyze_data import columns
+    panel = merge_all(tables["elections"], tables["candidates"], tables["scores"], tables["demographics"])
+    return build_features(panel[columns].dropna())
+
+# ordinal of a district in the table captions, e.g. 1st, 22nd, 113th
+def ordinal(number):
+    suffix = "th" if 10 <= number % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(number % 10, "th")
+    return f"{number}{suffix}"
+
+# Wikipedia-like page of a state's House election: one table per district with the rows read by get_data.parse_district_table
+def synthetic_election_html(election, year, state_name = "California"):
+    tables = []
+    for district, candidates in election.groupby("District", sort = True):
+        photos = "".join(f'<td><img src="{html.escape(str(photo).replace("https:", ""))}/220px-thumb.jpg"></td>' for photo in candidates["Photo"])
+        names = "".join(f"<td>{html.escape(str(name))}</td>" for name in candidates["Name"])
+        parties = "".join(f"<td>{html.escape(str(party))}</td>" for party in candidates["Party"])
+        votes = "".join(f"<td>{vote}</td>" for vote in candidates["Votes"])
+        incumbent = candidates.loc[candidates["Incumbent"] == 1, "Name"]
+        representative = f'<td><p><a href="#">{html.escape(str(incumbent.iloc[0]))}</a></p></td><td>Party</td>' if len(incumbent) else "<td></td>"
+        tables.append(f"<table><caption>{year} {state_name}'s {ordinal(int(district))} congressional district election</caption>"
+                      f"<tr><th>header</th></tr><tr><td>Nominee</td></tr><tr><td>Candidate</td></tr><tr>{photos}</tr><tr>{names}</tr><tr>{parties}</tr>"
+                      f"<tr>{votes}</tr><tr><td>Percentage</td></tr><tr><td>Result</td></tr><tr>{representative}</tr></table>")
+    return f"<html><body><h1>{year} United States House of Representatives elections in {state_name}</h1>{''.join(tables)}</body></html>"
+
+# saved HTML fixture of each year at a scale (written once): {year: path}
+def election_fixtures(scale, tables, seed = 0, output_dir = fixture_dir):
+    os.makedirs(output_dir, exist_ok = True)
+    paths = {}
+    for year in years:
+        paths[year] = os.path.join(output_dir, f"CA_house_election_{year}_x{scale}_seed{seed}.html")
+        if not os.path.exists(paths[year]):
+            with open(paths[year], "w", encoding = "utf-8") as file:
+                file.write(synthetic_election_html(tables["elections"][year], year))
+    return paths
+
+# synthetic face images: random crops, mirror images, brightness changes & sizes of the candidate photos (written once)
+def synthetic_faces(count, output_dir = os.path.join(fixture_dir, "faces"), source_dir = "../data/processed/candidate_images/CA", seed = 0):
+    from PIL import Image, ImageEnhance, ImageOps
+
+    sources = sorted(image for image in Path(source_dir).glob("*/*") if image.is_file())
+    os.makedirs(output_dir, exist_ok = True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        source = sources[i % len(sources)]
+        # the random numbers of image i do not depend on the images that already exist
+        crop, mirror, brightness, size = rng.uniform(0, 0.05, 4), rng.random() < 0.5, rng.uniform(0.8, 1.2), rng.choice([400, 800, 1600, 3200])
+        path = os.path.join(output_dir, f"face_{i:06d}.jpg")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+        try:
+            with Image.open(source) as img:
+                img = img.convert("RGB")
+                width, height = img.size
+                img = img.crop((int(crop[0] * width), int(crop[1] * height), int(width * (1 - crop[2])), int(height * (1 - crop[3]))))
+                img = ImageOps.mirror(img) if mirror else img
+                img = ImageEnhance.Brightness(img).enhance(brightness)
+                img.thumbnail((size, size))
+                img.save(path, quality = 90)
+        except Exception as e:
+            print(f"Error - {source}: {str(e)}")
+            paths.pop()
+    return paths
+
+
+
+## timing
+
+# run a function once untimed and `repeat` times timed: result entry with the seconds of each run
+def time_stage(stage, scale, function, repeat, rows = None):
+    function()
+    seconds = []
+    for run in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return {"stage": stage, "scale": scale, "rows": rows, "repeat": repeat,
+            "seconds": [round(value, 6) for value in seconds],
+            "min": round(min(seconds), 6), "median": round(statistics.median(seconds), 6), "mean": round(statistics.mean(seconds), 6),
+            "stdev": round(statistics.stdev(seconds), 6) if len(seconds) > 1 else 0.0}
+
+# phases of one image with one detector: decode, detect, landmark & score (seconds), found = a face was found
+def time_image(image_path, name):
+    import face_score
+
+    start = time.perf_counter()
+    gray = face_score.load_gray_image(image_path)
+    decoded = time.perf_counter()
+    if name == "HOG":
+        faces = face_score.detector(gray)
+        rect = faces[0] if len(faces) > 0 else None
+    else:
+        dets = face_score.detector_CNN(gray)
+        rect = dets[0].rect if len(dets) > 0 else None
+    detected = time.perf_counter()
+    phases = {"decode": decoded - start, "detect": detected - decoded}
+    if rect is None:
+        return phases, False
+
+    landmarks = (face_score.predictor if name == "HOG" else face_score.predictor_CNN)(gray, rect)
+    landmarked = time.perf_counter()
+    face_score.score_landmarks(landmarks)
+    phases.update({"landmark": landmarked - detected, "score": time.perf_counter() - landmarked})
+    return phases, True
+
+# per-image latency of analyze_face (HOG) or analyze_face_CNN, split into its phases: result entry
+#   count: images of the scale, the total time is extrapolated when fewer images are timed
+def time_images(stage, name, images, scale = 1, count = None):
+    count = count or len(images)
+    import face_score
+
+    if face_score.predictor_CNN is None:
+        face_score.load_models()
+    # warm-up image
+    time_image(images[0], name)
+    latencies = {"decode": [], "detect": [], "landmark": [], "score": []}
+    totals = []
+    found = 0
+    for image in images:
+        gc.collect()
+        phases, face_found = time_image(image, name)
+        found += face_found
+        totals.append(sum(phases.values()))
+        for phase, seconds in phases.items():
+            latencies[phase].append(seconds)
+    summary = {phase: {"images": len(values), "mean": round(float(np.mean(values)), 6), "median": round(float(np.median(values)), 6),
+                       "p95": round(float(np.percentile(values, 95)), 6), "total": round(float(np.sum(values)), 6)}
+               for phase, values in latencies.items() if values}
+    return {"stage": stage, "scale": scale, "rows": count, "timed": len(images), "found": found, "phases": summary,
+            "min": round(min(totals), 6), "median": round(statistics.median(totals), 6), "mean": round(statistics.mean(totals), 6),
+            "total": round(sum(totals) * count / len(images), 6), "extrapolated": count > len(images)}
+
+
+
+## stages
+
+# parse the saved HTML fixtures of both years with get_data.parse_house_election
+def bench_parse(scale, tables, repeat, seed = 0):
+    from get_data import parse_house_election
+
+    pages = {}
+    for year, path in election_fixtures(scale, tables, seed).items():
+        with open(path, "rb") as file:
+            pages[year] = file.read()
+    rows = sum(len(tables["elections"][year]) for year in years)
+    return time_stage("parse", scale, lambda: [parse_house_election(pages[year], "CA", year) for year in years], repeat, rows)
+
+# merge_all of clean_data.merge on the synthetic tables (the files are read before timing)
+def bench_merge(scale, tables, repeat):
+    rows = sum(len(data) for data in tables["elections"].values())
+    return time_stage("merge", scale, lambda: merge_all(tables["elections"], tables["candidates"], tables["scores"], tables["demographics"]), repeat, rows)
+
+# OLS_regressions of the 4 score group table
+def bench_OLS(scale, panel, repeat):
+    from analyze_data import OLS_regressions, score_bins
+    return time_stage("OLS", scale, lambda: OLS_regressions(panel.copy(), *score_bins[4]), repeat, len(panel))
+
+# stargazer_table of the fitted models (written to a temporary file)
+def bench_stargazer(scale, panel, repeat):
+    from analyze_data import OLS_regressions, stargazer_table, score_bins
+    models = OLS_regressions(panel.copy(), *score_bins[4])
+    with tempfile.TemporaryDirectory() as folder:
+        return time_stage("stargazer", scale, lambda: stargazer_table(models, os.path.join(folder, "table.html")), repeat, len(panel))
+
+# summary cube, score group aggregates & the 8 scatter plots of visualize_results (rendered in this process to a temporary folder)
+def bench_plot(scale, panel, repeat):
+    from cube import build_cube
+    from visualize_results import figure_list, render_figure
+
+    def plot_all(folder):
+        for figure in figure_list(build_cube(panel), output_dir = folder):
+            render_figure(figure)
+
+    with tempfile.TemporaryDirectory() as folder:
+        return time_stage("plot", scale, lambda: plot_all(folder), repeat, len(panel))
+
+
+
+## benchmark
+
+# versions of the environment, so runs are only compared on the same setup
+def environment():
+    versions = {}
+    for name in ["numpy", "pandas", "statsmodels", "matplotlib", "bs4", "lxml", "dlib", "cv2", "stargazer"]:
+        try:
+            versions[name] = getattr(__import__(name), "__version__", "unknown")
+        except ImportError:
+            versions[name] = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except Exception:
+        commit = None
+    return {"python": sys.version.split()[0], "platform": platform.platform(), "processor": platform.processor(),
+            "cpu_count": os.cpu_count(), "commit": commit, "versions": versions, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+# time the stages at each scale: {"environment", "settings", "results"}, written as JSON to output
+def run_benchmark(stages = None, scales = None, repeat = default_repeat, images = default_images, seed = 0, output = None):
+    stages = stages or stage_names
+    scales = scales or default_scales
+    output = output or os.path.join(benchmark_dir, f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    unknown = [stage for stage in stages if stage not in stage_names]
+    if unknown:
+        raise ValueError(f"unknown stages: {unknown} (use {', '.join(stage_names)})")
+
+    results = []
+    tables = CA_tables()
+    for scale in scales:
+        stage_repeat = large_scale_repeat if scale >= large_scale else repeat
+        scaled = synthetic_tables(scale, seed, tables)
+        panel = synthetic_panel(scaled) if set(stages) & {"OLS", "stargazer", "plot"} else None
+        for stage in stages:
+            try:
+                if stage.startswith("image_"):
+                    # per-image stages on images x scale synthetic faces (at most max_images are timed)
+                    count = images * scale
+                    result = time_images(stage, stage.split("_")[1], synthetic_faces(min(count, max_images), seed = seed), scale, count)
+                    print(f"{stage} x{scale}: median {result['median']:.4f} s per image, total {result['total']:.2f} s ({count} images"
+                          + (f", extrapolated from {result['timed']} timed" if result["extrapolated"] else "") + ")")
+                else:
+                    if stage == "parse":
+                        result = bench_parse(scale, scaled, stage_repeat, seed)
+                    elif stage == "merge":
+                        result = bench_merge(scale, scaled, stage_repeat)
+                    else:
+                        result = {"OLS": bench_OLS, "stargazer": bench_stargazer, "plot": bench_plot}[stage](scale, panel, stage_repeat)
+                    print(f"{stage} x{scale}: median {result['median']:.4f} s ({result['rows']} rows)")
+            except Exception as e:
+                print(f"Error - {stage} x{scale}: {str(e)}")
+                result = {"stage": stage, "scale": scale, "error": str(e)}
+            results.append(result)
+
+    report = {"environment": environment(),
+              "settings": {"stages": stages, "scales": scales, "repeat": repeat, "large_scale_repeat": large_scale_repeat, "images": images, "max_images": max_images, "seed": seed},
+              "results": results}
+    os.makedirs(os.path.dirname(output) or ".", exist_ok = True)
+    with open(output, "w", encoding = "utf-8") as file:
+        json.dump(report, file, indent = 1)
+    print(f"Benchmark saved to {output}")
+    return report
+
+# median of each stage & scale of a benchmark file compared with a baseline file: slower than threshold = regression
+def compare_benchmarks(baseline_path, current_path, threshold = 0.1):
+    medians = []
+    for path in (baseline_path, current_path):
+        with open(path, "r", encoding = "utf-8") as file:
+            medians.append({(result["stage"], result["scale"]): result["median"] for result in json.load(file)["results"] if "median" in result})
+    baseline, current = medians
+
+    rows = []
+    for key in [key for key in current if key in baseline]:
+        ratio = current[key] / baseline[key] if baseline[key] else float("nan")
+        status = "regression" if ratio > 1 + threshold else "faster" if ratio < 1 - threshold else "same"
+        rows.append({"stage": key[0], "scale": key[1], "baseline": baseline[key], "current": current[key], "ratio": round(ratio, 3), "status": status})
+        print(f"{key[0]} x{key[1]}: {baseline[key]:.4f} s -> {current[key]:.4f} s ({ratio:.2f}x, {status})")
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,103 @@
+# This file contains functions and methods that are used to aggregate the analysis data into one cube of summary statistics
+# every descriptive table (and the figures) is a roll-up of the cube's cells instead of another pass over a filtered copy of the data
+import numpy as np
+import pandas as pd
+# storage of the cached cube
+from storage import read_table, write_table
+# categories of the features
+from features import other_parties
+
+
+
+## cube
+
+# cells: one per combination of the dimensions present in the data
+cube_dimensions = ["Year", "Gender", "Party", "Incumbent", "city_type", "Edu_Level", "Age_Group", "score_bin", "score_CNN_bin"]
+
+# finest score bins, the score groups of the tables are unions of them
+score_bins = [0, 70, 75, 80, 100]
+score_bin_labels = ["below 69.99", "70-74.99", "75-79.99", "above 80"]
+# score groups: {number of groups: {group: score bins}}
+score_groups = {4: {label: [label] for label in score_bin_labels},
+                3: {"below 74.99": ["below 69.99", "70-74.99"], "75-79.99": ["75-79.99"], "above 80": ["above 80"]}}
+
+# variables with statistics in each cell
+cube_variables = ["vote_share", "ln_vote_share", "score", "score_CNN",
+                  "Gender_M", "Gender_F", "Republican", "Democratic", "Other", "Incumbent_0", "Incumbent_1",
+                  "Age", "Master & Above", "College", "High School",
+                  "city_type_rural", "city_type_transition", "city_type_urban",
+                  "Poverty (%)", "Median_Household_Income", "Pop_Total", "Sex Ratio"]
+
+# candidate features as cells of the cube: {feature: (dimension, values)}
+cube_subsets = {"Gender_M": ("Gender", ["M"]), "Gender_F": ("Gender", ["F"]),
+                "Master & Above": ("Edu_Level", [3]), "College": ("Edu_Level", [2]), "High School": ("Edu_Level", [1]),
+                "Republican": ("Party", ["Republican"]), "Democratic": ("Party", ["Democratic"]), "Other": ("Party", other_parties),
+                "Incumbent_0": ("Incumbent", [0]), "Incumbent_1": ("Incumbent", [1]),
+                "city_type_rural": ("city_type", ["rural"]), "city_type_transition": ("city_type", ["transition"]), "city_type_urban": ("city_type", ["urban"])}
+
+# count, sum, sum of squares, min & max of every variable in every cell, in one grouped pass over the data
+# sumdev & sumsq are the sums of the variable minus its overall mean and of their squares, which keeps the variance accurate for large values
+def build_cube(data, variables = None):
+    variables = variables or cube_variables
+    values = data[variables].astype(float)
+    deviations = values - values.mean()
+    squares = (deviations ** 2).add_suffix(" ^2")
+    deviations = deviations.add_suffix(" -mean")
+
+    keys = [data[name] for name in cube_dimensions if not name.endswith("_bin")]
+    keys += [pd.cut(data[score], bins = score_bins, labels = score_bin_labels, include_lowest = True).rename(f"{score}_bin") for score in ["score", "score_CNN"]]
+    grouped = pd.concat([values, deviations, squares], axis = 1).groupby(keys, observed = True, dropna = False)
+    aggregated = grouped.agg({**{variable: ["count", "sum", "min", "max"] for variable in variables},
+                              **{f"{variable} -mean": ["sum"] for variable in variables}, **{f"{variable} ^2": ["sum"] for variable in variables}})
+
+    statistics = {"rows": grouped.size()}
+    for variable in variables:
+        statistics[f"count({variable})"] = aggregated[(variable, "count")]
+        statistics[f"sum({variable})"] = aggregated[(variable, "sum")]
+        statistics[f"sumdev({variable})"] = aggregated[(f"{variable} -mean", "sum")]
+        statistics[f"sumsq({variable})"] = aggregated[(f"{variable} ^2", "sum")]
+        statistics[f"min({variable})"] = aggregated[(variable, "min")]
+        statistics[f"max({variable})"] = aggregated[(variable, "max")]
+    return pd.DataFrame(statistics)
+
+# cells of the cube in one of the values of a dimension
+def cube_rows(cube, dimension, values):
+    return cube.index.get_level_values(dimension).isin(values)
+
+def save_cube(cube, path = "../results/summary_cube.csv"):
+    write_table(cube.reset_index(), path)
+
+def read_cube(path = "../results/summary_cube.csv"):
+    return read_table(path).set_index(cube_dimensions)
+
+
+
+## roll-ups
+
+# N, Mean, Std (ddof 1), Min & Max of each variable over the selected cells (rows: boolean array over the cells), by groups of cells
+#   by: group of each selected cell (e.g. a dimension's values), levels: all groups in order, groups without cells have N = 0
+# -> {variable: DataFrame indexed by group}, plus "rows" (number of rows of each group)
+def summarize(cube, variables, rows = None, by = None, levels = None):
+    cells = cube if rows is None else cube[rows]
+    keys = np.zeros(len(cells), dtype = int) if by is None else np.asarray(by)
+    levels = [0] if by is None else levels
+    sums = cells.groupby(keys).sum(numeric_only = True).reindex(levels)
+    mins = cells.groupby(keys).min(numeric_only = True).reindex(levels)
+    maxs = cells.groupby(keys).max(numeric_only = True).reindex(levels)
+
+    summary = {"rows": sums["rows"].fillna(0).astype(int)}
+    for variable in variables:
+        n = sums[f"count({variable})"].fillna(0).astype(int)
+        total = sums[f"sum({variable})"]
+        variance = (sums[f"sumsq({variable})"] - sums[f"sumdev({variable})"] ** 2 / n) / (n - 1)
+        summary[variable] = pd.DataFrame({"N": n,
+                                          "Mean": (total / n).where(n > 0),
+                                          "Std": np.sqrt(variance.clip(lower = 0)).where(n > 1),
+                                          "Min": mins[f"min({variable})"],
+                                          "Max": maxs[f"max({variable})"]})
+    return summary
+
+# score group of each cell: {score bin: score group} of the score's bins
+def score_group_keys(cells, score, num_groups):
+    group_of = {label: group for group, labels in score_groups[num_groups].items() for label in labels}
+    return cells.index.get_level_values(f"{score}_bin").map(group_of)
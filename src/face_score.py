@@ -0,0 +1,564 @@
+# This file contains functions and methods that are used to calculate the facial attractiveness score
+import os
+import time
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+# face detection
+import cv2
+# Three Forehead and Five Eyes
+import dlib
+import numpy as np
+from PIL import Image
+# score cache
+import score_cache
+# trace of per-image latencies & failures
+import instrument
+
+
+
+## face detectors
+
+# models are loaded by load_models(), once per process
+detector = None
+predictor = None
+detector_CNN = None
+predictor_CNN = None
+
+def load_models(model_dir = "../data/raw/dlib_model"):
+    global detector, predictor, detector_CNN, predictor_CNN
+
+    # HOG + Linear SVM face detector
+    detector = dlib.get_frontal_face_detector()
+    predictor = dlib.shape_predictor(os.path.join(model_dir, "shape_predictor_68_face_landmarks.dat"))
+    # MMOD CNN face detector
+    detector_CNN = dlib.cnn_face_detection_model_v1(os.path.join(model_dir, "mmod_human_face_detector.dat"))
+    predictor_CNN = dlib.shape_predictor(os.path.join(model_dir, "shape_predictor_68_face_landmarks.dat"))
+
+
+
+## facial attractiveness score
+
+def calculate_distance(point1, point2):
+    return np.sqrt((point1[0] - point2[0])**2 + (point1[1] - point2[1])**2)
+
+# two courts
+def calculate_two_courts(landmarks):
+    # eyebow_center to lowest_nose
+    eyebrow_center = ((landmarks[21] + landmarks[22]) / 2).astype(int)
+    midcourt = calculate_distance(eyebrow_center, landmarks[33])
+    # lowest_nose to jaw
+    lowcourt = calculate_distance(landmarks[33], landmarks[8])
+
+    # two courts height
+    total_height = midcourt + lowcourt
+
+    return [midcourt/total_height, lowcourt/total_height]
+
+# five eyes
+def calculate_five_eyes(landmarks):
+    left_eye = calculate_distance(landmarks[36], landmarks[39])
+    right_eye = calculate_distance(landmarks[42], landmarks[45])
+    eye_distance = calculate_distance(landmarks[39], landmarks[42])
+    left_face = calculate_distance(landmarks[0], landmarks[36])
+    right_face = calculate_distance(landmarks[45], landmarks[16])
+
+    # five eyes width
+    face_width = calculate_distance(landmarks[0], landmarks[16])
+
+    return [left_face/face_width, left_eye/face_width, eye_distance/face_width, right_eye/face_width, right_face/face_width]
+
+# calculate attractiveness_score
+def calculate_attractiveness_score(two_courts, five_eyes):
+    full_score = 100
+    minus_score = 0
+
+    # ideal ratio
+    ideal_two_courts = [0.5, 0.5]
+    ideal_five_eyes = [0.2, 0.2, 0.2, 0.2, 0.2]
+    # minus score
+    minus_score += sum([abs(a-b) * 100 for a, b in zip(two_courts, ideal_two_courts)])
+    minus_score += sum([abs(a-b) * 100 for a, b in zip(five_eyes, ideal_five_eyes)])
+
+    # final score
+    final_score = max(0, full_score - int(minus_score))
+
+    return final_score
+
+## facial attractiveness score (batch of faces)
+
+# same results as the functions above for landmarks of shape (N, 68, 2), the order of operations is kept so the floats match exactly
+def calculate_distance_batch(point1, point2):
+    return np.sqrt((point1[:, 0] - point2[:, 0])**2 + (point1[:, 1] - point2[:, 1])**2)
+
+# two courts: (N, 2)
+def calculate_two_courts_batch(landmarks):
+    # eyebow_center to lowest_nose
+    eyebrow_center = ((landmarks[:, 21] + landmarks[:, 22]) / 2).astype(int)
+    midcourt = calculate_distance_batch(eyebrow_center, landmarks[:, 33])
+    # lowest_nose to jaw
+    lowcourt = calculate_distance_batch(landmarks[:, 33], landmarks[:, 8])
+
+    # two courts height
+    total_height = midcourt + lowcourt
+
+    return np.stack([midcourt/total_height, lowcourt/total_height], axis = 1)
+
+# five eyes: (N, 5)
+def calculate_five_eyes_batch(landmarks):
+    left_eye = calculate_distance_batch(landmarks[:, 36], landmarks[:, 39])
+    right_eye = calculate_distance_batch(landmarks[:, 42], landmarks[:, 45])
+    eye_distance = calculate_distance_batch(landmarks[:, 39], landmarks[:, 42])
+    left_face = calculate_distance_batch(landmarks[:, 0], landmarks[:, 36])
+    right_face = calculate_distance_batch(landmarks[:, 45], landmarks[:, 16])
+
+    # five eyes width
+    face_width = calculate_distance_batch(landmarks[:, 0], landmarks[:, 16])
+
+    return np.stack([left_face/face_width, left_eye/face_width, eye_distance/face_width, right_eye/face_width, right_face/face_width], axis = 1)
+
+# attractiveness_score: (N,)
+def calculate_attractiveness_score_batch(two_courts, five_eyes):
+    full_score = 100
+
+    # minus score (summed left to right like the built-in sum)
+    minus_two_courts = np.abs(two_courts - 0.5) * 100
+    minus_five_eyes = np.abs(five_eyes - 0.2) * 100
+    minus_score = minus_two_courts[:, 0] + minus_two_courts[:, 1]
+    minus_score = minus_score + (((minus_five_eyes[:, 0] + minus_five_eyes[:, 1]) + minus_five_eyes[:, 2]) + minus_five_eyes[:, 3]) + minus_five_eyes[:, 4]
+
+    # final score (int() truncates toward zero)
+    final_score = np.maximum(0, full_score - np.trunc(minus_score).astype(int))
+
+    return final_score
+
+# all ratios and scores for a batch of landmarks
+def score_landmarks_batch(landmarks):
+    landmarks = np.asarray(landmarks)
+    two_courts = calculate_two_courts_batch(landmarks)
+    five_eyes = calculate_five_eyes_batch(landmarks)
+
+    return {"two_courts": two_courts,
+            "five_eyes": five_eyes,
+            "score": calculate_attractiveness_score_batch(two_courts, five_eyes)}
+
+# landmark points of a dlib shape as an (68, 2) array
+def shape_to_array(shape):
+    return np.array([[p.x, p.y] for p in shape.parts()])
+
+
+
+# decode an image once into a grayscale buffer (nothing is written back to disk)
+def load_gray_image(image_path):
+    with open(image_path, "rb") as file:
+        data = np.frombuffer(file.read(), dtype = np.uint8)
+
+    # jpg, png, bmp: same pixels as cv2.imread
+    img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if img is not None:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    # other formats (gif, webp, tiff, ...): decode with PIL
+    with Image.open(image_path) as img:
+        # flatten palette and transparent images to RGB before converting to gray
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            img = img.convert("RGBA").convert("RGB")
+        rgb = np.asarray(img.convert("RGB"))
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+
+# calculate attractiveness_score from 68 face landmarks (dlib shape or (68, 2) array)
+def score_landmarks(landmarks):
+    if not isinstance(landmarks, np.ndarray):
+        landmarks = shape_to_array(landmarks)
+
+    two_courts = calculate_two_courts(landmarks)
+    five_eyes = calculate_five_eyes(landmarks)
+    attractiveness_score = calculate_attractiveness_score(two_courts, five_eyes)
+
+    return attractiveness_score
+
+# calculate attractiveness_score for each image: HOG + Linear SVM face detector
+# phases: dict that gets the seconds of detect, landmarks & score (None = not timed)
+def analyze_face(gray, phases = None):
+    faces = instrument.timed(phases, "HOG_detect", detector, gray)
+    landmarks = instrument.timed(phases, "HOG_landmarks", predictor, gray, faces[0])
+
+    return instrument.timed(phases, "HOG_score", score_landmarks, landmarks)
+
+# calculate attractiveness_score for each image: MMOD CNN face detector
+def analyze_face_CNN(gray, phases = None):
+    dets = instrument.timed(phases, "CNN_detect", detector_CNN, gray)
+
+    # the first face
+    face_rect = dets[0].rect
+    landmarks = instrument.timed(phases, "CNN_landmarks", predictor_CNN, gray, face_rect)
+
+    return instrument.timed(phases, "CNN_score", score_landmarks, landmarks)
+
+
+
+## scoring engine
+
+# version of the score formula, bump it when calculate_* changes so cached scores are recalculated
+SCORE_VERSION = 1
+
+# attractiveness score function of each detector
+analyzers = {"HOG": analyze_face, "CNN": analyze_face_CNN}
+
+# calculate the scores of one image: {detector: score}, score is None if no face is found
+# a detector that fails with an error (e.g. an unreadable or truncated file) gets no score, so it is not cached and the next run retries it
+def score_image(image_path, detectors = ("HOG", "CNN")):
+    image = Path(image_path)
+    phases = {}
+    # all detectors share one decoded image
+    gray = decode_image(image, phases)
+    if gray is None:
+        return {}
+    return score_gray(image, gray, detectors, phases)
+
+# decode an image for scoring, None if it can not be read (phases gets the decode time)
+def decode_image(image, phases = None):
+    try:
+        return instrument.timed(phases, "decode", load_gray_image, image)
+    except Exception as e:
+        print(f"Error - {image}: {str(e)}")
+        instrument.failure("unreadable_image", image, e)
+        return None
+
+# calculate the scores of an image that is already decoded (e.g. by the prefetching scorer)
+def score_gray(image, gray, detectors = ("HOG", "CNN"), phases = None):
+    phases = {} if phases is None else phases
+    scores = {}
+    for name in detectors:
+        try:
+            scores[name] = analyzers[name](gray, phases)
+        except Exception as e:
+            print(f"Error - {image} ({name}): {str(e)}")
+            kind = instrument.failure_kind(e)
+            instrument.failure(kind, image, e, name)
+            # only "no face found" is a score, other errors are retried
+            if kind == "no_face":
+                scores[name] = None
+    instrument.record_image(image, phases, scores)
+    return scores
+
+## batched MMOD CNN face detector
+
+# working size of batched CNN detection: larger images are downscaled to this longer side (if no max_size is given)
+batch_max_size = 1024
+# square canvases the images are padded onto, so images of mixed sizes share a few buckets
+bucket_sizes = (256, 512, 1024)
+# most canvas pixels per CNN forward pass (the MMOD CNN needs about 1.2 GB for one 1024 x 1024 canvas)
+batch_pixels = int(os.environ.get("CNN_BATCH_PIXELS", 4 * 1024 * 1024))
+
+# side of the square bucket canvas of an image side (multiples of the largest bucket above it)
+def bucket_side(size):
+    for side in bucket_sizes:
+        if size <= side:
+            return side
+    return -(-size // bucket_sizes[-1]) * bucket_sizes[-1]
+
+# downscale an image to max_size (if larger) and pad it onto its square bucket canvas: (canvas, scale)
+def fit_to_bucket(gray, max_size = batch_max_size):
+    scale = 1.0
+    if max(gray.shape) > max_size:
+        scale = max_size / max(gray.shape)
+        gray = cv2.resize(gray, (round(gray.shape[1] * scale), round(gray.shape[0] * scale)), interpolation = cv2.INTER_AREA)
+
+    side = bucket_side(max(gray.shape))
+    # padding is added at the bottom and right, so face coordinates do not move
+    canvas = np.zeros((side, side), dtype = gray.dtype)
+    canvas[:gray.shape[0], :gray.shape[1]] = gray
+
+    return canvas, scale
+
+# first face of each image in original image coordinates (None if no face is found)
+# images of the same bucket go through the CNN together, at most batch_size images and batch_pixels pixels per forward pass
+def detect_faces_CNN_batch(grays, batch_size = 16, max_size = None):
+    fitted = [fit_to_bucket(gray, max_size or batch_max_size) for gray in grays]
+    buckets = {}
+    for i, (canvas, scale) in enumerate(fitted):
+        buckets.setdefault(canvas.shape, []).append(i)
+
+    face_rects = [None] * len(grays)
+    for shape, indexes in buckets.items():
+        step = max(1, min(batch_size, batch_pixels // (shape[0] * shape[1])))
+        for start in range(0, len(indexes), step):
+            batch = indexes[start:start + step]
+            dets = detector_CNN([fitted[i][0] for i in batch], 0, len(batch))
+            for i, image_dets in zip(batch, dets):
+                if len(image_dets) > 0:
+                    # map the rect back to the original image
+                    rect = image_dets[0].rect
+                    scale = fitted[i][1]
+                    face_rects[i] = dlib.rectangle(int(rect.left() / scale), int(rect.top() / scale), int(rect.right() / scale), int(rect.bottom() / scale))
+    return face_rects
+
+# calculate the scores of a chunk of images one at a time
+def score_image_chunk(jobs):
+    return [score_image(image, names) for image, names in jobs]
+
+# calculate the scores of many images with batched CNN detection: [{detector: score}, ...]
+def score_image_batch(jobs, batch_size = 16, max_size = None):
+    grays = []
+    scores = []
+    phases = [{} for job in jobs]
+    for (image, names), image_phases in zip(jobs, phases):
+        try:
+            grays.append(instrument.timed(image_phases, "decode", load_gray_image, image))
+            scores.append({})
+        except Exception as e:
+            print(f"Error - {image}: {str(e)}")
+            instrument.failure("unreadable_image", image, e)
+            grays.append(None)
+            scores.append({})
+
+    # HOG + Linear SVM face detector, one image at a time
+    for (image, names), gray, image_scores, image_phases in zip(jobs, grays, scores, phases):
+        if gray is not None and "HOG" in names:
+            try:
+                image_scores["HOG"] = analyze_face(gray, image_phases)
+            except Exception as e:
+                print(f"Error - {image} (HOG): {str(e)}")
+                kind = instrument.failure_kind(e)
+                instrument.failure(kind, image, e, "HOG")
+                if kind == "no_face":
+                    image_scores["HOG"] = None
+
+    # MMOD CNN face detector, in batches (the batch time is shared equally by its images)
+    cnn = [i for i, (image, names) in enumerate(jobs) if grays[i] is not None and "CNN" in names]
+    batch_phases = {}
+    face_rects = instrument.timed(batch_phases, "CNN_detect", detect_faces_CNN_batch, [grays[i] for i in cnn], batch_size, max_size)
+    for i, face_rect in zip(cnn, face_rects):
+        phases[i]["CNN_detect"] = batch_phases["CNN_detect"] / len(cnn)
+        if face_rect is None:
+            print(f"Error - {jobs[i][0]} (CNN): no face found")
+            instrument.failure("no_face", jobs[i][0], stage = "CNN")
+            scores[i]["CNN"] = None
+        else:
+            landmarks = instrument.timed(phases[i], "CNN_landmarks", predictor_CNN, grays[i], face_rect)
+            scores[i]["CNN"] = instrument.timed(phases[i], "CNN_score", score_landmarks, landmarks)
+
+    for (image, names), gray, image_scores, image_phases in zip(jobs, grays, scores, phases):
+        if gray is not None:
+            instrument.record_image(image, image_phases, image_scores)
+    return scores
+
+## HOG-first detector cascade
+
+# downscale an image so its longer side is at most max_size: (image, scale)
+def resize_max(gray, max_size):
+    scale = min(1.0, max_size / max(gray.shape))
+    if scale < 1.0:
+        gray = cv2.resize(gray, (round(gray.shape[1] * scale), round(gray.shape[0] * scale)), interpolation = cv2.INTER_AREA)
+    return gray, scale
+
+# map a rect from a resized (and cropped) image back to the original image
+def original_rect(rect, scale, left = 0, top = 0):
+    return dlib.rectangle(int(left + rect.left() / scale), int(top + rect.top() / scale), int(left + rect.right() / scale), int(top + rect.bottom() / scale))
+
+# first CNN face in the original image: inside the padded HOG face region if there is one, else a full scan of the small image
+def detect_face_CNN_cascade(gray, small, scale, hog_rect, padding = 0.5, roi_size = 400):
+    if hog_rect is not None:
+        # padded region around the HOG face, cut from the original image and resized to at most roi_size
+        pad_x = int(hog_rect.width() * padding)
+        pad_y = int(hog_rect.height() * padding)
+        left = max(0, hog_rect.left() - pad_x)
+        top = max(0, hog_rect.top() - pad_y)
+        right = min(gray.shape[1], hog_rect.right() + pad_x)
+        bottom = min(gray.shape[0], hog_rect.bottom() + pad_y)
+        roi, roi_scale = resize_max(np.ascontiguousarray(gray[top:bottom, left:right]), roi_size)
+        dets = detector_CNN(roi)
+        if len(dets) > 0:
+            return original_rect(dets[0].rect, roi_scale, left, top)
+
+    # full CNN scan when HOG finds nothing (or there is no CNN face in the region)
+    dets = detector_CNN(small)
+    if len(dets) > 0:
+        return original_rect(dets[0].rect, scale)
+    return None
+
+# calculate the scores of one image with the cascade: detection runs on a copy downscaled to max_size,
+# landmarks run on the original image so the scores are in original coordinates
+def score_image_cascade(image_path, detectors = ("HOG", "CNN"), max_size = 800):
+    image = Path(image_path)
+    phases = {}
+    gray = decode_image(image, phases)
+    if gray is None:
+        return {}
+    return score_gray_cascade(image, gray, detectors, max_size, phases)
+
+# cascade scores of an image that is already decoded
+def score_gray_cascade(image, gray, detectors = ("HOG", "CNN"), max_size = 800, phases = None):
+    phases = {} if phases is None else phases
+    small, scale = instrument.timed(phases, "resize", resize_max, gray, max_size)
+
+    # HOG + Linear SVM face detector on the small image
+    faces = instrument.timed(phases, "HOG_detect", detector, small)
+    hog_rect = original_rect(faces[0], scale) if len(faces) > 0 else None
+
+    scores = {}
+    if "HOG" in detectors:
+        if hog_rect is None:
+            print(f"Error - {image} (HOG): no face found")
+            instrument.failure("no_face", image, stage = "HOG")
+            scores["HOG"] = None
+        else:
+            landmarks = instrument.timed(phases, "HOG_landmarks", predictor, gray, hog_rect)
+            scores["HOG"] = instrument.timed(phases, "HOG_score", score_landmarks, landmarks)
+
+    # MMOD CNN face detector, guided by the HOG face
+    if "CNN" in detectors:
+        cnn_rect = instrument.timed(phases, "CNN_detect", detect_face_CNN_cascade, gray, small, scale, hog_rect)
+        if cnn_rect is None:
+            print(f"Error - {image} (CNN): no face found")
+            instrument.failure("no_face", image, stage = "CNN")
+            scores["CNN"] = None
+        else:
+            landmarks = instrument.timed(phases, "CNN_landmarks", predictor_CNN, gray, cnn_rect)
+            scores["CNN"] = instrument.timed(phases, "CNN_score", score_landmarks, landmarks)
+
+    instrument.record_image(image, phases, scores)
+    return scores
+
+# calculate the scores of a chunk of images with the cascade
+def score_image_cascade_chunk(jobs, max_size = 800):
+    return [score_image_cascade(image, names, max_size) for image, names in jobs]
+
+# score_CNN of one image with the exhaustive path and with the cascade, and the time each takes
+def compare_cascade_image(image_path, max_size = 800):
+    image = Path(image_path)
+    start = time.perf_counter()
+    exhaustive = score_image(image, ("CNN",)).get("CNN")
+    middle = time.perf_counter()
+    cascade = score_image_cascade(image, ("CNN",), max_size).get("CNN")
+    end = time.perf_counter()
+
+    return {"ID": image.stem,
+            "score_CNN": exhaustive,
+            "score_CNN_cascade": cascade,
+            "diff": cascade - exhaustive if exhaustive is not None and cascade is not None else None,
+            "seconds": round(middle - start, 4),
+            "seconds_cascade": round(end - middle, 4)}
+
+# report how much score_CNN from the cascade differs from the exhaustive path: (rows, summary)
+def cascade_report(folder, workers = 1, model_dir = "../data/raw/dlib_model", max_size = 800):
+    images = sorted(image for image in Path(folder).iterdir() if image.is_file())
+    task = partial(compare_cascade_image, max_size = max_size)
+    if workers <= 1:
+        if detector is None:
+            load_models(model_dir)
+        rows = [task(image) for image in images]
+    else:
+        with ProcessPoolExecutor(max_workers = workers, initializer = load_models, initargs = (model_dir,)) as executor:
+            rows = list(executor.map(task, images))
+
+    diffs = np.array([row["diff"] for row in rows if row["diff"] is not None])
+    seconds = sum(row["seconds"] for row in rows)
+    seconds_cascade = sum(row["seconds_cascade"] for row in rows)
+    summary = {"images": len(rows),
+               "scored_both": len(diffs),
+               # faces found by only one of the two paths
+               "found_exhaustive_only": sum(row["score_CNN"] is not None and row["score_CNN_cascade"] is None for row in rows),
+               "found_cascade_only": sum(row["score_CNN"] is None and row["score_CNN_cascade"] is not None for row in rows),
+               "identical": int((diffs == 0).sum()),
+               "mean_abs_diff": round(float(np.abs(diffs).mean()), 4) if len(diffs) else None,
+               "max_abs_diff": int(np.abs(diffs).max()) if len(diffs) else None,
+               "speedup": round(seconds / seconds_cascade, 2) if seconds_cascade else None}
+
+    return rows, summary
+
+
+
+# image size from the file header (no decoding), used to put images of the same size in one batch
+def image_size(image_path):
+    try:
+        with Image.open(image_path) as img:
+            return img.size
+    except Exception:
+        return (0, 0)
+
+# score (image_path, detectors) jobs in this process or in a pool of processes that each load the models once
+# cnn_batch_size > 1 runs the CNN detector on batches of images padded onto bucket canvases (downscaled to cnn_max_size or batch_max_size)
+# cnn_max_size alone downscales large images before CNN detection
+# cascade_max_size runs the HOG-first cascade with detection on images downscaled to cascade_max_size (cnn_* are ignored)
+def run_scoring(jobs, workers = 1, model_dir = "../data/raw/dlib_model", cnn_batch_size = 1, cnn_max_size = None, cascade_max_size = None):
+    if cascade_max_size is not None:
+        cnn_batch_size = 1
+        chunks = [[job] for job in jobs]
+        task = partial(score_image_cascade_chunk, max_size = cascade_max_size)
+    elif cnn_batch_size > 1:
+        # group images of the same size, score them in chunks and put the results back in job order
+        order = sorted(range(len(jobs)), key = lambda i: image_size(jobs[i][0]))
+        chunks = [[jobs[i] for i in order[start:start + cnn_batch_size]] for start in range(0, len(order), cnn_batch_size)]
+        task = partial(score_image_batch, batch_size = cnn_batch_size, max_size = cnn_max_size)
+    elif cnn_max_size is not None:
+        chunks = [[job] for job in jobs]
+        task = partial(score_image_batch, batch_size = 1, max_size = cnn_max_size)
+    else:
+        chunks = [[job] for job in jobs]
+        task = score_image_chunk
+
+    if workers <= 1 or len(chunks) <= 1:
+        if detector is None:
+            load_models(model_dir)
+        chunk_scores = [task(chunk) for chunk in chunks]
+    else:
+        # small chunks keep slow CNN images spread across workers
+        chunksize = max(1, len(chunks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers = workers, initializer = load_models, initargs = (model_dir,)) as executor:
+            chunk_scores = list(executor.map(task, chunks, chunksize = chunksize))
+
+    scores = [image_scores for chunk in chunk_scores for image_scores in chunk]
+    if cnn_batch_size > 1:
+        job_scores = [None] * len(jobs)
+        for position, i in enumerate(order):
+            job_scores[i] = scores[position]
+        scores = job_scores
+    return scores
+
+# cache keys of the detectors with the given settings
+def cache_models(model_dir = "../data/raw/dlib_model", cnn_max_size = None, cascade_max_size = None, cnn_batch_size = 1):
+    models = score_cache.model_hashes(model_dir, dlib.__version__)
+    # downscaled or padded detection gives different scores than full size detection
+    if cascade_max_size is not None:
+        models = {name: score_cache.variant_hash(model_hash, f"cascade={cascade_max_size}") for name, model_hash in models.items()}
+    elif cnn_batch_size > 1 or cnn_max_size is not None:
+        sizes = ",".join(str(side) for side in bucket_sizes)
+        models["CNN"] = score_cache.variant_hash(models["CNN"], f"max_size={cnn_max_size or batch_max_size};buckets={sizes}")
+    return models
+
+# calculate scores for all images in a folder
+# cache: connection from score_cache.open_cache(), only new or changed images are scored
+# cnn_batch_size, cnn_max_size, cascade_max_size: see run_scoring
+# exclude: images that are not scored (e.g. rejected by the pre-screen), they get no row
+def score_folder(folder, workers = 1, model_dir = "../data/raw/dlib_model", cache = None, cnn_batch_size = 1, cnn_max_size = None, cascade_max_size = None, exclude = None):
+    # sort by file name so the output order is the same for any number of workers
+    exclude = {Path(image) for image in exclude or []}
+    images = sorted(image for image in Path(folder).iterdir() if image.is_file() and image not in exclude)
+    detectors = tuple(analyzers)
+
+    scores = [{} for image in images]
+    if cache is not None:
+        models = cache_models(model_dir, cnn_max_size, cascade_max_size, cnn_batch_size)
+        hashes = [score_cache.file_hash(image) for image in images]
+        cached = score_cache.get_scores(cache, set(hashes), models, SCORE_VERSION)
+        for i, image_hash in enumerate(hashes):
+            scores[i] = {name: cached[(image_hash, name)] for name in detectors if (image_hash, name) in cached}
+
+    # only score the detectors that are not cached
+    todo = [i for i in range(len(images)) if len(scores[i]) < len(detectors)]
+    jobs = [(images[i], tuple(name for name in detectors if name not in scores[i])) for i in todo]
+    new_scores = run_scoring(jobs, workers, model_dir, cnn_batch_size, cnn_max_size, cascade_max_size)
+    for i, image_scores in zip(todo, new_scores):
+        scores[i].update(image_scores)
+
+    # detectors that failed with an error have no score and are not cached
+    if cache is not None and todo:
+        score_cache.put_scores(cache, {(hashes[i], name): score for i, image_scores in zip(todo, new_scores) for name, score in image_scores.items()}, models, SCORE_VERSION)
+
+    results = []
+    for image, image_scores in zip(images, scores):
+        if image_scores.get("HOG") is not None and image_scores.get("CNN") is not None:
+            results.append({"ID": image.stem, "score": image_scores["HOG"], "score_CNN": image_scores["CNN"]})
+    return results
@@ -0,0 +1,80 @@
+# This file contains functions and methods that are used to build the analysis features in one vectorized pass
+import numpy as np
+import pandas as pd
+
+
+
+## thresholds
+
+# city_type thresholds of each election year: urban = income & population at or above the urban thresholds,
+# rural = income & population below the rural thresholds, otherwise transition
+city_thresholds = {2018: {"urban_income": 100000, "urban_population": 760000, "rural_income": 75000, "rural_population": 720000}}
+# years that are not listed
+default_city_thresholds = {"urban_income": 100000, "urban_population": 760000, "rural_income": 75000, "rural_population": 730000}
+
+city_types = np.array(["rural", "transition", "urban"], dtype = object)
+
+# education level: 3 = master & above, 2 = bachelor, 1 = high school
+edu_levels = {"Master": 3, "Doctor": 3, "Bachelor": 2, "High_school": 1}
+# parties of Other (neither Republican nor Democratic)
+other_parties = ["Green", "No party preference"]
+
+# age groups (right-closed bins)
+age_bins = [0, 40, 50, 60, 70, 100]
+age_labels = ["<40", "40-50", "50-60", "60-70", ">70"]
+
+# variables with 0/1 dummies, e.g. Gender_F & Gender_M
+dummy_variables = ["Incumbent", "Gender", "city_type"]
+
+
+
+## features
+
+# value of a lookup table for each code, code -1 (missing) gets the missing value
+def lookup(codes, table, missing):
+    return np.append(table, missing)[codes]
+
+# city_type codes (0 rural, 1 transition, 2 urban) from median household income, population and the thresholds of each year
+def city_type_codes(income, population, years):
+    year_codes, year_values = pd.factorize(years)
+    thresholds = {name: lookup(year_codes, [city_thresholds.get(year, default_city_thresholds)[name] for year in year_values], default_city_thresholds[name])
+                  for name in default_city_thresholds}
+    urban = (income >= thresholds["urban_income"]) & (population >= thresholds["urban_population"])
+    rural = (income < thresholds["rural_income"]) & (population < thresholds["rural_population"])
+    return np.select([urban, rural], [2, 0], default = 1)
+
+# 0/1 columns of the values present, in sorted order like pd.get_dummies: codes index values, missing values are -1
+def dummy_columns(name, codes, values):
+    return {f"{name}_{values[code]}": (codes == code).astype(int) for code in np.unique(codes[codes >= 0])}
+
+# candidate IDs from Series of states, districts and numbers: state_district_number, e.g. CA_1_2
+def candidate_ids(states, districts, numbers):
+    return states.astype(str) + "_" + districts.astype(str) + "_" + numbers.astype(str)
+
+# analysis features of the final dataset, added in one concat:
+# Agesq, Edu_Level, education & party flags, city_type, the dummies and Age_Group
+def build_features(data):
+    features = {"Agesq": data["Age"] ** 2,
+                "Edu_Level": data["Edu"].map(edu_levels)}
+
+    # education & party flags from the codes of the values, not a string comparison per row
+    edu_codes, edu_values = pd.factorize(data["Edu"])
+    features["Master & Above"] = lookup(edu_codes, edu_values.isin(["Master", "Doctor"]), False).astype(int)
+    features["College"] = lookup(edu_codes, edu_values == "Bachelor", False).astype(int)
+    features["High School"] = lookup(edu_codes, edu_values == "High_school", False).astype(int)
+    party_codes, party_values = pd.factorize(data["Party"])
+    features["Republican"] = lookup(party_codes, party_values == "Republican", False).astype(int)
+    features["Democratic"] = lookup(party_codes, party_values == "Democratic", False).astype(int)
+    features["Other"] = lookup(party_codes, party_values.isin(other_parties), False).astype(int)
+    # city_type
+    city_codes = city_type_codes(data["Median_Household_Income"].to_numpy(dtype = float), data["Pop_Total"].to_numpy(dtype = float), data["Year"].to_numpy())
+    features["city_type"] = city_types[city_codes]
+
+    # dummies
+    for name in dummy_variables:
+        codes, values = (city_codes, city_types) if name == "city_type" else pd.factorize(data[name], sort = True)
+        features.update(dummy_columns(name, codes, values))
+
+    # age groups
+    features["Age_Group"] = pd.cut(data["Age"], bins = age_bins, labels = age_labels)
+    return pd.concat([data, pd.DataFrame(features, index = data.index)], axis = 1)
@@ -1,11 +1,61 @@
 # This file contains functions and methods that are used to get the raw data
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import pandas as pd
 import os
+import re
+import json
+import hashlib
+import time
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+# HTTP response cache
+import http_cache
+# csv / Parquet datasets
+from storage import read_table, write_table, table_exists
+# candidate IDs
+from features import candidate_ids
+# trace of failures & HTTP traffic
+import instrument
 
 
 
+## HTTP session
+
+# Set User-Agent
+headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"}
+
+# shared session: pooled connections and retries with backoff for failed requests
+def make_session(pool_size = 16, retries = 3, backoff = 0.5):
+    session = requests.Session()
+    retry = Retry(total = retries, backoff_factor = backoff, status_forcelist = [429, 500, 502, 503, 504], allowed_methods = ["HEAD", "GET"], respect_retry_after_header = True)
+    adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size, max_retries = retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(headers)
+    return session
+
+# per host rate limit: next time a request to each host may start
+host_lock = threading.Lock()
+host_next_time = {}
+
+def wait_for_host(url, per_second):
+    if not per_second:
+        return
+    host = urlparse(url).netloc
+    with host_lock:
+        now = time.monotonic()
+        start = max(now, host_next_time.get(host, now))
+        host_next_time[host] = start + 1 / per_second
+    time.sleep(max(0, start - now))
+
+
+
+## election results
+
 # get original image url
 def get_original_image_url(thumb_url):
     # remove /thumb/
@@ -15,126 +65,306 @@ def get_original_image_url(thumb_url):
 
     return original_url
 
+# state abbreviation: state name used in Wikipedia page titles and table captions
+state_names = {"AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas", "CA": "California",
+               "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware", "FL": "Florida", "GA": "Georgia",
+               "HI": "Hawaii", "ID": "Idaho", "IL": "Illinois", "IN": "Indiana", "IA": "Iowa",
+               "KS": "Kansas", "KY": "Kentucky", "LA": "Louisiana", "ME": "Maine", "MD": "Maryland",
+               "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota", "MS": "Mississippi", "MO": "Missouri",
+               "MT": "Montana", "NE": "Nebraska", "NV": "Nevada", "NH": "New Hampshire", "NJ": "New Jersey",
+               "NM": "New Mexico", "NY": "New York", "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio",
+               "OK": "Oklahoma", "OR": "Oregon", "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina",
+               "SD": "South Dakota", "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont",
+               "VA": "Virginia", "WA": "Washington", "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming"}
+# states with a single at-large district (2012-2020 apportionment; Montana has 2 districts from 2022)
+at_large_states = {"AK", "DE", "MT", "ND", "SD", "VT", "WY"}
+
+# faster parser backend if installed
+try:
+    import lxml
+    html_parser = "lxml"
+except ImportError:
+    html_parser = "html.parser"
+
+# index of all district election tables {district: table}, built in one pass over the document
+def index_district_tables(soup, year, state_name):
+    # table header, e.g. "2018 California's 1st congressional district election" or "2018 Alaska's at-large congressional district election"
+    caption_pattern = re.compile(rf"{year} {re.escape(state_name)}'s (?:(\d+)(?:st|nd|rd|th)|at-large) congressional district election")
+
+    tables = {}
+    for caption in soup.find_all("caption"):
+        match = caption_pattern.fullmatch(caption.string or "")
+        if match:
+            table = caption.find_parent("table")
+            # at-large district = district 1
+            district = int(match.group(1) or 1)
+            # keep the first table of each district
+            if table and district not in tables:
+                tables[district] = table
+    return tables
+
+# cells of the infobox row labeled `label` (e.g. "Party" or "Popular vote"), else of the row at offset rows after the photo row
+def labeled_row(rows, label, photo_row, offset):
+    for row in rows:
+        header = row.find("th")
+        if header is not None and header.get_text(" ", strip = True).lower().startswith(label.lower()):
+            return row.find_all("td")
+    index = photo_row + offset
+    return rows[index].find_all("td") if 0 <= index < len(rows) else []
+
+# name of the current representative: the first link of the row after "Representative before election" (or 6 rows after the photo row)
+def current_representative(rows, photo_row):
+    row = rows[photo_row + 6] if photo_row + 6 < len(rows) else None
+    for i, candidate_row in enumerate(rows[:-1]):
+        if "before election" in candidate_row.get_text(" ", strip = True).lower():
+            row = rows[i + 1]
+            break
+    cells = row.find_all("td") if row is not None else []
+    if len(cells) < 2:
+        return None
+    link = cells[0].find("a")
+    return link.text.strip() if link is not None else cells[0].get_text(" ", strip = True) or None
+
+# candidates of one district election table
+# rows are found by their labels, or by their position after the photo row (the layout of the CA 2018 & 2020 pages)
+def parse_district_table(table, year, state, district):
+    rows = table.find_all("tr")[1:]
+
+    # candidate photo: first row with images (uncontested races may have none)
+    photo_row = next((i for i, row in enumerate(rows) if row.find("img") is not None), 2)
+    photo_columns = rows[photo_row].find_all("img") if photo_row < len(rows) else []
+    # candidate  name
+    name_columns = labeled_row(rows, "Nominee", photo_row, 1)
+    # candidate party
+    party_columns = labeled_row(rows, "Party", photo_row, 2)
+    # candidate vote
+    vote_columns = labeled_row(rows, "Popular vote", photo_row, 3)
+    # current representative
+    current_rep = current_representative(rows, photo_row)
+
+    candidates = []
+    for i in range(len(name_columns)):
+        # candidate  name
+        name = name_columns[i].text.strip()
+        # candidate photo
+        img_src = photo_columns[i]["src"] if i < len(photo_columns) else ""
+        photo_url = f"https:{img_src}" if img_src.startswith("//") else img_src
+        original_photo_url = get_original_image_url(photo_url)
+        # photo is not downloadable (original_photo_url end with ".svg") = False, else = True
+        downloadable = "F" if original_photo_url.lower().endswith(".svg") else "T"
+        # candidate party
+        party = party_columns[i].text.strip() if i < len(party_columns) else ""
+        # candidate vote
+        votes = vote_columns[i].text.strip() if i < len(vote_columns) else ""
+        # current representative (yes = 1, no = 0)
+        re_election = 1 if current_rep == name else 0
+
+        candidates.append({"Year": year,
+                           "State": state,
+                           "District": district,
+                           "Name": name,
+                           "Photo": original_photo_url,
+                           "Photo_Downloadable": downloadable,
+                           "Party": party,
+                           "Votes": votes,
+                           "Incumbent": re_election})
+    return candidates
+
+# Wikipedia page of a state's House election
+def house_election_url(state, year):
+    state_name = state_names[state].replace(" ", "_")
+    if state in at_large_states:
+        return f"https://en.wikipedia.org/wiki/{year}_United_States_House_of_Representatives_election_in_{state_name}"
+    return f"https://en.wikipedia.org/wiki/{year}_United_States_House_of_Representatives_elections_in_{state_name}"
+
+# House election results of a state from its Wikipedia page content, districts are found from the page
+def parse_house_election(content, state, year):
+    # only the tables are parsed
+    soup = BeautifulSoup(content, html_parser, parse_only = SoupStrainer("table"))
+    tables = index_district_tables(soup, year, state_names[state])
+
+    house_data = []
+    for district in sorted(tables):
+        # a district table of another layout is skipped, the other districts of the page are kept
+        try:
+            candidates = parse_district_table(tables[district], year, state, district)
+        except Exception as e:
+            print(f"Error - {state} {year} district {district}: {str(e)}")
+            instrument.failure("malformed_table", f"{state}_{year}_{district}", e, "scrape")
+            continue
+        if not candidates:
+            instrument.failure("no_candidates", f"{state}_{year}_{district}", stage = "scrape")
+        house_data += candidates
+
+    house_election_df = pd.DataFrame(house_data, columns = ["Year", "State", "District", "Name", "Photo", "Photo_Downloadable", "Party", "Votes", "Incumbent"])
+    house_election_df = house_election_df[house_election_df["Name"] != ""]
+
+    return house_election_df
+
+# get House Election Result of any state and year
+def house_election(state, year, url = None, session = None):
+    url = url or house_election_url(state, year)
+    if session is None:
+        with make_session(pool_size = 1) as session:
+            response = http_cache.cached_get(session, url)
+    else:
+        response = http_cache.cached_get(session, url)
+    response.raise_for_status()
+
+    return parse_house_election(response.content, state, year)
+
 # get California House Election Result
 def CA_house_election(url, year):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.content, "html.parser")
-
-    CA_house_data = []
-
-    for district in range(1, 54):
-        suffix = ("st" if district in [1, 21, 31, 41, 51] else
-                  "nd" if district in [2, 22, 32, 42, 52] else
-                  "rd" if district in [3, 23, 33, 43, 53] else "th")
-    
-        # table header
-        header = soup.find("caption", string = f"{year} California's {district}{suffix} congressional district election")
-    
-        if header:
-            table = header.find_parent("table")
-            if table:
-                rows = table.find_all("tr")[1:]
-
-                # candidate  name
-                name_columns = rows[3].find_all("td")
-                # candidate photo
-                photo_columns = rows[2].find_all("img")
-                # candidate party
-                party_columns = rows[4].find_all("td")
-                # candidate vote
-                vote_columns = rows[5].find_all("td")
-                # current representative
-                current_rep_columns = rows[8].find_all("td")
-
-                for i in range(len(name_columns)):
-                    # candidate  name
-                    name = name_columns[i].text.strip()
-                    # candidate photo                
-                    img_src = photo_columns[i]["src"] if i < len(photo_columns) else ""
-                    photo_url = f"https:{img_src}" if img_src.startswith("//") else img_src
-                    original_photo_url = get_original_image_url(photo_url)
-                    # photo is not downloadable (original_photo_url end with ".svg") = False, else = True
-                    downloadable = "F" if original_photo_url.lower().endswith(".svg") else "T"
-                    # candidate party
-                    party = party_columns[i].text.strip() if i < len(party_columns) else ""
-                    # candidate vote
-                    votes = vote_columns[i].text.strip() if i < len(vote_columns) else ""
-                    # current representative (yes = 1, no = 0)
-                    if len(current_rep_columns) >= 2:
-                        current_rep = current_rep_columns[0].find("p").find("a").text.strip()
-                        re_election = 1 if current_rep == name else 0
-                    else:
-                        re_election = 0
-
-                    CA_house_data.append({"Year": year,
-                                          "State": "CA",
-                                          "District": district,
-                                          "Name": name,
-                                          "Photo": original_photo_url,
-                                          "Photo_Downloadable": downloadable,
-                                          "Party": party,
-                                          "Votes": votes,
-                                          "Incumbent": re_election})
-
-    CA_house_election_df = pd.DataFrame(CA_house_data)
-    CA_house_election_df = CA_house_election_df[CA_house_election_df["Name"] != ""]
-
-    return CA_house_election_df
-
-# call CA 2018 house election results
-url_2018 = "https://en.wikipedia.org/wiki/2018_United_States_House_of_Representatives_elections_in_California"
-CA_house_election_2018 = CA_house_election(url_2018, 2018)
-CA_house_election_2018["ID"] = CA_house_election_2018.groupby(["State", "District"]).cumcount() + 1
-CA_house_election_2018["ID"] = CA_house_election_2018.apply(lambda row: f"CA_{row["District"]}_{row["ID"]}", axis = 1)
-# call CA 2020 house election results
-url_2020 = "https://en.wikipedia.org/wiki/2020_United_States_House_of_Representatives_elections_in_California"
-CA_house_election_2020 = CA_house_election(url_2020, 2020)
-CA_house_election_2020["ID"] = CA_house_election_2020.groupby(["State", "District"]).cumcount() + 1
-CA_house_election_2020["ID"] = CA_house_election_2020.apply(lambda row: f"CA_{row["District"]}_{row["ID"]}", axis = 1)
-
-## save the results to csv file
-# create new folder
-output_dir = "../data/raw/election_result"
-os.makedirs(output_dir, exist_ok = True)
-# file path & save
-file_path_2018 = os.path.join(output_dir, "CA_house_election_2018.csv")
-file_path_2020 = os.path.join(output_dir, "CA_house_election_2020.csv")
-CA_house_election_2018.to_csv(file_path_2018, index = False, encoding = "utf-8")
-CA_house_election_2020.to_csv(file_path_2020, index = False, encoding = "utf-8")
+    return house_election("CA", year, url)
+
+# candidate ID: state_district_number, e.g. CA_1_2
+def add_candidate_ids(house_election_df):
+    numbers = house_election_df.groupby(["State", "District"]).cumcount() + 1
+    house_election_df["ID"] = candidate_ids(house_election_df["State"], house_election_df["District"], numbers)
+    return house_election_df
+
+# output folder of one state and year, partitioned as state=/year=
+def partition_dir(output_dir, state, year):
+    return os.path.join(output_dir, f"state={state}", f"year={year}")
+
+# scrape one state and year, skipped if the source page has not changed since the last scrape: (status, DataFrame)
+def scrape_partition(state, year, output_dir = "../data/raw/election_result", session = None):
+    if session is None:
+        with make_session(pool_size = 1) as session:
+            return scrape_partition(state, year, output_dir, session)
+
+    url = house_election_url(state, year)
+    response = http_cache.cached_get(session, url)
+    response.raise_for_status()
+
+    folder = partition_dir(output_dir, state, year)
+    csv_path = os.path.join(folder, "house_election.csv")
+    source_path = os.path.join(folder, "source.json")
+    page_hash = hashlib.sha256(response.content).hexdigest()
+
+    # same page as the last scrape: keep the saved partition
+    if table_exists(csv_path) and os.path.exists(source_path):
+        with open(source_path, "r", encoding = "utf-8") as file:
+            if json.load(file).get("sha256") == page_hash:
+                return "unchanged", read_table(csv_path)
+
+    house_election_df = add_candidate_ids(parse_house_election(response.content, state, year))
+    os.makedirs(folder, exist_ok = True)
+    write_table(house_election_df, csv_path)
+    with open(source_path, "w", encoding = "utf-8") as file:
+        json.dump({"url": url, "sha256": page_hash, "districts": int(house_election_df["District"].nunique())}, file, indent = 1)
+    return "scraped", house_election_df
+
+# scrape all states x years concurrently: {(state, year): DataFrame}
+def scrape_elections(states, years, output_dir = "../data/raw/election_result", max_workers = 8):
+    results = {}
+    session = make_session(pool_size = max_workers)
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = {executor.submit(scrape_partition, state, year, output_dir, session): (state, year) for state in states for year in years}
+        for future in as_completed(futures):
+            state, year = futures[future]
+            try:
+                status, results[(state, year)] = future.result()
+                print(f"{state} {year}: {status} ({len(results[(state, year)])} candidates)")
+            except Exception as e:
+                print(f"Error - {state} {year}: {str(e)}")
+                instrument.failure(instrument.failure_kind(e), f"{state} {year}", e, "scrape")
+    session.close()
+    return results
 
 
 
 ## save the photos
-def download_images(election_data, output_dir):
-    # Set User-Agent
-    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"}
-    
+
+# download one photo through the HTTP cache, the local file is only rewritten if the photo changed: (status, size)
+def download_image(session, photo_url, output_image_path, per_second = 10, timeout = 30):
+    exists = os.path.exists(output_image_path)
+    offline = http_cache.cache_mode == "offline-replay"
+
+    # photo downloaded before the HTTP cache was used: skip it if the server has the same size
+    if exists and http_cache.cache_mode == "online" and not http_cache.is_cached(photo_url):
+        wait_for_host(photo_url, per_second)
+        start = time.perf_counter()
+        response = session.head(photo_url, allow_redirects = True, timeout = timeout)
+        instrument.record_http(photo_url, response.status_code, 0, time.perf_counter() - start, method = "HEAD")
+        if response.status_code == 200 and response.headers.get("Content-Length") == str(os.path.getsize(output_image_path)):
+            return "skipped", os.path.getsize(output_image_path)
+    elif exists and offline and not http_cache.is_cached(photo_url):
+        return "skipped", os.path.getsize(output_image_path)
+
+    if not offline:
+        wait_for_host(photo_url, per_second)
+    response = http_cache.cached_get(session, photo_url, timeout = timeout)
+    if response.status_code != 200:
+        return response.status_code, None
+    if exists and os.path.getsize(output_image_path) == len(response.content):
+        return "skipped", len(response.content)
+
+    # write to a temporary file first so an interrupted download never leaves a broken photo
+    temp_path = output_image_path + ".part"
+    with open(temp_path, "wb") as file:
+        file.write(response.content)
+    os.replace(temp_path, output_image_path)
+    return "downloaded", len(response.content)
+
+# download photos concurrently: max_workers downloads at a time, at most per_second requests per second to each host
+def download_images(election_data, output_dir, max_workers = 8, per_second = 10, timeout = 30):
     os.makedirs(output_dir, exist_ok = True)
 
-    for index, row in election_data.iterrows():
-        photo_url = row["Photo"]
-        image_id = row["ID"]
-        # download images if Photo_Downloadable == T
-        if row["Photo_Downloadable"] == "T":
+    # download images if Photo_Downloadable == T
+    downloadable = election_data[election_data["Photo_Downloadable"] == "T"]
+    session = make_session(pool_size = max_workers)
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = {}
+        for photo_url, image_id in zip(downloadable["Photo"], downloadable["ID"]):
+            # image name: ID + filename extension
+            image_name = f"{image_id}{os.path.splitext(photo_url)[1]}"
+            output_image_path = os.path.join(output_dir, image_name)
+            future = executor.submit(download_image, session, photo_url, output_image_path, per_second, timeout)
+            futures[future] = image_id
+
+        for future in as_completed(futures):
+            image_id = futures[future]
             try:
-                response = requests.get(photo_url, headers = headers, stream = True)
-                if response.status_code == 200:
-                    # get filename extension
-                    image_extension = os.path.splitext(photo_url)[1]
-                    # image name
-                    image_name = f"{image_id}{image_extension}"
-                    output_image_path = os.path.join(output_dir, image_name)
-
-                    # download images
-                    with open(output_image_path, "wb") as file:
-                        for chunk in response.iter_content(1024):
-                            file.write(chunk)
-                else:
-                    print(f"Failed to download {image_id}: {response.status_code}")
+                status, size = future.result()
+                if size is None:
+                    print(f"Failed to download {image_id}: {status}")
+                    instrument.failure(f"http_{status}", image_id, stage = "download")
             except Exception as e:
                 print(f"Error - {image_id}: {str(e)}")
+                instrument.failure(instrument.failure_kind(e), image_id, e, "download")
+
+    session.close()
+
+
+## scrape election results & save the photos
+
+# states and election years to scrape, e.g. SCRAPE_STATES=CA,TX,NY SCRAPE_YEARS=2016,2018,2020
+default_states = os.environ.get("SCRAPE_STATES", "CA").split(",")
+default_years = [int(year) for year in os.environ.get("SCRAPE_YEARS", "2018,2020").split(",")]
+# results are saved in "../data/raw/election_result/state=CA/year=2018/house_election.csv"
+election_dir = "../data/raw/election_result"
+image_dir = "../data/raw/candidate_images"
+
+# scrape election results of all states x years, each state's results are also saved as {state}_house_election_{year}.csv (e.g. CA_house_election_2018.csv)
+def scrape(states = None, years = None, output_dir = election_dir):
+    elections = scrape_elections(states or default_states, years or default_years, output_dir)
+    for (state, year), house_election_df in sorted(elections.items()):
+        write_table(house_election_df, os.path.join(output_dir, f"{state}_house_election_{year}.csv"))
+    return elections
+
+# download the candidate photos of scraped election results
+def download(states = None, years = None, output_dir = election_dir, photo_dir = image_dir):
+    for state in states or default_states:
+        for year in years or default_years:
+            csv_path = os.path.join(partition_dir(output_dir, state, year), "house_election.csv")
+            if not table_exists(csv_path):
+                print(f"Error - {state} {year}: no election results, run scrape first")
+                continue
+            download_images(read_table(csv_path), f"{photo_dir}/{state}/{year}")
+
 
-# download CA 2018 Candidate Photos
-download_images(CA_house_election_2018, "../data/raw/candidate_images/CA/2018")
-# download CA 2020 Candidate Photos
-download_images(CA_house_election_2020, "../data/raw/candidate_images/CA/2020")
+if __name__ == "__main__":
+    scrape()
+    download()
@@ -0,0 +1,98 @@
+# This file contains functions and methods that are used to cache HTTP responses on disk
+import os
+import json
+import time
+import hashlib
+import requests
+from requests.structures import CaseInsensitiveDict
+# trace of HTTP bytes & latencies
+import instrument
+
+
+
+# cache modes
+#   online: fetch over the network, revalidating stored responses with ETag / Last-Modified (304 = use the stored body)
+#   refresh: always fetch the full response and overwrite the store
+#   offline-replay: serve everything from the store, never use the network
+cache_modes = ["online", "refresh", "offline-replay"]
+cache_mode = os.environ.get("HTTP_CACHE_MODE", "online")
+# a fixture directory with the same layout can stand in for the network in tests
+cache_dir = os.environ.get("HTTP_CACHE_DIR", "../data/raw/http_cache")
+
+def set_cache(mode = None, directory = None):
+    global cache_mode, cache_dir
+    if mode is not None:
+        if mode not in cache_modes:
+            raise ValueError(f"unknown HTTP cache mode: {mode} (use one of {cache_modes})")
+        cache_mode = mode
+    if directory is not None:
+        cache_dir = directory
+
+# file paths of a URL in the store: (body, metadata)
+def cache_paths(url):
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"{key}.body"), os.path.join(cache_dir, f"{key}.json")
+
+def is_cached(url):
+    return os.path.exists(cache_paths(url)[1])
+
+# stored response as a requests.Response, None if the URL is not in the store
+def load_response(url):
+    body_path, meta_path = cache_paths(url)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding = "utf-8") as file:
+        meta = json.load(file)
+    with open(body_path, "rb") as file:
+        content = file.read()
+
+    response = requests.Response()
+    response.url = meta["url"]
+    response.status_code = meta["status"]
+    response.headers = CaseInsensitiveDict(meta["headers"])
+    response._content = content
+    response._content_consumed = True
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    return response
+
+# save a 200 response (body + headers); the body is written first so the metadata only exists for complete entries
+def save_response(url, response):
+    os.makedirs(cache_dir, exist_ok = True)
+    body_path, meta_path = cache_paths(url)
+    # the body is stored decoded, so transfer headers no longer apply to it
+    headers = {key: value for key, value in response.headers.items() if key.lower() not in ("content-encoding", "transfer-encoding", "content-length")}
+    headers["Content-Length"] = str(len(response.content))
+    for path, data, mode in [(body_path, response.content, "wb"),
+                             (meta_path, json.dumps({"url": url, "status": response.status_code, "headers": headers, "fetched": time.time()}, indent = 1), "w")]:
+        temp_path = f"{path}.{os.getpid()}.part"
+        with open(temp_path, mode) as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+# GET through the cache
+def cached_get(session, url, timeout = 30, **kwargs):
+    start = time.perf_counter()
+    stored = load_response(url) if cache_mode != "refresh" else None
+
+    if cache_mode == "offline-replay":
+        if stored is None:
+            raise FileNotFoundError(f"not in HTTP cache ({cache_dir}): {url}")
+        instrument.record_http(url, stored.status_code, 0, time.perf_counter() - start, "cache")
+        return stored
+
+    headers = dict(kwargs.pop("headers", None) or {})
+    if stored is not None:
+        # conditional fetch: only transfer the body if it changed
+        if "ETag" in stored.headers:
+            headers["If-None-Match"] = stored.headers["ETag"]
+        if "Last-Modified" in stored.headers:
+            headers["If-Modified-Since"] = stored.headers["Last-Modified"]
+
+    response = session.get(url, headers = headers, timeout = timeout, **kwargs)
+    # bytes transferred over the network (the body of a 304 is empty)
+    instrument.record_http(url, response.status_code, len(response.content), time.perf_counter() - start, "revalidated" if response.status_code == 304 else "network")
+    if response.status_code == 304 and stored is not None:
+        return stored
+    if response.status_code == 200:
+        save_response(url, response)
+    return response
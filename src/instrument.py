@@ -0,0 +1,224 @@
+# This file contains functions and methods that are used to record the time, memory, failures and HTTP traffic of the pipeline
+# events are appended to a JSON-lines trace (one line per stage, image, failure or request) and summarized at the end of a run
+import os
+import sys
+import json
+import time
+import threading
+import cProfile
+from contextlib import contextmanager
+import numpy as np
+
+# peak memory is only available on Unix
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+
+## settings
+
+# JSON-lines trace, off unless TRACE_PATH is set (e.g. TRACE_PATH=../results/trace/trace.jsonl)
+trace_path = os.environ.get("TRACE_PATH") or None
+# stages profiled with cProfile, e.g. PROFILE_STAGES=score,analyze (written next to the trace as profile_{stage}_{run}.prof)
+profile_stages = [name for name in os.environ.get("PROFILE_STAGES", "").split(",") if name]
+profile_dir = "../results/trace"
+# ID of the run: set once and passed to worker processes through the environment, so their events belong to the same run
+run_id = os.environ.get("TRACE_RUN") or None
+
+# one line at a time from the threads of a process (worker processes append whole lines to the same file)
+trace_lock = threading.Lock()
+
+def start_run():
+    global run_id
+    if run_id is None:
+        run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        os.environ["TRACE_RUN"] = run_id
+
+def set_trace(path = None, profile = None):
+    global trace_path, profile_stages
+    if path:
+        trace_path = path
+        os.environ["TRACE_PATH"] = path
+    if profile is not None:
+        profile_stages = profile
+        os.environ["PROFILE_STAGES"] = ",".join(profile)
+    start_run()
+
+def enabled():
+    return trace_path is not None
+
+if trace_path:
+    start_run()
+
+
+
+## events
+
+# append one event to the trace (nothing is done if the trace is off)
+def record(event, **fields):
+    if trace_path is None:
+        return
+    line = json.dumps({"event": event, "run": run_id, "time": round(time.time(), 6), "pid": os.getpid(), **fields}, default = str)
+    with trace_lock:
+        os.makedirs(os.path.dirname(trace_path) or ".", exist_ok = True)
+        with open(trace_path, "a", encoding = "utf-8") as file:
+            file.write(line + "\n")
+
+# call function(*args) and add its seconds to phases[name] (phases None: only call it)
+def timed(phases, name, function, *args):
+    if phases is None:
+        return function(*args)
+    start = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        phases[name] = phases.get(name, 0) + time.perf_counter() - start
+
+# per-image phase latencies & scores of one image
+def record_image(image, phases, scores):
+    record("image", image = str(image), phases = {name: round(seconds, 6) for name, seconds in phases.items()}, scores = scores)
+
+# failure type of an exception: no_face (faces[0] of an empty detection), http_{status}, http_timeout, http_connection or the exception name
+def failure_kind(error):
+    if isinstance(error, IndexError):
+        return "no_face"
+    response = getattr(error, "response", None)
+    if response is not None and getattr(response, "status_code", None) is not None:
+        return f"http_{response.status_code}"
+    name = type(error).__name__
+    if "Timeout" in name:
+        return "http_timeout"
+    if name in ("ConnectionError", "ProxyError", "SSLError"):
+        return "http_connection"
+    return name
+
+# one failure of an item (image, photo, page), e.g. failure("no_face", image, stage = "CNN")
+def failure(kind, item, error = None, stage = None):
+    record("failure", kind = kind, item = str(item), stage = stage, error = str(error) if error is not None else None)
+
+# one HTTP request: source = network, revalidated (304, body from the cache) or cache (offline replay)
+def record_http(url, status, size, seconds, source = "network", method = "GET"):
+    record("http", url = url, method = method, status = status, bytes = size, seconds = round(seconds, 6), source = source)
+
+
+
+## stages
+
+# peak resident memory (MB) of this process, or of its finished child processes (e.g. the scoring workers)
+def peak_rss(children = False):
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+# wall time & peak memory of a stage, with cProfile if the stage is in profile_stages (or profile = True)
+# peak RSS is the peak of the whole process so far, stages that run in parallel threads share it
+@contextmanager
+def stage(name, profile = None):
+    profile = name in profile_stages if profile is None else profile
+    profiler = None
+    if profile:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # only one profiler can be active at a time (e.g. stages running in parallel)
+            print(f"Warning - {name}: not profiled ({str(e)})")
+            profiler = None
+
+    record("stage_start", stage = name)
+    start = time.perf_counter()
+    status = "failed"
+    try:
+        yield
+        status = "ok"
+    finally:
+        seconds = time.perf_counter() - start
+        profile_path = None
+        if profiler is not None:
+            profiler.disable()
+            folder = os.path.dirname(trace_path) if trace_path else profile_dir
+            os.makedirs(folder or ".", exist_ok = True)
+            profile_path = os.path.join(folder, f"profile_{name}_{run_id or os.getpid()}.prof")
+            profiler.dump_stats(profile_path)
+        record("stage", stage = name, status = status, seconds = round(seconds, 6),
+               peak_rss_mb = peak_rss(), children_peak_rss_mb = peak_rss(children = True), profile = profile_path)
+
+
+
+## summary
+
+# mean, median, p95, max & total of a list of seconds
+def latency_summary(values):
+    values = np.asarray(values, dtype = float)
+    return {"count": len(values), "mean": round(float(values.mean()), 6), "median": round(float(np.median(values)), 6),
+            "p95": round(float(np.percentile(values, 95)), 6), "max": round(float(values.max()), 6), "total": round(float(values.sum()), 6)}
+
+# events of one run of a trace (default: the current run, or the last run in the file)
+def read_trace(path = None, run = None):
+    path = path or trace_path
+    events = []
+    with open(path, "r", encoding = "utf-8") as file:
+        for line in file:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                # a line cut off by an interruption
+                continue
+    run = run or run_id or (events[-1]["run"] if events else None)
+    return [event for event in events if event.get("run") == run]
+
+# summary of a run: stages, per-image phase latencies & the slowest images, failure counts and HTTP traffic
+def summarize_trace(path = None, run = None, slowest = 10):
+    events = read_trace(path, run)
+    summary = {"run": run or run_id, "stages": {}, "images": {}, "slowest_images": [], "failures": {}, "http": {}}
+
+    for event in events:
+        if event["event"] == "stage":
+            summary["stages"][event["stage"]] = {name: event[name] for name in ("status", "seconds", "peak_rss_mb", "children_peak_rss_mb", "profile")}
+
+    images = [event for event in events if event["event"] == "image"]
+    phases = {}
+    for event in images:
+        for name, seconds in event["phases"].items():
+            phases.setdefault(name, []).append(seconds)
+    summary["images"] = {name: latency_summary(values) for name, values in sorted(phases.items())}
+    totals = sorted(((sum(event["phases"].values()), event["image"]) for event in images), reverse = True)
+    summary["slowest_images"] = [{"image": image, "seconds": round(seconds, 6)} for seconds, image in totals[:slowest]]
+
+    for event in events:
+        if event["event"] == "failure":
+            key = f"{event['kind']} ({event['stage']})" if event.get("stage") else event["kind"]
+            summary["failures"][key] = summary["failures"].get(key, 0) + 1
+
+    requests = [event for event in events if event["event"] == "http"]
+    if requests:
+        summary["http"] = {"requests": len(requests), "bytes": sum(event["bytes"] or 0 for event in requests),
+                           "latency": latency_summary([event["seconds"] for event in requests]),
+                           "by_source": {source: sum(event["source"] == source for event in requests) for source in sorted({event["source"] for event in requests})},
+                           "by_status": {str(status): sum(event["status"] == status for event in requests) for status in sorted({event["status"] for event in requests}, key = str)}}
+    return summary
+
+# write the summary of the current run next to the trace (trace.jsonl -> trace_summary.json) and print its main lines
+def write_summary(path = None):
+    path = path or trace_path
+    if path is None or not os.path.exists(path):
+        return None
+    summary = summarize_trace(path)
+    summary_path = f"{os.path.splitext(path)[0]}_summary.json"
+    with open(summary_path, "w", encoding = "utf-8") as file:
+        json.dump(summary, file, indent = 1)
+
+    for name, entry in summary["stages"].items():
+        print(f"{name}: {entry['seconds']:.1f}s, peak RSS {entry['peak_rss_mb']} MB ({entry['status']})")
+    for name, entry in summary["images"].items():
+        print(f"{name}: median {entry['median'] * 1000:.1f} ms, p95 {entry['p95'] * 1000:.1f} ms ({entry['count']} images)")
+    if summary["failures"]:
+        print("failures: " + ", ".join(f"{kind} {count}" for kind, count in sorted(summary["failures"].items())))
+    if summary["http"]:
+        print(f"HTTP: {summary['http']['requests']} requests, {summary['http']['bytes'] / 1e6:.1f} MB, median {summary['http']['latency']['median'] * 1000:.0f} ms")
+    print(f"Trace summary saved to {summary_path}")
+    return summary
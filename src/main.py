@@ -0,0 +1,162 @@
+# This file is the command line entry point of the project, e.g. python main.py score --workers 4
+# stage modules (and requests, dlib & OpenCV, statsmodels, matplotlib) are only imported by the subcommand that uses them
+import argparse
+import os
+
+
+
+## subcommands
+
+def run_scrape(args):
+    import get_data
+    get_data.scrape(args.states, args.years)
+
+def run_download(args):
+    import get_data
+    get_data.download(args.states, args.years)
+
+def run_demographics(args):
+    import clean_data
+    clean_data.demographics(args.states, args.years)
+
+def run_score(args):
+    import clean_data
+    # options that are not given keep the defaults of clean_data.py (environment variables)
+    options = {"workers": args.workers, "batch_size": args.cnn_batch_size, "max_size": args.cnn_max_size,
+               "cascade_size": args.cascade_max_size, "report": args.cascade_report or None, "prescreen": args.prescreen or None,
+               "stream": args.stream or None, "years": args.years}
+    clean_data.score(**{name: value for name, value in options.items() if value is not None})
+
+def run_merge(args):
+    import clean_data
+    clean_data.merge(args.years, states = args.states)
+
+def run_analyze(args):
+    import analyze_data
+    # options that are not given keep the defaults of analyze_data.py (environment variables)
+    options = {"methods": args.resampling, "replications": args.replications, "seed": args.seed, "workers": args.workers}
+    analyze_data.analyze(**{name: value for name, value in options.items() if value is not None})
+
+def run_sweep(args):
+    import spec_curve
+    spec_curve.sweep(grid = args.cut_grid, cuts = args.max_cuts, workers = args.workers)
+
+def run_plot(args):
+    import visualize_results
+    visualize_results.plot(by_year = args.by_year, workers = args.workers, force = args.force)
+
+def run_benchmark(args):
+    import benchmark
+    if args.compare:
+        benchmark.compare_benchmarks(*args.compare, threshold = args.threshold)
+    else:
+        benchmark.run_benchmark(args.stages, args.scales, repeat = args.repeat, images = args.images, seed = args.seed, output = args.output)
+
+def run_pipeline(args):
+    import pipeline
+    pipeline.run_pipeline(args.stages, {"states": args.states, "years": args.years}, force = args.force or [], skip = args.skip or [], jobs = args.jobs, dry_run = args.dry_run)
+
+commands = {"scrape": (run_scrape, "scrape House election results from Wikipedia"),
+            "download": (run_download, "download the candidate photos"),
+            "demographics": (run_demographics, "build the district demographics from the ACS tables"),
+            "score": (run_score, "calculate the facial attractiveness scores"),
+            "merge": (run_merge, "merge all data into CA_final.csv"),
+            "analyze": (run_analyze, "descriptive statistics & OLS tables"),
+            "sweep": (run_sweep, "specification curve over score bins, controls and samples (resumable)"),
+            "plot": (run_plot, "figures"),
+            "benchmark": (run_benchmark, "time the stages on synthetic data of 1x, 10x or 1000x the CA size (see benchmark.py)"),
+            "run": (run_pipeline, "run the stale stages in dependency order (see pipeline.py)")}
+
+
+
+## arguments
+
+def comma_list(cast):
+    return lambda value: [cast(item) for item in value.split(",")]
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = "The Impact of Facial Attractiveness on Candidates' Vote Share")
+    parser.add_argument("--storage-format", choices = ["csv", "parquet"], help = "format of the intermediate datasets (default: STORAGE_FORMAT or csv)")
+    parser.add_argument("--http-cache-mode", help = "online, refresh or offline-replay (default: HTTP_CACHE_MODE or online)")
+    parser.add_argument("--trace", help = "JSON-lines trace of stage times, memory, per-image latencies, failures & HTTP requests, e.g. ../results/trace/trace.jsonl (default: TRACE_PATH or off)")
+    parser.add_argument("--profile", type = comma_list(str), help = "stages profiled with cProfile, e.g. score,analyze (default: PROFILE_STAGES)")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    parsers = {name: subparsers.add_parser(name, help = help) for name, (function, help) in commands.items()}
+    for name in ["scrape", "download", "demographics", "merge", "run"]:
+        parsers[name].add_argument("--states", type = comma_list(str), help = "e.g. CA,TX,NY")
+    for name in ["scrape", "download", "demographics", "score", "merge", "run"]:
+        parsers[name].add_argument("--years", type = comma_list(int), help = "e.g. 2018,2020")
+
+    score_parser = parsers["score"]
+    score_parser.add_argument("--workers", type = int, help = "worker processes (default: SCORE_WORKERS or the number of CPU cores)")
+    score_parser.add_argument("--cnn-batch-size", type = int, help = "images per CNN batch (default: CNN_BATCH_SIZE or 1)")
+    score_parser.add_argument("--cnn-max-size", type = int, help = "largest image side for CNN detection (default: CNN_MAX_SIZE or full size)")
+    score_parser.add_argument("--cascade-max-size", type = int, help = "HOG-first cascade on images downscaled to this size (default: CASCADE_MAX_SIZE or off)")
+    score_parser.add_argument("--cascade-report", action = "store_true", help = "compare the cascade with the exhaustive CNN path")
+    score_parser.add_argument("--prescreen", action = "store_true", help = "pre-screen the photos, rejected photos are not scored (default: PRESCREEN or off)")
+    score_parser.add_argument("--stream", action = "store_true", help = "decode images ahead of detection and checkpoint the results, an interrupted run resumes (default: SCORE_STREAM or off)")
+
+    analyze_parser = parsers["analyze"]
+    analyze_parser.add_argument("--resampling", type = comma_list(str), help = "p-values of the score group by wild, pairs and/or permutation resampling, e.g. wild,permutation (default: RESAMPLING or off)")
+    analyze_parser.add_argument("--replications", type = int, help = "replications per model (default: RESAMPLING_REPLICATIONS or 10000)")
+    analyze_parser.add_argument("--seed", type = int, help = "random seed (default: RESAMPLING_SEED or 0)")
+    analyze_parser.add_argument("--workers", type = int, help = "worker processes (default: RESAMPLING_WORKERS or the number of CPU cores)")
+
+    sweep_parser = parsers["sweep"]
+    sweep_parser.add_argument("--cut-grid", type = comma_list(int), help = "inner bin edges of the score groups to choose from (default: 60,65,70,75,80,85)")
+    sweep_parser.add_argument("--max-cuts", type = int, help = "most inner bin edges per specification (default: 3)")
+    sweep_parser.add_argument("--workers", type = int, help = "worker processes (default: the number of CPU cores)")
+
+    plot_parser = parsers["plot"]
+    plot_parser.add_argument("--by-year", action = "store_true", help = "also draw the figures of each election year")
+    plot_parser.add_argument("--workers", type = int, help = "worker processes (default: the number of CPU cores)")
+    plot_parser.add_argument("--force", action = "store_true", help = "draw all figures, also the unchanged ones")
+
+    benchmark_parser = parsers["benchmark"]
+    benchmark_parser.add_argument("--stages", type = comma_list(str), help = "e.g. parse,merge,OLS (default: parse,image_HOG,image_CNN,merge,OLS,stargazer,plot)")
+    benchmark_parser.add_argument("--scales", type = comma_list(int), help = "sizes of the synthetic data, e.g. 1,10,1000 (default: 1,10)")
+    benchmark_parser.add_argument("--repeat", type = int, default = 5, help = "timed runs per stage after one warm-up run (default: 5, 1 from 100x)")
+    benchmark_parser.add_argument("--images", type = int, default = 20, help = "images of the per-image stages at scale 1, scaled with --scales (default: 20)")
+    benchmark_parser.add_argument("--seed", type = int, default = 0, help = "random seed of the synthetic data (default: 0)")
+    benchmark_parser.add_argument("--output", help = "JSON file of the results (default: results/benchmark/benchmark_{time}.json)")
+    benchmark_parser.add_argument("--compare", nargs = 2, metavar = ("BASELINE", "CURRENT"), help = "compare two result files instead of running")
+    benchmark_parser.add_argument("--threshold", type = float, default = 0.1, help = "slowdown of the median counted as a regression (default: 0.1)")
+
+    run_parser = parsers["run"]
+    run_parser.add_argument("stages", nargs = "*", help = "target stages, with all their upstream stages (default: all)")
+    run_parser.add_argument("--force", type = comma_list(str), help = "stages to run even if they are up to date, e.g. scrape,score")
+    run_parser.add_argument("--skip", type = comma_list(str), help = "stages not to run, their current outputs are used, e.g. scrape,download")
+    run_parser.add_argument("--jobs", type = int, default = 2, help = "stages run in parallel (default: 2)")
+    run_parser.add_argument("--dry-run", action = "store_true", help = "only show which stages are stale")
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    args = parse_args(argv)
+    # all paths are relative to src/
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    if args.storage_format:
+        import storage
+        storage.set_storage_format(args.storage_format)
+        # the pipeline fingerprints read the storage format from the environment
+        os.environ["STORAGE_FORMAT"] = args.storage_format
+    if args.http_cache_mode:
+        import http_cache
+        http_cache.set_cache(mode = args.http_cache_mode)
+
+    import instrument
+    if args.trace or args.profile:
+        instrument.set_trace(args.trace, args.profile)
+
+    # the stages of run are traced by pipeline.py
+    if args.command == "run":
+        commands[args.command][0](args)
+    else:
+        with instrument.stage(args.command):
+            commands[args.command][0](args)
+    instrument.write_summary()
+
+
+if __name__ == "__main__":
+    main()
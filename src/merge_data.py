@@ -0,0 +1,79 @@
+# This file contains functions and methods that are used to merge election results, candidate data, scores and district demographics
+import numpy as np
+import pandas as pd
+
+
+
+## keys
+
+# candidate data columns used in the final dataset
+candidate_columns = ["ID", "Gender", "Year_of_Birth", "Edu"]
+
+# stack the per-year (or per-state & year) tables, adding the missing key columns
+# a key shorter than key_names fills the last names, e.g. 2018 -> Year of ["State", "Year"]
+def stack_tables(tables, key_names):
+    frames = []
+    for key, data in tables.items():
+        key = key if isinstance(key, tuple) else (key,)
+        names = key_names[len(key_names) - len(key):]
+        frames.append(data.assign(**{name: value for name, value in zip(names, key) if name not in data.columns}))
+    return pd.concat(frames, ignore_index = True) if frames else pd.DataFrame(columns = key_names)
+
+# raise if the key columns do not identify the rows of a table
+def check_unique(data, keys, name):
+    duplicated = data[data.duplicated(keys, keep = False)]
+    if len(duplicated) > 0:
+        examples = duplicated[keys].drop_duplicates().head(10).to_dict("records")
+        raise ValueError(f"{name} has {len(duplicated)} rows with duplicated keys {keys}: {examples}")
+
+# integer candidate key shared by all tables: (Year, ID) -> 0 .. n-1
+def candidate_keys(*tables):
+    keys = pd.MultiIndex.from_frame(pd.concat([data[["Year", "ID"]] for data in tables], ignore_index = True)).unique()
+    return keys, [keys.get_indexer(pd.MultiIndex.from_frame(data[["Year", "ID"]])) for data in tables]
+
+
+
+## merge
+
+# final dataset of all years and states
+#   elections, scores: {(state, year): DataFrame}, candidates: {(state, year): DataFrame} (Excel data), demographics: {(state, year): DataFrame}
+#   the election, candidate & score tables can also be keyed by year alone (one state)
+# rows are ordered by Year, State, District, ID like the earlier per-year outer merges
+def merge_all(elections, candidates, scores, demographics):
+    election = stack_tables(elections, ["State", "Year"])
+    # candidate IDs carry the state (CA_1_2), the election results give the State of each candidate
+    candidate = stack_tables({key: data[candidate_columns] for key, data in candidates.items()}, ["State", "Year"]).drop(columns = "State", errors = "ignore")
+    score = stack_tables(scores, ["State", "Year"]).drop(columns = "State", errors = "ignore")
+    demographic = stack_tables(demographics, ["State", "Year"])
+
+    # one-to-one: one row per candidate in each table
+    check_unique(election, ["Year", "ID"], "election results")
+    check_unique(candidate, ["Year", "ID"], "candidate data")
+    check_unique(score, ["Year", "ID"], "scores")
+    # many-to-one: one row per district in the demographics
+    check_unique(demographic, ["Year", "State", "District"], "district demographics")
+
+    # join candidates on the integer key, Year & ID of rows missing from the election results are taken from the key
+    keys, (election["key"], candidate["key"], score["key"]) = candidate_keys(election, candidate, score)
+    final = (election.merge(candidate.drop(columns = ["Year", "ID"]), on = "key", how = "outer", validate = "one_to_one")
+                     .merge(score.drop(columns = ["Year", "ID"]), on = "key", how = "outer", validate = "one_to_one"))
+    for name in ("Year", "ID"):
+        final[name] = keys.get_level_values(name)[final["key"].to_numpy()]
+
+    # join districts on (Year, State, District) with State as a categorical
+    states = pd.CategoricalDtype(sorted(set(final["State"].dropna()) | set(demographic["State"].dropna())))
+    final["State"] = final["State"].astype(states)
+    demographic["State"] = demographic["State"].astype(states)
+    final = final.merge(demographic, on = ["Year", "State", "District"], how = "outer", validate = "many_to_one")
+
+    # ln vote share: one grouped pass over all districts
+    final["Votes"] = final["Votes"].astype(str).str.replace(",", "").astype(float)
+    final["total_votes"] = final.groupby(["Year", "State", "District"], observed = True)["Votes"].transform("sum")
+    final["vote_share"] = final["Votes"] / final["total_votes"]
+    final["ln_vote_share"] = np.log(final["vote_share"])
+    # age
+    final["Age"] = final["Year"] - final["Year_of_Birth"]
+
+    final["State"] = final["State"].astype(object)
+    final = final.sort_values(["Year", "State", "District", "ID"], kind = "stable").drop(columns = "key")
+    return final.reset_index(drop = True)
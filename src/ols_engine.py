@@ -0,0 +1,232 @@
+# This file contains functions and methods that are used to fit many OLS models on one shared design matrix
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from scipy import stats
+# Stargazer renders the results like statsmodels results
+from stargazer.translators import register_class
+
+
+
+## formulas
+
+# formulas use the statsmodels / patsy notation of this project: "y ~ x + C(g) + x:C(g) + x:z"
+# categorical factors are treatment coded against the first level present in the model's rows, like patsy
+def parse_formula(formula):
+    dependent, right_side = [part.strip() for part in formula.split("~")]
+    terms = [tuple(factor.strip() for factor in term.split(":")) for term in right_side.split("+")]
+    for term in terms:
+        if sum(is_categorical(factor) for factor in term) > 1:
+            raise ValueError(f"interactions of two categorical factors are not supported: {':'.join(term)}")
+    return dependent, terms
+
+def is_categorical(factor):
+    return factor.startswith("C(") and factor.endswith(")")
+
+def variable(factor):
+    return factor[2:-1] if is_categorical(factor) else factor
+
+# patsy column order: Intercept, then terms grouped by their numeric factors (in order of first appearance), lower order terms first
+def order_terms(terms):
+    groups = {(): []}
+    for term in terms:
+        numeric = frozenset(factor for factor in term if not is_categorical(factor))
+        groups.setdefault(numeric if numeric else (), []).append(term)
+    return [term for group in groups.values() for term in sorted(group, key = len)]
+
+# column name of a term for one level of its categorical factor, e.g. "score_group:C(Incumbent)[T.1]"
+def column_name(term, level = None):
+    return ":".join(f"{factor}[T.{level}]" if is_categorical(factor) else factor for factor in term)
+
+
+
+## shared design matrix
+
+# all columns any of the formulas can use, built once: (matrix, {column name: index}, {categorical variable: (level codes, levels)})
+def build_design(data, formulas):
+    columns = {"Intercept": np.ones(len(data))}
+    categories = {}
+    for formula in formulas:
+        for term in parse_formula(formula)[1]:
+            numeric = [factor for factor in term if not is_categorical(factor)]
+            base = np.prod([data[factor].to_numpy(dtype = float) for factor in numeric], axis = 0) if numeric else np.ones(len(data))
+            categorical = [variable(factor) for factor in term if is_categorical(factor)]
+            if not categorical:
+                columns.setdefault(column_name(term), base)
+                continue
+            if categorical[0] not in categories:
+                # sorted levels, missing values = -1
+                categories[categorical[0]] = pd.factorize(data[categorical[0]], sort = True)
+            codes, levels = categories[categorical[0]]
+            for code, level in enumerate(levels):
+                columns.setdefault(column_name(term, level), base * (codes == code))
+
+    names = list(columns)
+    matrix = np.column_stack([columns[name] for name in names])
+    return matrix, {name: i for i, name in enumerate(names)}, categories
+
+# columns of one model: the formula's terms with the categorical levels present in its rows (the first level is the reference)
+def model_columns(terms, rows, categories):
+    names = ["Intercept"]
+    for term in order_terms(terms):
+        categorical = [variable(factor) for factor in term if is_categorical(factor)]
+        if not categorical:
+            names.append(column_name(term))
+            continue
+        codes, levels = categories[categorical[0]]
+        present = np.unique(codes[rows])
+        names += [column_name(term, levels[code]) for code in present[present >= 0][1:]]
+    return names
+
+
+
+## batched least squares
+
+# results in the form Stargazer reads from statsmodels results
+OLSResult = namedtuple("OLSResult", ["params", "bse", "pvalues", "conf_int_low", "conf_int_high", "cov_params",
+                                     "nobs", "df_model", "df_resid", "rsquared", "rsquared_adj", "fvalue", "f_pvalue",
+                                     "resid_std_err", "dependent"])
+
+# pinv (like statsmodels: singular values below rcond * largest are dropped) and rank of stacked matrices
+def batched_pinv(X, nobs, rcond = 1e-15):
+    u, s, vt = np.linalg.svd(X, full_matrices = False)
+    largest = s.max(axis = 1, keepdims = True)
+    s_inv = np.where(s > rcond * largest, 1 / np.where(s > 0, s, 1), 0)
+    # numpy's matrix_rank tolerance, computed with the model's own number of rows
+    rank = (s > largest * np.maximum(nobs, X.shape[2])[:, None] * np.finfo(float).eps).sum(axis = 1)
+    return np.einsum("mkj,mj,mnj->mkn", vt.transpose(0, 2, 1), s_inv, u), rank
+
+# fit models with the same number of columns at once; excluded rows are zero rows, so they do not change the fit
+def fit_batch(X, y, keep, cov_type):
+    nobs = keep.sum(axis = 1)
+    X = np.where(keep[:, :, None], X, 0)
+    y = np.where(keep, y, 0)
+    pinv, rank = batched_pinv(X, nobs)
+    params = np.einsum("mkn,mn->mk", pinv, y)
+    resid = (y - np.einsum("mnk,mk->mn", X, params)) * keep
+    df_resid = nobs - rank
+
+    # sandwich covariance: HC0 = pinv diag(e^2) pinv', HC1 = n / (n - k) HC0
+    cov = np.einsum("mkn,mn,mjn->mkj", pinv, resid ** 2, pinv)
+    if cov_type == "HC1":
+        cov = cov * (nobs / df_resid)[:, None, None]
+    elif cov_type != "HC0":
+        raise ValueError(f"unknown cov_type: {cov_type} (use HC0 or HC1)")
+
+    ssr = (resid ** 2).sum(axis = 1)
+    centered_tss = (((y - (y.sum(axis = 1) / nobs)[:, None]) * keep) ** 2).sum(axis = 1)
+    return params, cov, nobs, rank, df_resid, ssr, centered_tss
+
+# robust Wald F test that all coefficients except the intercept are 0 (statsmodels' fvalue for robust covariances)
+def wald_f(params, cov, df_resid):
+    restricted = cov[1:, 1:]
+    if restricted.size == 0:
+        return np.nan, np.nan
+    J = np.linalg.matrix_rank(restricted)
+    F = params[1:] @ np.linalg.pinv(restricted) @ params[1:] / J
+    return F, stats.f.sf(F, J, df_resid)
+
+# shared design matrix and the (dependent, columns, rows) of every model: {name: (formula, rows)}, rows is a boolean Series / array or None for all rows
+# rows with missing values in the model's variables are dropped, like statsmodels
+def model_specs(data, models):
+    design, index, categories = build_design(data, [formula for formula, rows in models.values()])
+    missing = {column: values.to_numpy() for column, values in data.isna().items()}
+    specs = {}
+    for name, (formula, rows) in models.items():
+        dependent, terms = parse_formula(formula)
+        keep = np.ones(len(data), dtype = bool) if rows is None else np.asarray(rows, dtype = bool)
+        used = [dependent] + sorted({variable(factor) for term in terms for factor in term})
+        keep = keep & ~np.logical_or.reduce([missing[column] for column in used])
+        specs[name] = (dependent, model_columns(terms, keep, categories), keep)
+    return design, index, specs
+
+# design matrix and dependent variable of every model, only its rows: {name: (X, y, columns)}
+def model_matrices(data, models):
+    data = data.reset_index(drop = True)
+    design, index, specs = model_specs(data, models)
+    return {name: (design[np.ix_(keep, [index[column] for column in columns])], data[dependent].to_numpy(dtype = float)[keep], columns)
+            for name, (dependent, columns, keep) in specs.items()}
+
+# fit all models: {name: (formula, rows)} -> {name: OLSResult}
+def fit_ols(data, models, cov_type = "HC1"):
+    data = data.reset_index(drop = True)
+    design, index, specs = model_specs(data, models)
+
+    # models with the same number of columns are solved in one batch
+    results = {}
+    for k in sorted({len(columns) for dependent, columns, keep in specs.values()}):
+        batch = [name for name, (dependent, columns, keep) in specs.items() if len(columns) == k]
+        X = np.stack([design[:, [index[column] for column in specs[name][1]]] for name in batch])
+        y = np.stack([data[specs[name][0]].to_numpy(dtype = float) for name in batch])
+        keep = np.stack([specs[name][2] for name in batch])
+        params, cov, nobs, rank, df_resid, ssr, centered_tss = fit_batch(X, y, keep, cov_type)
+
+        z = stats.norm.ppf(0.975)
+        for i, name in enumerate(batch):
+            dependent, columns, rows = specs[name]
+            bse = np.sqrt(np.diag(cov[i]))
+            rsquared = 1 - ssr[i] / centered_tss[i]
+            fvalue, f_pvalue = wald_f(params[i], cov[i], df_resid[i])
+            results[name] = OLSResult(params = pd.Series(params[i], index = columns),
+                                      bse = pd.Series(bse, index = columns),
+                                      pvalues = pd.Series(2 * stats.norm.sf(np.abs(params[i] / bse)), index = columns),
+                                      conf_int_low = pd.Series(params[i] - z * bse, index = columns),
+                                      conf_int_high = pd.Series(params[i] + z * bse, index = columns),
+                                      cov_params = pd.DataFrame(cov[i], index = columns, columns = columns),
+                                      nobs = float(nobs[i]), df_model = float(rank[i] - 1), df_resid = float(df_resid[i]),
+                                      rsquared = rsquared, rsquared_adj = 1 - (nobs[i] - 1) / df_resid[i] * (1 - rsquared),
+                                      fvalue = fvalue, f_pvalue = f_pvalue,
+                                      resid_std_err = np.sqrt(ssr[i] / df_resid[i]), dependent = dependent)
+    # keep the order of the models
+    return {name: results[name] for name in models}
+
+
+
+## check against statsmodels
+
+# largest relative differences of params, bse & F between the engine and statsmodels' OLS(...).fit(cov_type): DataFrame, one row per model
+# results: fit_ols(data, models, cov_type) if already fitted
+def compare_statsmodels(data, models, results = None, cov_type = "HC1"):
+    import statsmodels.formula.api as smf
+
+    data = data.reset_index(drop = True)
+    results = results or fit_ols(data, models, cov_type)
+    rows = []
+    for name, (formula, model_rows) in models.items():
+        subset = data if model_rows is None else data[np.asarray(model_rows, dtype = bool)]
+        reference = smf.ols(formula, data = subset).fit(cov_type = cov_type)
+        result = results[name]
+
+        def difference(values, expected):
+            values, expected = np.atleast_1d(np.asarray(values, dtype = float)), np.atleast_1d(np.asarray(expected, dtype = float))
+            return float(np.max(np.abs(values - expected) / np.maximum(np.abs(expected), 1e-8))) if values.size else 0.0
+        same_columns = list(result.params.index) == list(reference.params.index)
+        rows.append({"model": name, "columns": same_columns,
+                     "params": difference(result.params, reference.params.reindex(result.params.index)) if same_columns else np.inf,
+                     "bse": difference(result.bse, reference.bse.reindex(result.bse.index)) if same_columns else np.inf,
+                     "F": difference(result.fvalue, np.squeeze(reference.fvalue)), "nobs": result.nobs == reference.nobs})
+    return pd.DataFrame(rows)
+
+# raise ValueError if any model's params, bse or F differ from statsmodels by more than tolerance (relative)
+def check_statsmodels(data, models, results = None, cov_type = "HC1", tolerance = 1e-6):
+    comparison = compare_statsmodels(data, models, results, cov_type)
+    failed = comparison[~comparison["columns"] | ~comparison["nobs"] | (comparison[["params", "bse", "F"]] > tolerance).any(axis = 1)]
+    if len(failed):
+        raise ValueError(f"OLS engine differs from statsmodels:\n{failed.to_string(index = False)}")
+    return comparison
+
+
+
+## Stargazer
+
+# model data in the form of Stargazer's statsmodels translator
+def stargazer_model_data(result):
+    return {"p_values": result.pvalues, "cov_values": result.params, "cov_std_err": result.bse,
+            "r2": result.rsquared, "r2_adj": result.rsquared_adj, "pseudo_r2": None,
+            "f_p_value": result.f_pvalue, "degree_freedom": result.df_model, "degree_freedom_resid": result.df_resid,
+            "nobs": result.nobs, "f_statistic": result.fvalue, "dependent_variable": result.dependent,
+            "cov_names": result.params.index.values,
+            "conf_int_low_values": result.conf_int_low, "conf_int_high_values": result.conf_int_high,
+            "resid_std_err": result.resid_std_err}
+
+register_class(OLSResult, stargazer_model_data)
@@ -0,0 +1,244 @@
+# This file contains functions and methods that are used to run the pipeline stages in dependency order, skipping stages that are up to date
+import os
+import glob
+import json
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+# file content hashes
+from score_cache import file_hash
+# wall time, peak memory & profiles of the stages
+import instrument
+
+
+
+## stages
+
+# run the stage functions, the stage modules are imported only when their stage runs
+# --states and --years are passed to the stages that use them (score uses the CA photos of the years, merge the tables of the states & years)
+def run_scrape(options):
+    import get_data
+    get_data.scrape(options.get("states"), options.get("years"))
+
+def run_download(options):
+    import get_data
+    get_data.download(options.get("states"), options.get("years"))
+
+def run_demographics(options):
+    import clean_data
+    clean_data.demographics(options.get("states"), options.get("years"))
+
+def run_score(options):
+    import clean_data
+    clean_data.score(years = options.get("years"))
+
+def run_merge(options):
+    import clean_data
+    clean_data.merge(options.get("years"), states = options.get("states"))
+
+def run_analyze(options):
+    import analyze_data
+    analyze_data.analyze()
+
+def run_plot(options):
+    import visualize_results
+    visualize_results.plot()
+
+# dependency graph: each stage with its upstream stages, the source files it runs (code version),
+# the files it reads and writes (glob patterns, directories are read recursively) and the settings that change its results
+stages = {"scrape": {"run": run_scrape, "deps": [],
+                     "code": ["get_data.py", "features.py", "http_cache.py", "storage.py"],
+                     "inputs": [],
+                     "outputs": ["../data/raw/election_result/*_house_election_*", "../data/raw/election_result/state=*/year=*/*"],
+                     "env": ["SCRAPE_STATES", "SCRAPE_YEARS"], "options": ["states", "years"]},
+          "download": {"run": run_download, "deps": ["scrape"],
+                       "code": ["get_data.py", "features.py", "http_cache.py", "storage.py"],
+                       "inputs": ["../data/raw/election_result/state=*/year=*/house_election.*"],
+                       "outputs": ["../data/raw/candidate_images"],
+                       "env": ["SCRAPE_STATES", "SCRAPE_YEARS"], "options": ["states", "years"]},
+          "demographics": {"run": run_demographics, "deps": [],
+                           "code": ["clean_data.py", "acs_ingest.py", "storage.py"],
+                           "inputs": ["../data/raw/District_Demographics"],
+                           "outputs": ["../data/processed/District_Demographics/*_District_Demographics_*"],
+                           "env": [], "options": ["states", "years"]},
+          # the downloaded photos are checked and replaced by hand in ../data/processed/candidate_images/CA before scoring
+          "score": {"run": run_score, "deps": ["download"],
+                    "code": ["clean_data.py", "face_score.py", "prescreen.py", "score_cache.py", "storage.py", "stream_score.py"],
+                    "inputs": ["../data/processed/candidate_images/CA/*/*", "../data/raw/dlib_model"],
+                    "outputs": ["../data/processed/candidate_images/CA/*_scores.*"],
+                    "env": ["CNN_BATCH_SIZE", "CNN_MAX_SIZE", "CASCADE_MAX_SIZE", "CASCADE_REPORT", "PRESCREEN"], "options": ["years"]},
+          "merge": {"run": run_merge, "deps": ["scrape", "demographics", "score"],
+                    "code": ["clean_data.py", "merge_data.py", "storage.py"],
+                    "inputs": ["../data/raw/election_result/*_house_election_*",
+                               "../data/raw/election_result/state=*/year=*/house_election.*",
+                               "../data/processed/candidate_data/*.xlsx",
+                               "../data/processed/candidate_images/*/*_scores.*",
+                               "../data/processed/District_Demographics/*_District_Demographics_*"],
+                    "outputs": ["../data/processed/CA_final.*"],
+                    "env": [], "options": ["states", "years"]},
+          "analyze": {"run": run_analyze, "deps": ["merge"],
+                      "code": ["analyze_data.py", "cube.py", "features.py", "ols_engine.py", "resampling.py", "storage.py"],
+                      "inputs": ["../data/processed/CA_final.*"],
+                      "outputs": ["../results/alldata_CA.csv", "../results/summary_cube.*", "../results/descriptive_statistics/*.csv", "../results/table/*.html"],
+                      "env": ["RESAMPLING", "RESAMPLING_REPLICATIONS", "RESAMPLING_SEED"], "options": []},
+          "plot": {"run": run_plot, "deps": ["analyze"],
+                   "code": ["visualize_results.py", "cube.py", "features.py", "storage.py"],
+                   "inputs": ["../results/summary_cube.*"],
+                   "outputs": ["../results/figures/lnVoteShare_Score/*/*.png"],
+                   "env": [], "options": []}}
+
+# settings that change the results of every stage
+common_env = ["STORAGE_FORMAT"]
+
+
+
+## fingerprints
+
+# fingerprints of the last successful runs, and file hashes keyed by (size, modification time) so unchanged files are not read again
+state_path = "../data/processed/pipeline_state.json"
+
+def load_state(path = None):
+    path = path or state_path
+    if not os.path.exists(path):
+        return {"stages": {}, "files": {}}
+    with open(path, "r", encoding = "utf-8") as file:
+        return json.load(file)
+
+def save_state(state, path = None):
+    path = path or state_path
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    temp_path = f"{path}.part"
+    with open(temp_path, "w", encoding = "utf-8") as file:
+        json.dump(state, file, indent = 1, sort_keys = True)
+    os.replace(temp_path, path)
+
+# all files matched by the patterns, directories are expanded
+def expand_paths(patterns):
+    paths = set()
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            if os.path.isdir(path):
+                for folder, subfolders, files in os.walk(path):
+                    paths.update(os.path.join(folder, name) for name in files)
+            else:
+                paths.add(path)
+    return sorted(path.replace(os.sep, "/") for path in paths)
+
+# content hash of a file, reused while its size and modification time are unchanged
+def cached_file_hash(path, file_hashes):
+    stat = os.stat(path)
+    entry = file_hashes.get(path)
+    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+        return entry["sha256"]
+    sha256 = file_hash(path)
+    file_hashes[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": sha256}
+    return sha256
+
+# fingerprint of a stage: its code version, input files and settings
+def stage_fingerprint(name, options, file_hashes):
+    stage = stages[name]
+    sha = hashlib.sha256()
+    for path in sorted(stage["code"]):
+        sha.update(f"code {path} {file_hash(path)}\n".encode())
+    for path in expand_paths(stage["inputs"]):
+        sha.update(f"input {path} {cached_file_hash(path, file_hashes)}\n".encode())
+    for variable in common_env + stage["env"]:
+        sha.update(f"env {variable}={os.environ.get(variable, '')}\n".encode())
+    settings = {option: options.get(option) for option in stage["options"]}
+    sha.update(f"options {json.dumps(settings, sort_keys = True, default = str)}\n".encode())
+    return sha.hexdigest()
+
+# all outputs of a stage exist
+def outputs_exist(name):
+    return all(glob.glob(pattern) for pattern in stages[name]["outputs"])
+
+
+
+## run
+
+# the target stages and all their upstream stages
+def upstream_stages(targets):
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in stages:
+            raise ValueError(f"unknown stage: {name} (use one of {list(stages)})")
+        if name not in selected:
+            selected.add(name)
+            pending += stages[name]["deps"]
+    # keep the order of the stage table
+    return [name for name in stages if name in selected]
+
+# run the stale stages of the targets (default: all stages), independent stages in parallel
+#   force: stages that run even if they are up to date; skip: stages whose current outputs are used as they are (e.g. scrape offline)
+#   dry_run: only print the stages that would run
+def run_pipeline(targets = None, options = None, force = (), skip = (), jobs = 2, dry_run = False):
+    options = options or {}
+    selected = upstream_stages(targets or list(stages))
+    state = load_state()
+    status = {}
+
+    if dry_run:
+        for name in selected:
+            if name in skip:
+                status[name] = "skipped"
+                print(f"{name}: skipped")
+                continue
+            # a stage is also stale if an upstream stage will run and may change its inputs
+            stale = (name in force or not outputs_exist(name) or any(status.get(dep) == "stale" for dep in stages[name]["deps"] if dep in selected)
+                     or state["stages"].get(name) != stage_fingerprint(name, options, state["files"]))
+            status[name] = "stale" if stale else "up to date"
+            print(f"{name}: {status[name]}")
+        return status
+
+    # run one stage if it is stale: ("ran" or "up to date", fingerprint, seconds), file_hashes is the stage's own copy
+    def run_stage(name, file_hashes):
+        fingerprint = stage_fingerprint(name, options, file_hashes)
+        if name not in force and outputs_exist(name) and state["stages"].get(name) == fingerprint:
+            return "up to date", fingerprint, 0
+        start = time.perf_counter()
+        with instrument.stage(name):
+            stages[name]["run"](options)
+        # inputs written while the stage ran (e.g. Parquet copies) belong to the next fingerprint
+        return "ran", stage_fingerprint(name, options, file_hashes), time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers = jobs) as executor:
+        running = {}
+        while len(status) < len(selected):
+            # start every stage whose upstream stages are done
+            for name in selected:
+                if name in status or name in [running_name for running_name, file_hashes in running.values()]:
+                    continue
+                deps = [dep for dep in stages[name]["deps"] if dep in selected]
+                if name in skip:
+                    status[name] = "skipped"
+                    print(f"{name}: skipped")
+                elif any(status.get(dep) in ("failed", "blocked") for dep in deps):
+                    status[name] = "blocked"
+                    print(f"Error - {name}: not run, an upstream stage failed")
+                elif all(dep in status for dep in deps):
+                    file_hashes = dict(state["files"])
+                    running[executor.submit(run_stage, name, file_hashes)] = (name, file_hashes)
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in done:
+                name, file_hashes = running.pop(future)
+                try:
+                    status[name], fingerprint, seconds = future.result()
+                    state["stages"][name] = fingerprint
+                    state["files"].update(file_hashes)
+                    save_state(state)
+                    print(f"{name}: {status[name]}" + (f" ({seconds:.1f}s)" if status[name] == "ran" else ""))
+                except Exception as e:
+                    status[name] = "failed"
+                    state["stages"].pop(name, None)
+                    save_state(state)
+                    print(f"Error - {name}: {str(e)}")
+
+    # forget the hashes of files that no longer exist
+    state["files"] = {path: entry for path, entry in state["files"].items() if os.path.exists(path)}
+    save_state(state)
+    return status
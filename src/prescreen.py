@@ -0,0 +1,263 @@
+# This file contains functions and methods that are used to pre-screen the candidate photos before scoring
+# cheap checks (image size, HOG detection on a downscaled copy, 68 landmarks & head pose) label each photo
+# accepted, needs-review or rejected; rejected photos are not scored and the photos to check by hand are listed in a curation queue
+import os
+import json
+import hashlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+import pandas as pd
+# detectors, image decoding & the cascade's resizing
+import face_score
+# image content hashes & cached scores
+import score_cache
+from score_cache import file_hash
+# trace of failures
+import instrument
+
+
+
+## thresholds
+
+# smallest image side and face width (pixels of the original image): below reject = rejected, below review = needs-review
+reject_image_side = 100
+reject_face_width = 40
+review_face_width = 80
+# HOG detection confidence (dlib detector score) below which a photo needs review
+review_confidence = 0.5
+# head pose (degrees): larger yaw or pitch than reject = rejected (profile / strongly tilted), larger than review = needs-review
+# (the hand-curated CA photos are within about 30 degrees of yaw and pitch, and 20 degrees of roll)
+reject_angle = 40
+review_angle = 20
+review_roll = 15
+# HOG detection runs on a copy downscaled to this size (and on the original image if no face is found on the copy)
+detect_max_size = 800
+
+# version of the checks, bump it when a check changes so saved pre-screen results are recalculated
+PRESCREEN_VERSION = 2
+
+statuses = ["accepted", "needs-review", "rejected"]
+
+# generic 3D face model (nose tip, chin, outer eye corners, mouth corners) for the head pose, and the matching landmark points
+model_points = np.array([(0.0, 0.0, 0.0), (0.0, -330.0, -65.0), (-225.0, 170.0, -135.0), (225.0, 170.0, -135.0), (-150.0, -150.0, -125.0), (150.0, -150.0, -125.0)])
+model_landmarks = [30, 8, 36, 45, 48, 54]
+
+# hash of the thresholds, saved results of other settings are recalculated
+def prescreen_settings(detect_size = detect_max_size):
+    settings = {"reject_image_side": reject_image_side, "reject_face_width": reject_face_width, "review_face_width": review_face_width,
+                "review_confidence": review_confidence, "reject_angle": reject_angle, "review_angle": review_angle, "review_roll": review_roll,
+                "detect_max_size": detect_size, "version": PRESCREEN_VERSION}
+    return hashlib.sha256(json.dumps(settings, sort_keys = True).encode()).hexdigest()[:16]
+
+
+
+## checks
+
+# angle in (-90, 90]: the Euler angles of the pose are only defined up to a half turn
+def fold_angle(angle):
+    return angle - 180 if angle > 90 else angle + 180 if angle <= -90 else angle
+
+# head pose (yaw, pitch, roll in degrees) from 68 landmarks: the generic face model fitted to the landmarks with solvePnP
+def head_pose(landmarks, width, height):
+    camera = np.array([[width, 0, width / 2], [0, width, height / 2], [0, 0, 1]], dtype = float)
+    found, rotation, translation = cv2.solvePnP(model_points, landmarks[model_landmarks].astype(float), camera, np.zeros(4), flags = cv2.SOLVEPNP_ITERATIVE)
+    if not found:
+        return None
+    matrix, _ = cv2.Rodrigues(rotation)
+    (pitch, yaw, roll), *_ = cv2.RQDecomp3x3(matrix)
+    # roll from the line between the eye centers (more stable than the fitted roll)
+    left_eye = landmarks[36:42].mean(axis = 0)
+    right_eye = landmarks[42:48].mean(axis = 0)
+    roll = np.degrees(np.arctan2(right_eye[1] - left_eye[1], right_eye[0] - left_eye[0]))
+    return fold_angle(yaw), fold_angle(pitch), roll
+
+# status of a photo from its reasons: the most severe one
+def photo_status(rejected, review):
+    return "rejected" if rejected else "needs-review" if review else "accepted"
+
+# pre-screen one photo: row with its status, the reasons and the measures
+def prescreen_image(image_path):
+    return prescreen_checks(image_path)[0]
+
+# checks of one photo: (row, gray image, HOG face rect, landmarks), the last ones are None if the checks stop before them
+# detect_size: HOG detection on a copy downscaled to this size (None = on the original image, as the full size scorer does)
+def prescreen_checks(image_path, detect_size = detect_max_size):
+    image = Path(image_path)
+    row = {"ID": image.stem, "image": str(image), "status": None, "reasons": "",
+           "width": None, "height": None, "faces": 0, "hog_confidence": None, "face_width": None, "yaw": None, "pitch": None, "roll": None}
+    rejected, review = [], []
+
+    # image size from the header, without decoding ((0, 0) if the header can not be read)
+    row["width"], row["height"] = face_score.image_size(image)
+    if 0 < min(row["width"], row["height"]) < reject_image_side:
+        rejected.append("resolution")
+        row.update(status = photo_status(rejected, review), reasons = "; ".join(rejected))
+        return row, None, None, None
+    try:
+        gray = face_score.load_gray_image(image)
+    except Exception as e:
+        instrument.failure("unreadable_image", image, e, "prescreen")
+        row.update(status = "rejected", reasons = "unreadable_image")
+        return row, None, None, None
+    row["height"], row["width"] = gray.shape
+
+    # HOG + Linear SVM face detector on a downscaled copy, with its detection scores
+    small, scale = face_score.resize_max(gray, detect_size) if detect_size is not None else (gray, 1.0)
+    rects, confidences, _ = face_score.detector.run(small, 0, 0)
+    if len(rects) == 0 and scale < 1.0:
+        # the scorer detects at full size, so a face missed on the copy is looked for in the original image
+        rects, confidences, _ = face_score.detector.run(gray, 0, 0)
+        scale = 1.0
+    row["faces"] = len(rects)
+    if len(rects) == 0:
+        # no HOG score can be calculated, so the photo can not get a valid score
+        row.update(status = "rejected", reasons = "no_face")
+        return row, gray, None, None
+    if len(rects) > 1:
+        review.append("multiple_faces")
+    face_rect = face_score.original_rect(rects[0], scale)
+    row["hog_confidence"] = round(float(confidences[0]), 3)
+    row["face_width"] = face_rect.width()
+    if row["hog_confidence"] < review_confidence:
+        review.append("low_confidence")
+    if row["face_width"] < reject_face_width:
+        rejected.append("face_resolution")
+    elif row["face_width"] < review_face_width:
+        review.append("face_resolution")
+
+    # head pose from the 68 landmarks
+    landmarks = face_score.shape_to_array(face_score.predictor(gray, face_rect))
+    pose = head_pose(landmarks, row["width"], row["height"])
+    if pose is None:
+        review.append("pose_unknown")
+    else:
+        row["yaw"], row["pitch"], row["roll"] = (round(float(angle), 1) for angle in pose)
+        if max(abs(row["yaw"]), abs(row["pitch"])) > reject_angle:
+            rejected.append("pose")
+        elif max(abs(row["yaw"]), abs(row["pitch"])) > review_angle or abs(row["roll"]) > review_roll:
+            review.append("pose")
+
+    row.update(status = photo_status(rejected, review), reasons = "; ".join(rejected + review))
+    return row, gray, face_rect, landmarks
+
+
+
+## pre-screen of a folder
+
+# pre-screen rows of images (or the results of task for each item), in this process or in a pool of processes that each load the models once
+def run_prescreen(images, workers = 1, model_dir = "../data/raw/dlib_model", task = prescreen_image):
+    # nothing to check (e.g. all rows are saved): the models are not loaded
+    if not images:
+        return []
+    if workers <= 1 or len(images) <= 1:
+        if face_score.detector is None:
+            face_score.load_models(model_dir)
+        return [task(image) for image in images]
+    chunksize = max(1, len(images) // (workers * 4))
+    with ProcessPoolExecutor(max_workers = workers, initializer = face_score.load_models, initargs = (model_dir,)) as executor:
+        return list(executor.map(task, images, chunksize = chunksize))
+
+# saved rows of the checks with the given settings: {content hash: row}
+def saved_rows(saved_path, settings):
+    if not saved_path or not os.path.exists(saved_path):
+        return {}
+    previous = pd.read_csv(saved_path, keep_default_na = False, na_values = [""])
+    return {row["hash"]: row for row in previous.to_dict("records") if row.get("settings") == settings}
+
+# pre-screen DataFrame of a folder from the saved and the new rows ({image: row}), with a summary
+def folder_rows(folder, images, hashes, saved, new_rows, settings):
+    rows = []
+    for image in images:
+        image_hash = hashes[str(image)]
+        row = dict(saved[image_hash], ID = image.stem, image = str(image)) if image_hash in saved else new_rows[str(image)]
+        rows.append({**row, "hash": image_hash, "settings": settings})
+    print(f"Pre-screen - {Path(folder).name}: {len(images)} photos, {len(new_rows)} checked, "
+          + ", ".join(f"{status} {sum(row['status'] == status for row in rows)}" for status in statuses))
+    return pd.DataFrame(rows, columns = list(rows[0]) if rows else ["ID", "image", "status", "reasons", "hash", "settings"])
+
+# pre-screen all images of a folder, reusing the saved rows of unchanged images (same content hash & settings): DataFrame
+def prescreen_folder(folder, saved_path = None, workers = 1, model_dir = "../data/raw/dlib_model"):
+    images = sorted(image for image in Path(folder).iterdir() if image.is_file())
+    hashes = {str(image): file_hash(image) for image in images}
+    settings = prescreen_settings()
+    saved = saved_rows(saved_path, settings)
+
+    todo = [image for image in images if hashes[str(image)] not in saved]
+    new_rows = {row["image"]: row for row in run_prescreen(todo, workers, model_dir)}
+    return folder_rows(folder, images, hashes, saved, new_rows, settings)
+
+
+
+## pre-screen & full size scoring in one pass
+
+# pre-screen and score one photo, (image, check, detectors) -> (row or None, {detector: score}), see face_score.score_image
+# the scores reuse the decoded image, and the HOG score the full size HOG detection & landmarks of the checks;
+# a rejected photo is not scored, and a photo with a saved row (check = False) is only scored
+def prescreen_score_image(job):
+    image, check, names = job
+    if not check:
+        return None, face_score.score_image(image, names)
+    row, gray, face_rect, landmarks = prescreen_checks(image, detect_size = None)
+    scores = {}
+    if row["status"] == "rejected":
+        return row, scores
+    if "HOG" in names:
+        scores["HOG"] = face_score.score_landmarks(landmarks)
+    others = tuple(name for name in names if name != "HOG")
+    if others:
+        scores.update(face_score.score_gray(Path(image), gray, others))
+    return row, scores
+
+# pre-screen & score all images of a folder in one pool, for full size scoring (no batched, downscaled or cascade CNN detection)
+# saved rows of unchanged images and cached scores are reused, rejected photos are not scored:
+# (pre-screen DataFrame, score rows like face_score.score_folder)
+def prescreen_score_folder(folder, saved_path = None, workers = 1, model_dir = "../data/raw/dlib_model", cache = None):
+    images = sorted(image for image in Path(folder).iterdir() if image.is_file())
+    hashes = {str(image): file_hash(image) for image in images}
+    # the checks detect at full size like the scorer, so the HOG detection is shared
+    settings = prescreen_settings(detect_size = None)
+    saved = saved_rows(saved_path, settings)
+    detectors = tuple(face_score.analyzers)
+
+    scores = {str(image): {} for image in images}
+    if cache is not None:
+        models = face_score.cache_models(model_dir)
+        cached = score_cache.get_scores(cache, set(hashes.values()), models, face_score.SCORE_VERSION)
+        scores = {image: {name: cached[(image_hash, name)] for name in detectors if (image_hash, name) in cached} for image, image_hash in hashes.items()}
+
+    # images without a saved row are checked, the ones that are not rejected are scored with the detectors that are not cached
+    jobs = []
+    for image in images:
+        row = saved.get(hashes[str(image)])
+        names = () if row is not None and row["status"] == "rejected" else tuple(name for name in detectors if name not in scores[str(image)])
+        if row is None or names:
+            jobs.append((image, row is None, names))
+    new_rows = {}
+    for (image, check, names), (row, image_scores) in zip(jobs, run_prescreen(jobs, workers, model_dir, prescreen_score_image)):
+        if row is not None:
+            new_rows[str(image)] = row
+        scores[str(image)].update(image_scores)
+
+    # detectors that failed with an error have no score and are not cached
+    if cache is not None and jobs:
+        score_cache.put_scores(cache, {(hashes[str(image)], name): score for image, check, names in jobs for name, score in scores[str(image)].items() if name in names},
+                               models, face_score.SCORE_VERSION)
+
+    prescreen = folder_rows(folder, images, hashes, saved, new_rows, settings)
+    rejected = set(prescreen.loc[prescreen["status"] == "rejected", "image"])
+    results = []
+    for image in images:
+        image_scores = scores[str(image)]
+        if str(image) not in rejected and image_scores.get("HOG") is not None and image_scores.get("CNN") is not None:
+            results.append({"ID": image.stem, "score": image_scores["HOG"], "score_CNN": image_scores["CNN"]})
+    return prescreen, results
+
+
+
+# photos to check by hand: rejected first, then needs-review, each by ID
+def curation_queue(prescreen):
+    queue = prescreen[prescreen["status"] != "accepted"].copy()
+    queue["order"] = queue["status"].map({"rejected": 0, "needs-review": 1})
+    return queue.sort_values(["order", "ID"]).drop(columns = ["order", "hash", "settings"])
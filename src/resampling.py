@@ -0,0 +1,93 @@
+# This file contains functions and methods that are used to calculate bootstrap and permutation p-values of one OLS coefficient
+# replications are solved as batched matrix operations, in chunks spread over a process pool
+import numpy as np
+
+
+
+## t statistics
+
+resampling_methods = ["wild", "pairs", "permutation"]
+
+# HC1 t statistic of coefficient j for stacked designs X (r, n, k) with dependent Y (r, n) and row counts W (r, n)
+# replications with a singular design (e.g. a category missing from a pairs resample) are nan
+def batched_t(X, Y, j, W, center = 0):
+    n, k = X.shape[1], X.shape[2]
+    XW = X * W[:, :, None]
+    XtWX = XW.transpose(0, 2, 1) @ X
+    singular = np.linalg.matrix_rank(XtWX) < k
+    XtWX[singular] = np.eye(k)
+    inverse = np.linalg.inv(XtWX)
+    params = (inverse @ (XW.transpose(0, 2, 1) @ Y[:, :, None]))[:, :, 0]
+    resid = Y - (X @ params[:, :, None])[:, :, 0]
+    # HC1 variance of coefficient j: n / (n - k) * (X'WX)^-1 X' W diag(e^2) X (X'WX)^-1, only row j
+    row = (X @ inverse[:, j, :, None])[:, :, 0]
+    variance = n / (n - k) * (W * resid ** 2 * row ** 2).sum(axis = 1)
+    t = (params[:, j] - center) / np.sqrt(variance)
+    t[singular] = np.nan
+    return t
+
+# HC1 t statistic of coefficient j of one model
+def observed_t(X, y, j):
+    return batched_t(X[None], y[None], j, np.ones((1, len(y))))[0]
+
+
+
+## replications
+
+# wild bootstrap with the null imposed: y* = fitted values of the model without column j + Rademacher sign flips of its residuals
+# the design is the same in every replication, so all replications are one product with the pseudo inverse
+def wild_chunk(X, y, j, replications, rng):
+    n, k = X.shape
+    restricted = np.delete(X, j, axis = 1)
+    fitted = restricted @ np.linalg.lstsq(restricted, y, rcond = None)[0]
+    Y = fitted[:, None] + (y - fitted)[:, None] * rng.choice([-1.0, 1.0], size = (n, replications))
+    pinv = np.linalg.pinv(X)
+    params = pinv @ Y
+    resid = Y - X @ params
+    variance = n / (n - k) * (pinv[j] ** 2) @ (resid ** 2)
+    return params[j] / np.sqrt(variance)
+
+# pairs bootstrap: rows resampled with replacement as row counts, t statistics centered at the full-sample estimate
+def pairs_chunk(X, y, j, replications, rng):
+    n = len(y)
+    W = rng.multinomial(n, np.full(n, 1 / n), size = replications).astype(float)
+    estimate = np.linalg.lstsq(X, y, rcond = None)[0][j]
+    return batched_t(np.broadcast_to(X, (replications,) + X.shape), np.broadcast_to(y, (replications, n)), j, W, center = estimate)
+
+# permutation: the values of column j (the score) are shuffled across the rows, all other columns stay
+def permutation_chunk(X, y, j, replications, rng):
+    n = len(y)
+    permuted = np.repeat(X[None], replications, axis = 0)
+    permuted[:, :, j] = X[rng.permuted(np.tile(np.arange(n), (replications, 1)), axis = 1), j]
+    return batched_t(permuted, np.broadcast_to(y, (replications, n)), j, np.ones((replications, n)))
+
+chunk_functions = {"wild": wild_chunk, "pairs": pairs_chunk, "permutation": permutation_chunk}
+
+# one chunk of replications, run in a worker process
+def run_chunk(method, X, y, j, replications, seed):
+    return chunk_functions[method](X, y, j, replications, np.random.default_rng(seed))
+
+
+
+## p-values
+
+# two-sided p-value of coefficient j: (p-value, replications used)
+#   the chunks and their seeds depend only on seed, replications & chunk_size, so the result is the same for any number of workers
+#   executor: a concurrent.futures executor for the chunks, None runs them in this process
+def resampling_pvalue(X, y, j, method, replications = 10000, seed = 0, chunk_size = 1000, executor = None):
+    if method not in chunk_functions:
+        raise ValueError(f"unknown resampling method: {method} (use one of {resampling_methods})")
+    sizes = [min(chunk_size, replications - start) for start in range(0, replications, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if executor is None:
+        chunks = [run_chunk(method, X, y, j, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+    else:
+        chunks = [future.result() for future in [executor.submit(run_chunk, method, X, y, j, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]]
+    t = np.concatenate(chunks)
+    t = t[~np.isnan(t)]
+
+    extreme = (np.abs(t) >= abs(observed_t(X, y, j))).sum()
+    # the observed data is one of the permutations
+    if method == "permutation":
+        return (extreme + 1) / (len(t) + 1), len(t)
+    return extreme / len(t), len(t)
@@ -0,0 +1,83 @@
+# This file contains functions and methods that are used to cache facial attractiveness scores on disk
+import os
+import hashlib
+import sqlite3
+import time
+
+
+
+# sha256 of a file's content
+def file_hash(path, chunk_size = 1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+# hash of the model files each detector depends on
+def model_hashes(model_dir, dlib_version = ""):
+    shape_predictor = file_hash(os.path.join(model_dir, "shape_predictor_68_face_landmarks.dat"))
+    mmod = file_hash(os.path.join(model_dir, "mmod_human_face_detector.dat"))
+    # the HOG detector is built into dlib, so its "model" is the dlib version
+    return {"HOG": hashlib.sha256(f"{dlib_version}:{shape_predictor}".encode()).hexdigest(),
+            "CNN": hashlib.sha256(f"{mmod}:{shape_predictor}".encode()).hexdigest()}
+
+# cache key of a detector run with different settings: {model hash}:{variant}, so pruning can still match the model files
+def variant_hash(model_hash, variant):
+    return f"{model_hash}:{variant}"
+
+# open (or create) the cache database
+def open_cache(cache_path):
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok = True)
+    conn = sqlite3.connect(cache_path)
+    conn.execute("""CREATE TABLE IF NOT EXISTS scores (
+                        image_hash TEXT NOT NULL,
+                        detector TEXT NOT NULL,
+                        model_hash TEXT NOT NULL,
+                        score_version INTEGER NOT NULL,
+                        score INTEGER,
+                        updated REAL NOT NULL,
+                        PRIMARY KEY (image_hash, detector, model_hash, score_version))""")
+    return conn
+
+# cached scores: {(image_hash, detector): score}, score is None if no face was found
+def get_scores(conn, image_hashes, models, score_version):
+    cached = {}
+    image_hashes = list(image_hashes)
+    # sqlite limits the number of query parameters
+    for i in range(0, len(image_hashes), 500):
+        batch = image_hashes[i:i + 500]
+        placeholders = ", ".join("?" * len(batch))
+        for detector, model_hash in models.items():
+            query = f"""SELECT image_hash, score FROM scores
+                        WHERE detector = ? AND model_hash = ? AND score_version = ?
+                        AND image_hash IN ({placeholders})"""
+            for image_hash, score in conn.execute(query, [detector, model_hash, score_version] + batch):
+                cached[(image_hash, detector)] = score
+    return cached
+
+# save new scores: {(image_hash, detector): score}
+def put_scores(conn, scores, models, score_version):
+    now = time.time()
+    rows = [(image_hash, detector, models[detector], score_version, score, now) for (image_hash, detector), score in scores.items()]
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+# delete entries from old model files or score versions (and, if given, images that are no longer used)
+# models are the hashes of the current model files (model_hashes), entries of their variants (cascade, downscaled or batched CNN) are kept
+def prune_cache(conn, models, score_version, image_hashes = None):
+    with conn:
+        deleted = 0
+        for detector, model_hash in models.items():
+            deleted += conn.execute("""DELETE FROM scores WHERE detector = ?
+                                       AND ((model_hash != ? AND substr(model_hash, 1, ?) != ?) OR score_version != ?)""",
+                                    (detector, model_hash, len(model_hash) + 1, f"{model_hash}:", score_version)).rowcount
+        placeholders = ", ".join("?" * len(models))
+        deleted += conn.execute(f"DELETE FROM scores WHERE detector NOT IN ({placeholders})", list(models)).rowcount
+
+        if image_hashes is not None:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep (image_hash TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM keep")
+            conn.executemany("INSERT OR IGNORE INTO keep VALUES (?)", [(image_hash,) for image_hash in image_hashes])
+            deleted += conn.execute("DELETE FROM scores WHERE image_hash NOT IN (SELECT image_hash FROM keep)").rowcount
+    return deleted
@@ -0,0 +1,204 @@
+# This file contains functions and methods that are used to fit the specification curve of the score effect
+# every combination of score (HOG / CNN), score coding (continuous or score groups over a grid of bin edges), controls and sample is one OLS model
+import os
+import json
+import hashlib
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+# OLS
+from ols_engine import fit_ols
+# csv / Parquet datasets
+from storage import read_table
+
+
+
+## specifications
+
+# inner bin edges of the score groups are chosen from this grid (1 - 3 edges: 2 - 4 score groups)
+cut_grid = [60, 65, 70, 75, 80, 85]
+max_cuts = 3
+# controls that can be left out (C(Year) is in every model)
+controls = ["Age + Agesq", "C(Gender)", "C(Edu_Level)", "Democratic", "C(Incumbent)", "C(city_type)"]
+# samples: rows of the sample and the control that is constant in it
+samples = {"All": (None, None),
+           "Not Democratic": (lambda data: data["Party"] != "Democratic", "Democratic"),
+           "Democratic": (lambda data: data["Party"] == "Democratic", "Democratic"),
+           "Not Incumbent": (lambda data: data["Incumbent"] == 0, "C(Incumbent)"),
+           "Incumbent": (lambda data: data["Incumbent"] == 1, "C(Incumbent)")}
+
+# score codings: "continuous" or the inner bin edges, e.g. "75,80" = bins [0, 75, 80, 100]
+def score_codings(grid = None, cuts = None):
+    grid = grid or cut_grid
+    return ["continuous"] + [",".join(str(edge) for edge in edges) for n in range(1, (cuts or max_cuts) + 1) for edges in combinations(grid, n)]
+
+# all specifications, indexed by a readable key, e.g. "score_CNN | 75,80 | Age + Agesq + C(Gender) | Democratic"
+def specifications(grid = None, cuts = None):
+    rows = []
+    for coding in score_codings(grid, cuts):
+        for score in ["score", "score_CNN"]:
+            for sample, (rows_of, constant) in samples.items():
+                available = [control for control in controls if control != constant]
+                for n in range(len(available) + 1):
+                    for subset in combinations(available, n):
+                        rows.append({"spec": f"{score} | {coding} | {' + '.join(subset) or 'none'} | {sample}",
+                                     "score": score, "coding": coding,
+                                     "groups": 0 if coding == "continuous" else len(coding.split(",")) + 1,
+                                     "controls": " + ".join(subset), "sample": sample})
+    return pd.DataFrame(rows).set_index("spec")
+
+# formula and score variable of a specification
+def spec_model(spec):
+    variable = spec["score"] if spec["coding"] == "continuous" else spec["score"].replace("score", "score_group")
+    right_side = " + ".join([variable] + ([spec["controls"]] if spec["controls"] else []) + ["C(Year)"])
+    return f"ln_vote_share ~ {right_side}", variable
+
+
+
+## sweep
+
+# fit the specifications of one score coding (run in a worker process): rows of the results table
+def fit_coding(data, coding, specs):
+    data = data.copy()
+    if coding != "continuous":
+        bins = [0] + [int(edge) for edge in coding.split(",")] + [100]
+        labels = list(range(1, len(bins)))
+        data["score_group"] = pd.cut(data["score"], bins = bins, labels = labels, include_lowest = True).astype(int)
+        data["score_group_CNN"] = pd.cut(data["score_CNN"], bins = bins, labels = labels, include_lowest = True).astype(int)
+
+    sample_rows = {sample: None if rows_of is None else rows_of(data).to_numpy() for sample, (rows_of, constant) in samples.items()}
+    models = {}
+    variables = {}
+    for key, spec in specs.iterrows():
+        formula, variables[key] = spec_model(spec)
+        models[key] = (formula, sample_rows[spec["sample"]])
+    results = fit_ols(data, models)
+
+    rows = []
+    for key, result in results.items():
+        variable = variables[key]
+        rows.append({"spec": key, **specs.loc[key].to_dict(),
+                     "coef": result.params[variable], "std_err": result.bse[variable], "p_value": result.pvalues[variable],
+                     "nobs": int(result.nobs), "r2": result.rsquared})
+    return pd.DataFrame(rows)
+
+# version of the score coding (bins, labels) & the sweep's models, bump it when fit_coding or spec_model changes so old results are fitted again
+SWEEP_VERSION = 1
+
+# fingerprint of the input data, the grid and the sweep version: rows of other fingerprints are not reused
+def sweep_fingerprint(data, grid = None, cuts = None):
+    sha = hashlib.sha256()
+    sha.update(pd.util.hash_pandas_object(data, index = False).to_numpy().tobytes())
+    sha.update(json.dumps({"columns": list(data.columns), "grid": grid or cut_grid, "cuts": cuts or max_cuts,
+                           "controls": controls, "samples": list(samples), "version": SWEEP_VERSION}).encode())
+    return sha.hexdigest()[:16]
+
+# finished rows of the results table with this fingerprint; a line cut off by an interruption is removed from the file,
+# and rows of other fingerprints (other data, grid or sweep version) are removed from the file
+def read_results(path, fingerprint = None):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return pd.DataFrame()
+    with open(path, "rb+") as file:
+        content = file.read()
+        if not content.endswith(b"\n"):
+            file.truncate(content.rfind(b"\n") + 1)
+    if os.path.getsize(path) == 0:
+        return pd.DataFrame()
+    results = read_table(path)
+    results["coding"] = results["coding"].astype(str)
+    results["controls"] = results["controls"].fillna("").astype(str)
+
+    if fingerprint is not None:
+        current = results["fingerprint"] == fingerprint if "fingerprint" in results else pd.Series(False, index = results.index)
+        if not current.all():
+            print(f"{int((~current).sum())} results of other data or settings are removed")
+            results = results[current]
+            temp_path = f"{path}.part"
+            results.to_csv(temp_path, index = False)
+            os.replace(temp_path, path)
+    return results.drop_duplicates("spec", keep = "last").set_index("spec")
+
+# fit all specifications that are not in the results table yet, appending the results of each score coding as it finishes
+def run_sweep(data, path = "../results/spec_curve/spec_curve.csv", grid = None, cuts = None, workers = None):
+    specs = specifications(grid, cuts)
+    fingerprint = sweep_fingerprint(data, grid, cuts)
+    done = read_results(path, fingerprint)
+    pending = specs[~specs.index.isin(done.index)]
+    print(f"{len(specs)} specifications, {len(specs) - len(pending)} done, {len(pending)} to fit")
+    if len(pending) == 0:
+        return done.loc[specs.index]
+
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = [executor.submit(fit_coding, data, coding, coding_specs) for coding, coding_specs in pending.groupby("coding", sort = False)]
+        for future in as_completed(futures):
+            rows = future.result().assign(fingerprint = fingerprint)
+            # one write per score coding, the header only for a new file
+            write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+            with open(path, "a", newline = "", encoding = "utf-8") as file:
+                rows.to_csv(file, header = write_header, index = False)
+                file.flush()
+                os.fsync(file.fileno())
+    return read_results(path, fingerprint).loc[specs.index]
+
+
+
+## specification curve
+
+# specifications sorted by the z statistic of the score (score points and score groups have different scales),
+# with a panel that shows the share of each choice along the curve (thousands of specifications are too many to mark one by one)
+def plot_spec_curve(results, filename, slices = 200):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    results = results.assign(z = results["coef"] / results["std_err"]).sort_values("z").reset_index()
+    x = np.arange(len(results))
+    choices = ([("score", value, results["score"] == value) for value in ["score", "score_CNN"]]
+               + [("coding", "continuous", results["coding"] == "continuous")]
+               + [("coding", f"{groups} groups", results["groups"] == groups) for groups in sorted(results["groups"].unique()) if groups > 0]
+               + [("control", control, results["controls"].str.contains(control, regex = False)) for control in controls]
+               + [("sample", sample, results["sample"] == sample) for sample in samples])
+    # share of the specifications with each choice in equal slices of the sorted specifications
+    edges = np.unique(np.linspace(0, len(results), min(slices, len(results)) + 1).astype(int))
+    shares = np.array([np.add.reduceat(marked.to_numpy(dtype = float), edges[:-1]) / np.diff(edges) for group, label, marked in choices])
+
+    fig, (top, bottom) = plt.subplots(2, 1, figsize = (12, 9), sharex = True, gridspec_kw = {"height_ratios": [2, 3]})
+    significant = (results["p_value"] < 0.05).to_numpy()
+    top.scatter(x[~significant], results["z"][~significant], s = 2, color = "grey", label = "p >= 0.05")
+    top.scatter(x[significant], results["z"][significant], s = 2, color = "tab:red", label = "p < 0.05")
+    for bound in (-1.96, 1.96):
+        top.axhline(bound, color = "black", linestyle = "--", linewidth = 0.8)
+    top.axhline(0, color = "black", linewidth = 0.8)
+    top.set_ylabel("z statistic of the score (HC1)")
+    top.set_title(f"Specification Curve: Effect of Facial Attractiveness Score on ln Vote Share ({len(results)} specifications)")
+    top.legend(loc = "upper left", markerscale = 4)
+
+    image = bottom.imshow(shares, aspect = "auto", cmap = "Blues", vmin = 0, vmax = 1, interpolation = "nearest",
+                          extent = [-0.5, len(results) - 0.5, len(choices) - 0.5, -0.5])
+    bottom.set_yticks(range(len(choices)))
+    bottom.set_yticklabels([label for group, label, marked in choices])
+    for boundary in np.cumsum([sum(group == name for group, label, marked in choices) for name in ["score", "coding", "control"]]):
+        bottom.axhline(boundary - 0.5, color = "black", linewidth = 0.8)
+    fig.colorbar(image, ax = [top, bottom], location = "right", shrink = 0.5, label = "Share of the specifications")
+    bottom.set_xlabel("Specifications (sorted by z statistic)")
+
+    fig.savefig(filename, dpi = 150, bbox_inches = "tight")
+    plt.close(fig)
+
+
+
+## sweep & figure
+
+# fit the specification sweep on alldata_CA and draw its curve
+def sweep(path = "../results/alldata_CA.csv", output_dir = "../results/spec_curve", grid = None, cuts = None, workers = None):
+    alldata_CA = read_table(path)
+    results = run_sweep(alldata_CA, os.path.join(output_dir, "spec_curve.csv"), grid, cuts, workers)
+    plot_spec_curve(results, os.path.join(output_dir, "spec_curve.png"))
+    # share of the specifications with a positive and a significantly positive effect
+    print(f"positive: {(results['coef'] > 0).mean():.1%}, positive & p < 0.05: {((results['coef'] > 0) & (results['p_value'] < 0.05)).mean():.1%}")
+
+
+if __name__ == "__main__":
+    sweep()
@@ -0,0 +1,73 @@
+# This file contains functions and methods that are used to read and write the datasets passed between stages
+import os
+import pandas as pd
+
+# Parquet support is optional
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+
+# storage format of intermediate datasets: "csv" (default) or "parquet"
+storage_format = os.environ.get("STORAGE_FORMAT", "csv")
+# the csv fallback is reported once
+fallback_reported = False
+
+def set_storage_format(name):
+    global storage_format
+    if name not in ("csv", "parquet"):
+        raise ValueError(f"unknown storage format: {name} (use csv or parquet)")
+    storage_format = name
+
+# Parquet is used when it is the storage format and pyarrow is installed, otherwise the datasets are read & written as csv
+def use_parquet():
+    global fallback_reported
+    if storage_format == "parquet" and pq is None:
+        if not fallback_reported:
+            print("Warning - the storage format is parquet but pyarrow is not installed (pip install -r requirements.txt), reading & writing csv instead")
+            fallback_reported = True
+        return False
+    return storage_format == "parquet"
+
+# datasets are named by their .csv path, the Parquet copy sits next to it
+def parquet_path(path):
+    return os.path.splitext(path)[0] + ".parquet"
+
+# write a dataset: Parquet when enabled, csv otherwise (or always with keep_csv, for files that are read by people)
+def write_table(data, path, index = False, keep_csv = False):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+    parquet = use_parquet()
+    if parquet:
+        data.to_parquet(parquet_path(path), index = index)
+    if keep_csv or not parquet:
+        data.to_csv(path, index = index, encoding = "utf-8")
+
+# the dataset has been written in either format
+def table_exists(path):
+    return os.path.exists(path) or os.path.exists(parquet_path(path))
+
+# read a dataset, only the given columns: Parquet (memory-mapped) when enabled and available, csv otherwise
+def read_table(path, columns = None):
+    if use_parquet() and os.path.exists(parquet_path(path)):
+        return pq.read_table(parquet_path(path), columns = columns, memory_map = True).to_pandas()
+    if pq is None and not os.path.exists(path) and os.path.exists(parquet_path(path)):
+        raise FileNotFoundError(f"{path} only exists as {parquet_path(path)}, which needs pyarrow (pip install -r requirements.txt)")
+    return pd.read_csv(path, usecols = columns, encoding = "utf-8")
+
+# read an Excel workbook through a Parquet copy that is made once and refreshed when the workbook changes
+def read_excel_cached(path, columns = None):
+    if pq is None:
+        return pd.read_excel(path, usecols = columns)
+
+    cached_path = parquet_path(path)
+    if not os.path.exists(cached_path) or os.path.getmtime(cached_path) < os.path.getmtime(path):
+        data = pd.read_excel(path)
+        try:
+            data.to_parquet(cached_path, index = False)
+        except (pa.ArrowException, TypeError, ValueError):
+            # columns with mixed types can not be stored in Parquet, use the workbook directly
+            return data[columns] if columns is not None else data
+    return pq.read_table(cached_path, columns = columns, memory_map = True).to_pandas()
@@ -0,0 +1,205 @@
+# This file contains functions and methods that are used to score a folder of photos as a stream with bounded memory
+# a producer thread reads & decodes the next images while the current one is detected, and a writer thread appends
+# each result to a checkpoint file as soon as it is produced, so an interrupted run resumes where it stopped
+import os
+import csv
+import queue
+import threading
+from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+# detectors & scoring
+import face_score
+# score cache
+import score_cache
+# csv / Parquet datasets
+from storage import write_table
+
+
+
+## settings
+
+# decoded images waiting for detection (a 3000 x 4000 photo is 12 MB in gray), or images in flight in the worker processes per worker
+prefetch_size = int(os.environ.get("PREFETCH_SIZE", 4))
+# results waiting to be written
+result_queue_size = 64
+# the checkpoint is synced to disk and new scores are saved in the score cache every checkpoint_every images
+checkpoint_every = int(os.environ.get("CHECKPOINT_EVERY", 16))
+
+checkpoint_columns = ["image", "ID", "hash", "score", "score_CNN", "mode"]
+
+# scoring settings of the checkpoint rows, rows of other settings are scored again
+def score_mode(cascade_max_size = None):
+    return "exhaustive" if cascade_max_size is None else f"cascade={cascade_max_size}"
+
+# {folder}_scores.csv -> {folder}_scores.checkpoint.csv
+def checkpoint_path(output_path):
+    return f"{os.path.splitext(output_path)[0]}.checkpoint.csv"
+
+# scores of the images finished by an interrupted run: {image file name: (content hash, {detector: score})}, the last row of an image wins
+# a line cut off by the interruption is removed from the file, a checkpoint with other columns (older version) is started again
+def read_checkpoint(path, mode):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return {}
+    with open(path, "rb+") as file:
+        content = file.read()
+        if not content.endswith(b"\n"):
+            file.truncate(content.rfind(b"\n") + 1)
+    if os.path.getsize(path) == 0:
+        return {}
+    rows = pd.read_csv(path, dtype = {"image": str, "ID": str, "hash": str, "mode": str})
+    if list(rows.columns) != checkpoint_columns:
+        os.remove(path)
+        return {}
+    rows = rows[rows["mode"] == mode]
+    return {row["image"]: (row["hash"], {"HOG": None if pd.isna(row["score"]) else int(row["score"]),
+                                         "CNN": None if pd.isna(row["score_CNN"]) else int(row["score_CNN"])})
+            for row in rows.to_dict("records")}
+
+
+
+## stages
+
+# put an item on a bounded queue, waiting while running() is true: False if it stopped first
+def put(items, item, running):
+    while running():
+        try:
+            items.put(item, timeout = 0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+# producer thread: decode the images in order, (image, gray, phases) on the queue (gray None if the image can not be read)
+def produce(images, decoded, stop):
+    for image in images:
+        phases = {}
+        if not put(decoded, (image, face_score.decode_image(image, phases), phases), lambda: not stop.is_set()):
+            return
+
+# writer thread: append the result rows to the checkpoint until None, flushed after every row and synced every `every` rows
+def write_rows(path, rows, every, errors):
+    try:
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, "a", newline = "", encoding = "utf-8") as file:
+            writer = csv.writer(file)
+            if new_file:
+                writer.writerow(checkpoint_columns)
+            written = 0
+            while True:
+                row = rows.get()
+                if row is None:
+                    break
+                writer.writerow(row)
+                file.flush()
+                written += 1
+                if written % every == 0:
+                    os.fsync(file.fileno())
+            os.fsync(file.fileno())
+    except Exception as e:
+        errors.append(e)
+
+
+
+## streaming scorer
+
+# scores of all images in a folder, written to output_path like clean_data.score; the results are appended to
+# {output}.checkpoint.csv as they are produced and an interrupted run only scores the images that are not in it
+# (or whose content hash changed, e.g. a photo replaced before the resume)
+#   workers = 1: a producer thread decodes up to prefetch images ahead of detection in this process
+#   workers > 1: at most prefetch images per worker are in flight in the pool, results are written as they complete
+#   cache, cascade_max_size, exclude: see face_score.score_folder (batched CNN detection is not streamed)
+def score_stream(folder, output_path, workers = 1, model_dir = "../data/raw/dlib_model", cache = None, cascade_max_size = None, exclude = None, prefetch = None):
+    prefetch = prefetch or prefetch_size
+    exclude = {Path(image) for image in exclude or []}
+    images = sorted(image for image in Path(folder).iterdir() if image.is_file() and image not in exclude)
+    detectors = tuple(face_score.analyzers)
+    mode = score_mode(cascade_max_size)
+    checkpoint = checkpoint_path(output_path)
+    hashes = {image: score_cache.file_hash(image) for image in images}
+    saved = read_checkpoint(checkpoint, mode)
+    done = {name: scores for name, (image_hash, scores) in saved.items()}
+    pending = [image for image in images if image.name not in saved or saved[image.name][0] != hashes[image]]
+    print(f"{Path(folder).name}: {len(images)} images, {len(images) - len(pending)} in the checkpoint, {len(pending)} to score")
+
+    # cached scores of the pending images
+    known = {image: {} for image in pending}
+    if cache is not None and pending:
+        models = face_score.cache_models(model_dir, None, cascade_max_size)
+        cached = score_cache.get_scores(cache, set(hashes.values()), models, face_score.SCORE_VERSION)
+        known = {image: {name: cached[(hashes[image], name)] for name in detectors if (hashes[image], name) in cached} for image in pending}
+    new_scores = {}
+
+    # writer thread
+    rows = queue.Queue(maxsize = result_queue_size)
+    errors = []
+    writer = threading.Thread(target = write_rows, args = (checkpoint, rows, checkpoint_every, errors), daemon = True)
+    writer.start()
+
+    def finish(image, scores):
+        if not put(rows, [image.name, image.stem, hashes[image], scores.get("HOG"), scores.get("CNN"), mode], writer.is_alive):
+            raise RuntimeError(f"checkpoint writer stopped: {errors[0] if errors else 'unknown error'}")
+        done[image.name] = scores
+        # detectors that failed with an error have no score and are not cached
+        if cache is not None:
+            new_scores.update({(hashes[image], name): score for name, score in scores.items() if name not in known[image]})
+            if len(new_scores) >= checkpoint_every:
+                score_cache.put_scores(cache, new_scores, models, face_score.SCORE_VERSION)
+                new_scores.clear()
+
+    todo = []
+    for image in pending:
+        if len(known[image]) == len(detectors):
+            finish(image, known[image])
+        else:
+            todo.append((image, tuple(name for name in detectors if name not in known[image])))
+
+    stop = threading.Event()
+    try:
+        if workers <= 1:
+            if face_score.detector is None:
+                face_score.load_models(model_dir)
+            decoded = queue.Queue(maxsize = prefetch)
+            producer = threading.Thread(target = produce, args = ([image for image, names in todo], decoded, stop), daemon = True)
+            producer.start()
+            for image, names in todo:
+                image, gray, phases = decoded.get()
+                if gray is None:
+                    scores = {}
+                elif cascade_max_size is not None:
+                    scores = face_score.score_gray_cascade(image, gray, names, cascade_max_size, phases)
+                else:
+                    scores = face_score.score_gray(image, gray, names, phases)
+                finish(image, {**known[image], **scores})
+        elif todo:
+            task = face_score.score_image if cascade_max_size is None else partial(face_score.score_image_cascade, max_size = cascade_max_size)
+            with ProcessPoolExecutor(max_workers = workers, initializer = face_score.load_models, initargs = (model_dir,)) as executor:
+                running = {}
+                jobs = iter(todo)
+                while True:
+                    for image, names in jobs:
+                        running[executor.submit(task, image, names)] = image
+                        if len(running) >= workers * prefetch:
+                            break
+                    if not running:
+                        break
+                    completed, _ = wait(running, return_when = FIRST_COMPLETED)
+                    for future in completed:
+                        image = running.pop(future)
+                        finish(image, {**known[image], **future.result()})
+    finally:
+        stop.set()
+        put(rows, None, writer.is_alive)
+        writer.join()
+        if cache is not None and new_scores:
+            score_cache.put_scores(cache, new_scores, models, face_score.SCORE_VERSION)
+    if errors:
+        raise RuntimeError(f"checkpoint writer stopped: {errors[0]}")
+
+    # all images are done: the scores table in image order (images scored by both detectors), then the checkpoint is removed
+    results = [{"ID": image.stem, "score": done[image.name]["HOG"], "score_CNN": done[image.name]["CNN"]}
+               for image in images if done[image.name].get("HOG") is not None and done[image.name].get("CNN") is not None]
+    write_table(pd.DataFrame(results, columns = ["ID", "score", "score_CNN"]), output_path)
+    os.remove(checkpoint)
+    return results
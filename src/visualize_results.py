@@ -1,136 +1,168 @@
 # This file contains functions and methods that are used to visualize the results
 import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+# object-oriented Matplotlib figures: each figure has its own Agg canvas, no pyplot state is shared between figures
+from matplotlib.figure import Figure
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+# summary statistics cube of analyze_data.py
+from cube import read_cube, cube_rows, summarize, score_groups, score_group_keys
 
 
 
-# read the data
-alldata_CA = pd.read_csv("../results/alldata_CA.csv", encoding = "utf-8")
+## aggregates
 
+# ln vote share (mean), Democratic & Incumbent counts and N by score group, over the cells selected by rows
+# computed once for each score, number of groups and subset, and shared by the party and incumbent figures
+def score_group_aggregate(cube, score, num_groups, rows = None):
+    cells = cube if rows is None else cube[rows]
+    groups = list(score_groups[num_groups])
+    keys = score_group_keys(cells, score, num_groups)
+    summary = summarize(cells, ["ln_vote_share", score], by = keys, levels = groups)
+    democratic = cube_rows(cells, "Party", ["Democratic"])
+    incumbent = cube_rows(cells, "Incumbent", [1])
+    return pd.DataFrame({f"{score}_group": groups,
+                         "ln_vote_share (mean)": summary["ln_vote_share"]["Mean"].to_numpy(),
+                         "democratic_count": summarize(cells, [], rows = democratic, by = keys[democratic], levels = groups)["rows"].to_numpy(),
+                         "Incumbent_count": summarize(cells, [], rows = incumbent, by = keys[incumbent], levels = groups)["rows"].to_numpy(),
+                         "count": summary[score]["N"].to_numpy()})
 
 
-## Scatter Plot: ln Vote Share V.S. Score & Score_CNN
 
-# party
-os.makedirs("../results/figures/lnVoteShare_Score/byParty", exist_ok = True)
+## Scatter Plot: ln Vote Share V.S. Score & Score_CNN
 
-def scatterplot_lnVoteShare_Score_byParty(data, score_type, num_groups):
+# party & incumbent figures: count column of the group, annotation labels & colorbar label
+figure_styles = {"byParty": {"count": "democratic_count", "group": "Democratic", "other": "Non-democratic",
+                             "colorbar": "Proportion of Democratic Candidates"},
+                 "byIncumbent": {"count": "Incumbent_count", "group": "Incumbent", "other": "Not Incumbent",
+                                 "colorbar": "Proportion of Incumbent Candidates"}}
+
+# scatter plot of one aggregate: circle size = N, circle color = share of the group (Democratic or Incumbent)
+def scatterplot_lnVoteShare_Score(grouped_data, kind, score_type, num_groups, title, filename):
+    style = figure_styles[kind]
+    group_column = f"{score_type}_group"
+    # each score group: other sample = total sample - group sample, group ratio = group sample / total sample (for circle color)
+    grouped_data = grouped_data.assign(other_count = grouped_data["count"] - grouped_data[style["count"]],
+                                       ratio = grouped_data[style["count"]] / grouped_data["count"])
+
+    fig = Figure(figsize = (8, 5))
+    ax = fig.subplots()
+    scatter = ax.scatter(grouped_data[group_column],
+                         grouped_data["ln_vote_share (mean)"],
+                         # circle size
+                         s = grouped_data["count"]*5,
+                         # circle color
+                         c = grouped_data["ratio"],
+                         cmap = "coolwarm",
+                         alpha = 0.7)
 
-    # score groups
-    if num_groups == 3:
-        bins = [0, 75, 80, 100]
-        labels = ["below 74.99", "75-79.99", "above 80"]
-    else:
-        bins = [0, 70, 75, 80, 100]
-        labels = ["below 69.99", "70-74.99", "75-79.99", "above 80"]
-    data[f"{score_type}_group"] = pd.cut(data[score_type], bins = bins, labels = labels, include_lowest = True)
-
-    grouped_data = data.groupby(f"{score_type}_group", observed = False).agg({"ln_vote_share": "mean",
-                                                                              "Democratic": "sum",
-                                                                              score_type: "count"}).reset_index()
-
-    grouped_data.columns = [f"{score_type}_group", "ln_vote_share (mean)", "democratic_count", "count"]
-    # each score group: non-democratic sample = total sample - democratic sample
-    grouped_data["nondemocratic_count"] = grouped_data["count"] - grouped_data["democratic_count"]
-    
-    # each score group: democratic ratio = democratic sample / total sample (for circle color)
-    grouped_data["democratic_ratio"] = grouped_data["democratic_count"] / grouped_data["count"]
-
-    # scatter plot
-    plt.figure(figsize = (8, 5))
-    scatter = plt.scatter(grouped_data[f"{score_type}_group"], 
-                          grouped_data["ln_vote_share (mean)"], 
-                          # circle size
-                          s = grouped_data["count"]*5, 
-                          # circle color
-                          c = grouped_data["democratic_ratio"], 
-                          cmap = "coolwarm", 
-                          alpha = 0.7)
-    
     for i, row in grouped_data.iterrows():
-        x_pos = row[f"{score_type}_group"]
-        y_pos = row["ln_vote_share (mean)"]
-        if x_pos == grouped_data[f"{score_type}_group"].max():
+        if row[group_column] == grouped_data[group_column].iloc[-1]:
             # the highest score group
             xytext = (-150, -5)
         else:
-            xytext = (-1, 5)        
-        plt.annotate(f"Total: {int(row["count"])}\n(Democratic: {int(row["democratic_count"])}, Non-democratic: {int(row["nondemocratic_count"])})", 
-                     (row[f"{score_type}_group"], row["ln_vote_share (mean)"]),
-                     xytext = xytext, textcoords = "offset points", fontsize = 8)
-    
-    plt.title(f"ln Vote Share by {score_type} ({num_groups} groups)")
-    plt.xlabel("Score Groups")
-    plt.ylabel("ln Vote Share (mean)")
-    plt.colorbar(scatter, label = "Proportion of Democratic Candidates")
-    plt.tight_layout()
-    plt.savefig(f"../results/figures/lnVoteShare_Score/byParty/ln_vote_share_{score_type}_{num_groups}_groups.png")
-    plt.close()
-
-scatterplot_lnVoteShare_Score_byParty(alldata_CA, "score", 3)
-scatterplot_lnVoteShare_Score_byParty(alldata_CA, "score", 4)
-scatterplot_lnVoteShare_Score_byParty(alldata_CA, "score_CNN", 3)
-scatterplot_lnVoteShare_Score_byParty(alldata_CA, "score_CNN", 4)
-
-# incumbent
-os.makedirs("../results/figures/lnVoteShare_Score/byIncumbent", exist_ok = True)
-
-def scatterplot_lnVoteShare_Score_byIncumbent(data, score_type, num_groups):
-
-    # score groups
-    if num_groups == 3:
-        bins = [0, 75, 80, 100]
-        labels = ["below 74.99", "75-79.99", "above 80"]
+            xytext = (-1, 5)
+        ax.annotate(f"Total: {int(row['count'])}\n({style['group']}: {int(row[style['count']])}, {style['other']}: {int(row['other_count'])})",
+                    (row[group_column], row["ln_vote_share (mean)"]),
+                    xytext = xytext, textcoords = "offset points", fontsize = 8)
+
+    ax.set_title(title)
+    ax.set_xlabel("Score Groups")
+    ax.set_ylabel("ln Vote Share (mean)")
+    fig.colorbar(scatter, ax = ax, label = style["colorbar"])
+    fig.tight_layout()
+    fig.savefig(filename)
+
+# render one figure in a worker process: (filename, fingerprint)
+def render_figure(figure):
+    os.makedirs(os.path.dirname(figure["filename"]), exist_ok = True)
+    scatterplot_lnVoteShare_Score(figure["aggregate"], figure["kind"], figure["score"], figure["num_groups"], figure["title"], figure["filename"])
+    return figure["filename"], figure["fingerprint"]
+
+
+
+## figure list
+
+# fingerprints of the rendered figures: a figure is rendered again only if its aggregate, parameters or this file have changed
+state_path = "../results/figures/figure_state.json"
+
+def load_figure_state(path = None):
+    path = path or state_path
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding = "utf-8") as file:
+        return json.load(file)
+
+def save_figure_state(state, path = None):
+    path = path or state_path
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    temp_path = f"{path}.part"
+    with open(temp_path, "w", encoding = "utf-8") as file:
+        json.dump(state, file, indent = 1, sort_keys = True)
+    os.replace(temp_path, path)
+
+# fingerprint: hash of the plotting code, the parameters and the aggregate of a figure
+def figure_fingerprint(figure, code):
+    parameters = {name: value for name, value in figure.items() if name not in ("aggregate", "fingerprint")}
+    sha = hashlib.sha256(code.encode())
+    sha.update(json.dumps(parameters, sort_keys = True).encode())
+    sha.update(figure["aggregate"].to_csv(index = False).encode())
+    return sha.hexdigest()
+
+# all figures: party & incumbent figures of each score and number of groups, for all years and (by_year) for each year
+def figure_list(cube, output_dir = "../results/figures/lnVoteShare_Score", by_year = False):
+    subsets = [(None, output_dir, "")]
+    if by_year:
+        years = sorted(cube.index.get_level_values("Year").unique())
+        subsets += [(year, os.path.join(output_dir, str(year)), f"{year}, ") for year in years]
+
+    with open(os.path.abspath(__file__), "rb") as file:
+        code = hashlib.sha256(file.read()).hexdigest()
+    figures = []
+    for year, folder, title_prefix in subsets:
+        rows = None if year is None else cube_rows(cube, "Year", [year])
+        for score_type in ["score", "score_CNN"]:
+            for num_groups in [3, 4]:
+                # one aggregate for the party and the incumbent figure
+                aggregate = score_group_aggregate(cube, score_type, num_groups, rows)
+                for kind in ["byParty", "byIncumbent"]:
+                    figure = {"kind": kind, "score": score_type, "num_groups": num_groups, "aggregate": aggregate,
+                              "title": f"ln Vote Share by {score_type} ({title_prefix}{num_groups} groups)",
+                              "filename": os.path.join(folder, kind, f"ln_vote_share_{score_type}_{num_groups}_groups.png").replace(os.sep, "/")}
+                    figure["fingerprint"] = figure_fingerprint(figure, code)
+                    figures.append(figure)
+    return figures
+
+
+
+## all figures
+
+# a worker process starts (and imports Matplotlib) in about the time of 4 to 5 figures, so a pool is only used for at least 4 figures per worker
+figures_per_worker = 4
+
+# scatter plots of ln vote share by score group, for party and incumbent
+#   figures whose fingerprint is unchanged (and whose file exists) are skipped unless force, the others are rendered by a pool of workers
+def plot(path = "../results/summary_cube.csv", by_year = False, workers = None, force = False):
+    cube = read_cube(path)
+    figures = figure_list(cube, by_year = by_year)
+    state = load_figure_state()
+    stale = [figure for figure in figures
+             if force or state.get(figure["filename"]) != figure["fingerprint"] or not os.path.exists(figure["filename"])]
+    print(f"{len(figures)} figures, {len(figures) - len(stale)} unchanged, {len(stale)} to render")
+    if not stale:
+        return
+
+    # at most one worker per CPU, and each worker gets enough figures to pay for its start (1 CPU or few stale figures: in this process)
+    workers = min(workers or os.cpu_count(), os.cpu_count() or 1, len(stale) // figures_per_worker)
+    if workers <= 1:
+        rendered = [render_figure(figure) for figure in stale]
     else:
-        bins = [0, 70, 75, 80, 100]
-        labels = ["below 69.99", "70-74.99", "75-79.99", "above 80"]
-    data[f"{score_type}_group"] = pd.cut(data[score_type], bins = bins, labels = labels, include_lowest = True)
-
-    grouped_data = data.groupby(f"{score_type}_group", observed = False).agg({"ln_vote_share": "mean",
-                                                                              "Incumbent": "sum",
-                                                                              score_type: "count"}).reset_index()
-
-    grouped_data.columns = [f"{score_type}_group", "ln_vote_share (mean)", "Incumbent_count", "count"]
-    # each score group: non-Incumbent sample = total sample - Incumbent sample
-    grouped_data["nonIncumbent_count"] = grouped_data["count"] - grouped_data["Incumbent_count"]
-
-    # each score group: Incumbent ratio = Incumbent sample / total sample (for circle color)
-    grouped_data["Incumbent_ratio"] = grouped_data["Incumbent_count"] / grouped_data["count"]
-    
-    # scatter plot
-    plt.figure(figsize = (8, 5))
-    scatter = plt.scatter(grouped_data[f"{score_type}_group"], 
-                          grouped_data["ln_vote_share (mean)"], 
-                          # circle size
-                          s = grouped_data["count"]*5, 
-                          # circle color
-                          c = grouped_data["Incumbent_ratio"], 
-                          cmap = "coolwarm", 
-                          alpha = 0.7)
-    
-    for i, row in grouped_data.iterrows():
-        x_pos = row[f"{score_type}_group"]
-        y_pos = row["ln_vote_share (mean)"]
-        if x_pos == grouped_data[f"{score_type}_group"].max():
-            # the highest score group
-            xytext = (-150, -5)
-        else:
-            xytext = (-1, 5)        
-        plt.annotate(f"Total: {int(row["count"])}\n(Incumbent: {int(row["Incumbent_count"])}, Not Incumbent: {int(row["nonIncumbent_count"])})", 
-                     (row[f"{score_type}_group"], row["ln_vote_share (mean)"]),
-                     xytext = xytext, textcoords = "offset points", fontsize = 8)
-    
-    plt.title(f"ln Vote Share by {score_type} ({num_groups} groups)")
-    plt.xlabel("Score Groups")
-    plt.ylabel("ln Vote Share (mean)")
-    plt.colorbar(scatter, label = "Proportion of Incumbent Candidates")
-    plt.tight_layout()
-    plt.savefig(f"../results/figures/lnVoteShare_Score/byIncumbent/ln_vote_share_{score_type}_{num_groups}_groups.png")
-    plt.close()
-
-scatterplot_lnVoteShare_Score_byIncumbent(alldata_CA, "score", 3)
-scatterplot_lnVoteShare_Score_byIncumbent(alldata_CA, "score", 4)
-scatterplot_lnVoteShare_Score_byIncumbent(alldata_CA, "score_CNN", 3)
-scatterplot_lnVoteShare_Score_byIncumbent(alldata_CA, "score_CNN", 4)
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            rendered = list(executor.map(render_figure, stale))
+    state.update(dict(rendered))
+    save_figure_state(state)
+
+
+if __name__ == "__main__":
+    plot()
@@ -0,0 +1,12 @@
+# The modules of src/ are scripts that import each other by name and use paths relative to src/ (e.g. ../data/processed)
+import os
+import sys
+import pytest
+
+src_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, src_dir)
+
+# run every test from src/, like main.py
+@pytest.fixture(autouse = True)
+def in_src_dir(monkeypatch):
+    monkeypatch.chdir(src_dir)
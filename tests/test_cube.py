@@ -0,0 +1,73 @@
+# The roll-ups of the summary cube (cube.summarize) must give the groupby count / mean / std / min / max of the rows they cover
+import numpy as np
+import pandas as pd
+import pytest
+from cube import build_cube, summarize, cube_rows, score_group_keys
+
+
+# six candidates: 2018 has three rows (Age 30, 40, 50 -> mean 40, std 10), 2020 two rows, 2022 a single row (std NaN)
+@pytest.fixture
+def data():
+    return pd.DataFrame({"Year": [2018, 2018, 2018, 2020, 2020, 2022],
+                         "Gender": ["F", "M", "F", "M", "M", "F"],
+                         "Party": ["Democratic", "Republican", "Democratic", "Republican", "Green", "Democratic"],
+                         "Incumbent": [1, 0, 0, 1, 0, 1],
+                         "city_type": ["urban", "rural", "urban", "transition", "rural", "urban"],
+                         "Edu_Level": [3, 2, 1, 2, np.nan, 3],
+                         "Age_Group": ["<40", "40-50", "40-50", "50-60", "60-70", ">70"],
+                         "score": [65, 72, 78, 81, 69.5, 75],
+                         "score_CNN": [66, 70, 80, 85, 71, 74],
+                         "Age": [30, 40, 50, 55, 65, 80],
+                         "vote_share": [0.6, 0.4, 0.55, 0.7, np.nan, 1.0],
+                         # large values with a small spread: the shifted sums of squares keep the std exact
+                         "Pop_Total": [1e9 + 1, 1e9 + 2, 1e9 + 3, 1e9 + 4, 1e9 + 6, 1e9]})
+
+variables = ["Age", "vote_share", "score", "Pop_Total"]
+
+# the std of each group from Series.std (two passes), the one-pass groupby std loses digits on values like 1e9 + 1
+def groupby_summary(data, keys, variable):
+    grouped = data.groupby(keys, observed = False)[variable]
+    return pd.DataFrame({"N": grouped.count(), "Mean": grouped.mean(), "Std": grouped.agg(lambda values: values.std()), "Min": grouped.min(), "Max": grouped.max()})
+
+def check_summary(summary, expected):
+    pd.testing.assert_frame_equal(summary.reset_index(drop = True), expected.reset_index(drop = True), check_dtype = False, rtol = 1e-12)
+
+def test_known_values(data):
+    cube = build_cube(data, variables)
+    years = [2018, 2020, 2022]
+    summary = summarize(cube, variables, by = cube.index.get_level_values("Year"), levels = years)
+    assert summary["rows"].tolist() == [3, 2, 1]
+    assert summary["Age"]["N"].tolist() == [3, 2, 1]
+    assert summary["Age"]["Mean"].tolist() == [40, 60, 80]
+    assert summary["Age"].loc[2018, "Std"] == pytest.approx(10)
+    assert summary["Age"].loc[2020, "Std"] == pytest.approx(np.sqrt(50))
+    # a group of one row has no standard deviation
+    assert np.isnan(summary["Age"].loc[2022, "Std"])
+    # missing values are not counted
+    assert summary["vote_share"].loc[2020, "N"] == 1 and np.isnan(summary["vote_share"].loc[2020, "Std"])
+    assert summary["Pop_Total"].loc[2018, "Std"] == pytest.approx(1, rel = 1e-12)
+
+@pytest.mark.parametrize("dimension", ["Year", "Gender", "Party", "city_type"])
+def test_groups_match_groupby(data, dimension):
+    cube = build_cube(data, variables)
+    levels = sorted(data[dimension].unique())
+    summary = summarize(cube, variables, by = cube.index.get_level_values(dimension), levels = levels)
+    for variable in variables:
+        check_summary(summary[variable], groupby_summary(data, dimension, variable))
+
+def test_total_and_subset_match_pandas(data):
+    cube = build_cube(data, variables)
+    total = summarize(cube, variables)
+    women = summarize(cube, variables, rows = cube_rows(cube, "Gender", ["F"]))
+    for variable in variables:
+        check_summary(total[variable], groupby_summary(data.assign(all = 0), "all", variable))
+        check_summary(women[variable], groupby_summary(data[data["Gender"] == "F"].assign(all = 0), "all", variable))
+
+def test_score_groups_match_groupby(data):
+    cube = build_cube(data, variables)
+    keys = score_group_keys(cube, "score", 3)
+    levels = ["below 74.99", "75-79.99", "above 80"]
+    summary = summarize(cube, ["Age"], by = keys, levels = levels)
+    groups = pd.cut(data["score"], bins = [0, 75, 80, 100], labels = levels, include_lowest = True)
+    expected = groupby_summary(data.assign(group = groups), "group", "Age")
+    check_summary(summary["Age"], expected.reindex(levels))
@@ -0,0 +1,57 @@
+# The batch geometry (score_landmarks_batch) must give the ratios and scores of the scalar path (score_landmarks) for any 68 landmarks
+import numpy as np
+import pytest
+import face_score
+
+
+# synthetic faces: a frontal face with the ideal proportions (two equal courts, five equal eyes), jittered so the ratios and scores spread out
+def synthetic_landmarks(n, seed = 0, jitter = 12):
+    rng = np.random.default_rng(seed)
+    face = np.zeros((68, 2))
+    # jaw 0-16 from ear to ear through the chin (8)
+    angles = np.linspace(0, np.pi, 17)
+    face[0:17] = np.column_stack([200 - 100 * np.cos(angles), 150 + 120 * np.sin(angles)])
+    # eyebrows 17-26 (centre of 21 & 22 at y = 110), nose 27-35 (33 = lowest point, y = 190), eyes 36-47
+    face[17:27] = np.column_stack([np.linspace(128, 272, 10), np.full(10, 110)])
+    face[27:36] = np.column_stack([np.full(9, 200), np.linspace(130, 190, 9)])
+    face[33] = [200, 190]
+    face[36:42] = np.column_stack([np.linspace(140, 180, 6), np.full(6, 150)])
+    face[42:48] = np.column_stack([np.linspace(220, 260, 6), np.full(6, 150)])
+    face[48:68] = np.column_stack([np.linspace(170, 230, 20), np.full(20, 230)])
+    # eye corners 36, 39, 42, 45 split the face width (0 to 16) in five, the chin (8) is as far below the nose as the nose below the eyebrows
+    face[[0, 36, 39, 42, 45, 16]] = [[100, 150], [140, 150], [180, 150], [220, 150], [260, 150], [300, 150]]
+    face[8] = [200, 270]
+    return np.rint(face + rng.uniform(-jitter, jitter, size = (n, 68, 2))).astype(int)
+
+def scalar_geometry(landmarks):
+    return face_score.calculate_two_courts(landmarks), face_score.calculate_five_eyes(landmarks), face_score.score_landmarks(landmarks)
+
+@pytest.mark.parametrize("seed, jitter", [(0, 4), (1, 12), (2, 40)])
+def test_batch_geometry_matches_scalar(seed, jitter):
+    landmarks = synthetic_landmarks(50, seed, jitter)
+    batch = face_score.score_landmarks_batch(landmarks)
+    for i, face in enumerate(landmarks):
+        two_courts, five_eyes, score = scalar_geometry(face)
+        np.testing.assert_allclose(batch["two_courts"][i], two_courts, rtol = 1e-12)
+        np.testing.assert_allclose(batch["five_eyes"][i], five_eyes, rtol = 1e-12)
+        assert batch["score"][i] == score
+
+def test_ideal_face():
+    assert face_score.score_landmarks(synthetic_landmarks(1, 0, 0)[0]) == 100
+
+def test_scores_spread():
+    # the jitter gives faces of different scores, so the comparison above is not on one value
+    scores = face_score.score_landmarks_batch(synthetic_landmarks(50, 3, 40))["score"]
+    assert len(set(scores.tolist())) > 5
+
+def test_float_landmarks():
+    landmarks = synthetic_landmarks(20, 4, 12) + 0.5
+    batch = face_score.score_landmarks_batch(landmarks)
+    assert batch["score"].tolist() == [face_score.score_landmarks(face) for face in landmarks]
+
+def test_zero_score_floor():
+    # a badly distorted face scores 0 in both paths, not a negative number
+    landmarks = synthetic_landmarks(1, 5, 0)
+    landmarks[0, 16] = landmarks[0, 0] + [3, 0]
+    assert face_score.score_landmarks(landmarks[0]) == 0
+    assert face_score.score_landmarks_batch(landmarks)["score"].tolist() == [0]
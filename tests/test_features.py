@@ -0,0 +1,89 @@
+# The vectorized features (features.build_features) must give the columns of the earlier row-wise code of analyze_data.py
+import numpy as np
+import pandas as pd
+import pytest
+from features import build_features, city_type_codes, city_types
+
+
+# city_type of the earlier row-wise apply, kept here as the reference
+def city_type(row):
+    if row["Year"] == 2018:
+        if row["Median_Household_Income"] >= 100000 and row["Pop_Total"] >= 760000:
+            return "urban"
+        elif row["Median_Household_Income"] < 75000 and row["Pop_Total"] < 720000:
+            return "rural"
+        else:
+            return "transition"
+    else:
+        if row["Median_Household_Income"] >= 100000 and row["Pop_Total"] >= 760000:
+            return "urban"
+        elif row["Median_Household_Income"] < 75000 and row["Pop_Total"] < 730000:
+            return "rural"
+        else:
+            return "transition"
+
+# districts on each side of every threshold: (Year, Median_Household_Income, Pop_Total, city_type)
+boundary_rows = [
+    # urban: income & population at or above 100000 & 760000 (every year)
+    (2018, 100000, 760000, "urban"),
+    (2018, 99999, 760000, "transition"),
+    (2018, 100000, 759999, "transition"),
+    (2020, 100000, 760000, "urban"),
+    (2020, 99999, 800000, "transition"),
+    (2020, 150000, 759999, "transition"),
+    # rural: income below 75000 & population below 720000 in 2018 ...
+    (2018, 74999, 719999, "rural"),
+    (2018, 74999, 720000, "transition"),
+    (2018, 75000, 719999, "transition"),
+    (2018, 74999, 725000, "transition"),
+    # ... and below 730000 in the other years
+    (2020, 74999, 729999, "rural"),
+    (2020, 74999, 725000, "rural"),
+    (2020, 74999, 730000, "transition"),
+    (2020, 75000, 700000, "transition"),
+    (2022, 74999, 725000, "rural"),
+    (2022, 74999, 730000, "transition"),
+    (2016, 100000, 760000, "urban"),
+]
+
+@pytest.mark.parametrize("year, income, population, expected", boundary_rows)
+def test_city_type_boundaries(year, income, population, expected):
+    row = {"Year": year, "Median_Household_Income": income, "Pop_Total": population}
+    assert city_type(row) == expected
+    codes = city_type_codes(np.array([income], dtype = float), np.array([population], dtype = float), np.array([year]))
+    assert city_types[codes][0] == expected
+
+def test_city_type_of_mixed_years():
+    # all boundary rows in one call: the thresholds are looked up per row
+    data = pd.DataFrame(boundary_rows, columns = ["Year", "Median_Household_Income", "Pop_Total", "city_type"])
+    codes = city_type_codes(data["Median_Household_Income"].to_numpy(dtype = float), data["Pop_Total"].to_numpy(dtype = float), data["Year"].to_numpy())
+    assert city_types[codes].tolist() == data.apply(city_type, axis = 1).tolist()
+
+# the earlier feature code of analyze_data.py (without the saving)
+def row_wise_features(data):
+    data = data.copy()
+    data["Agesq"] = data["Age"] ** 2
+    data["Edu_Level"] = data["Edu"].map({"Master": 3, "Doctor": 3, "Bachelor": 2, "High_school": 1})
+    data["Master & Above"] = ((data["Edu"] == "Master") | (data["Edu"] == "Doctor")).astype(int)
+    data["College"] = (data["Edu"] == "Bachelor").astype(int)
+    data["High School"] = (data["Edu"] == "High_school").astype(int)
+    data["Republican"] = (data["Party"] == "Republican").astype(int)
+    data["Democratic"] = (data["Party"] == "Democratic").astype(int)
+    data["Other"] = ((data["Party"] == "Green") | (data["Party"] == "No party preference")).astype(int)
+    data["city_type"] = data.apply(city_type, axis = 1)
+    for var in ["Incumbent", "Gender", "city_type"]:
+        data = pd.concat([data, pd.get_dummies(data[var], prefix = var, prefix_sep = "_").astype(int)], axis = 1)
+    data["Age_Group"] = pd.cut(data["Age"], bins = [0, 40, 50, 60, 70, 100], labels = ["<40", "40-50", "50-60", "60-70", ">70"])
+    return data
+
+def test_build_features_matches_row_wise():
+    districts = pd.DataFrame(boundary_rows, columns = ["Year", "Median_Household_Income", "Pop_Total", "city_type"]).drop(columns = "city_type")
+    n = len(districts)
+    data = districts.assign(Age = [35, 40, 41, 50, 55, 60, 61, 70, 71, 45, 38, 66, 52, 49, 80, 30, 58][:n],
+                            Edu = ["Master", "Doctor", "Bachelor", "High_school", None, "Bachelor", "Master", "Doctor", "High_school",
+                                   "Bachelor", None, "Master", "Bachelor", "High_school", "Doctor", "Bachelor", "Master"][:n],
+                            Party = ["Democratic", "Republican", "Green", "No party preference", "Democratic", "Republican", "Libertarian",
+                                     "Democratic", "Republican", "Democratic", "Green", "Republican", "Democratic", None, "Republican", "Democratic", "Democratic"][:n],
+                            Incumbent = ["Yes", "No"] * (n // 2) + ["No"] * (n % 2),
+                            Gender = ["F", "M", "M"] * (n // 3) + ["F"] * (n % 3))
+    pd.testing.assert_frame_equal(build_features(data), row_wise_features(data))
@@ -0,0 +1,32 @@
+# The batched OLS engine must give the coefficients, standard errors and F statistics of statsmodels' OLS(...).fit(cov_type = "HC1")
+import os
+import pytest
+import analyze_data
+from ols_engine import fit_ols, compare_statsmodels, check_statsmodels
+
+
+@pytest.fixture(scope = "module")
+def alldata_CA():
+    return analyze_data.prepare_data(os.path.join(os.path.dirname(__file__), "..", "data", "processed", "CA_final.csv"))
+
+@pytest.mark.parametrize("groups", [3, 4])
+def test_OLS_tables_match_statsmodels(alldata_CA, groups):
+    models = analyze_data.OLS_models(alldata_CA, *analyze_data.score_bins[groups])
+    comparison = check_statsmodels(alldata_CA, models, fit_ols(alldata_CA, models))
+    assert len(comparison) == len(models)
+    assert comparison["columns"].all() and comparison["nobs"].all()
+    assert (comparison[["params", "bse", "F"]] < 1e-6).all().all()
+
+def test_interaction_models_match_statsmodels(alldata_CA):
+    analyze_data.OLS_models(alldata_CA, *analyze_data.score_bins[4])
+    formulas = ["ln_vote_share ~ score_group + C(Incumbent) + score_group:C(Incumbent) + Age + Agesq + C(Gender) + Democratic + C(Year)",
+                "ln_vote_share ~ score_group_CNN + C(Incumbent) + score_group_CNN:C(Incumbent) + Age + Agesq + C(Gender) + C(Edu_Level) + Democratic + C(city_type) + C(Year)"]
+    check_statsmodels(alldata_CA, {formula: (formula, None) for formula in formulas})
+
+def test_check_reports_differences(alldata_CA):
+    models = analyze_data.OLS_models(alldata_CA, *analyze_data.score_bins[3])
+    results = fit_ols(alldata_CA, models)
+    results["Total"] = results["Total"]._replace(bse = results["Total"].bse * 1.01)
+    assert compare_statsmodels(alldata_CA, models, results).set_index("model").loc["Total", "bse"] > 1e-3
+    with pytest.raises(ValueError, match = "differs from statsmodels"):
+        check_statsmodels(alldata_CA, models, results)